@@ -0,0 +1,66 @@
+"""Composite and partial indexes for hot query paths
+
+- storefront product listing (active, optional category, newest first)
+- cart lookups by (user_id, product_id)
+- order detail loads by order_id (items, status history)
+- admin order lists filtered by status / payment_status, sorted by created_at
+
+On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY outside the
+migration transaction, so writes keep flowing while they build. A failed
+concurrent build leaves an INVALID index behind; drop it and re-run.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:30:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+ACTIVE_ONLY = {
+    "sqlite_where": sa.text("is_active = 1"),
+    "postgresql_where": sa.text("is_active"),
+}
+
+# (name, table, columns, extra index kwargs)
+HOT_PATH_INDEXES = [
+    ("ix_products_active_created_at", "products", ["created_at"], ACTIVE_ONLY),
+    ("ix_products_active_category_created_at", "products", ["category", "created_at"], ACTIVE_ONLY),
+    ("ix_products_created_at", "products", ["created_at"], {}),
+    ("ix_cart_items_user_id_product_id", "cart_items", ["user_id", "product_id"], {}),
+    ("ix_order_items_order_id", "order_items", ["order_id"], {}),
+    ("ix_order_status_history_order_id_created_at", "order_status_history", ["order_id", "created_at"], {}),
+    ("ix_orders_created_at", "orders", ["created_at"], {}),
+    ("ix_orders_status_created_at", "orders", ["status", "created_at"], {}),
+    ("ix_orders_payment_status_created_at", "orders", ["payment_status", "created_at"], {}),
+    ("ix_orders_user_id_created_at", "orders", ["user_id", "created_at"], {}),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in HOT_PATH_INDEXES:
+            op.create_index(
+                name, table, columns,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+                **kwargs
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in reversed(HOT_PATH_INDEXES):
+            op.drop_index(
+                name, table_name=table,
+                if_exists=True,
+                postgresql_concurrently=True
+            )
@@ -0,0 +1,141 @@
+"""Persian-aware full-text search index for products
+
+SQLite: FTS5 table products_fts (rowid = products.id) holding normalized
+name/category/slug/description, maintained by triggers on products. The
+triggers normalize in plain SQL, so any SQLite client can write products.
+
+PostgreSQL: generated tsvector column products.search_vector with a GIN index
+built concurrently. Adding a STORED generated column rewrites the products
+table under an exclusive lock, so run this revision in a quiet window on
+large catalogs.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 11:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+FTS_TABLE = "products_fts"
+SEARCH_VECTOR_COLUMN = "search_vector"
+
+# Indexed columns with their tsvector weight label
+SEARCH_COLUMNS = [("name", "A"), ("category", "B"), ("slug", "C"), ("description", "D")]
+COLUMNS = [column for column, _ in SEARCH_COLUMNS]
+
+# app.utils.persian.PERSIAN_CHAR_MAP as of this revision: MAPPED_FROM[i]
+# becomes MAPPED_TO[i], DROPPED characters are removed
+MAPPED_FROM = "يىكةۀؤأإآٱ\u200c" + "".join(chr(0x06F0 + i) for i in range(10)) + "".join(chr(0x0660 + i) for i in range(10))
+MAPPED_TO = "ییکههواااا " + "0123456789" * 2
+DROPPED = "".join(chr(c) for c in range(0x064B, 0x0656)) + "\u0670\u0640\u200d"
+REPLACEMENTS = list(zip(MAPPED_FROM, MAPPED_TO)) + [(char, "") for char in DROPPED]
+# SQLite's parser overflows past ~30 nested calls, so the replace() calls are
+# spread over nested subqueries, this many per level
+REPLACEMENTS_PER_LEVEL = 15
+
+
+def _sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def sqlite_normalized_rows(prefix=""):
+    """
+    SELECT of id and the normalized COLUMNS, for every product (``prefix``
+    empty) or for the row a trigger sees (``prefix`` "new.").
+    normalize_persian as replace() calls, SQLite having no translate().
+    """
+    normalized = ", ".join(f"lower(coalesce({prefix}{column}, '')) AS {column}" for column in COLUMNS)
+    query = f"SELECT {prefix}id AS id, {normalized}" + ("" if prefix else " FROM products")
+    for start in range(0, len(REPLACEMENTS), REPLACEMENTS_PER_LEVEL):
+        expressions = []
+        for column in COLUMNS:
+            expression = column
+            for source, target in REPLACEMENTS[start:start + REPLACEMENTS_PER_LEVEL]:
+                expression = f"replace({expression}, {_sql_literal(source)}, {_sql_literal(target)})"
+            expressions.append(f"{expression} AS {column}")
+        query = f"SELECT id, {', '.join(expressions)} FROM ({query})"
+    return query
+
+
+def postgres_normalize(expression):
+    """normalize_persian as translate(), which deletes characters beyond the end of the target string"""
+    return f"translate(lower(coalesce({expression}, '')), {_sql_literal(MAPPED_FROM + DROPPED)}, {_sql_literal(MAPPED_TO)})"
+
+
+def postgres_search_vector_sql():
+    return " || ".join(
+        f"setweight(to_tsvector('simple', {postgres_normalize(column)}), '{label}')"
+        for column, label in SEARCH_COLUMNS
+    )
+
+
+def create_sqlite_triggers():
+    column_list = ", ".join(COLUMNS)
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+        f"INSERT INTO {FTS_TABLE} (rowid, {column_list}) {sqlite_normalized_rows('new.')}; "
+        f"END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF {column_list} ON products BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"INSERT INTO {FTS_TABLE} (rowid, {column_list}) {sqlite_normalized_rows('new.')}; "
+        f"END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"END"
+    )
+
+
+def drop_sqlite_triggers():
+    op.execute("DROP TRIGGER IF EXISTS products_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS products_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS products_fts_insert")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        column_list = ", ".join(COLUMNS)
+        op.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{column_list}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(f"DELETE FROM {FTS_TABLE}")
+        op.execute(f"INSERT INTO {FTS_TABLE} (rowid, {column_list}) {sqlite_normalized_rows()}")
+        create_sqlite_triggers()
+
+    elif dialect == "postgresql":
+        op.execute(
+            f"ALTER TABLE products ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector "
+            f"GENERATED ALWAYS AS ({postgres_search_vector_sql()}) STORED"
+        )
+        with op.get_context().autocommit_block():
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_search_vector "
+                f"ON products USING gin ({SEARCH_VECTOR_COLUMN})"
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        drop_sqlite_triggers()
+        op.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+    elif dialect == "postgresql":
+        with op.get_context().autocommit_block():
+            op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_products_search_vector")
+        op.execute(f"ALTER TABLE products DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}")
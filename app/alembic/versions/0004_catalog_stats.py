@@ -0,0 +1,79 @@
+"""Summary table for admin dashboard product counters
+
+catalog_stats holds total / active / out-of-stock / low-stock counts for the
+whole catalog and per category, kept up to date incrementally by
+app.utils.catalog_stats. The table is backfilled here from products, with the
+counters as defined at this revision (low stock: 1 to 10 units).
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+COUNTERS = ("total", "active", "out_of_stock", "low_stock")
+LOW_STOCK_THRESHOLD = 10
+
+products = sa.table(
+    "products",
+    sa.column("id", sa.Integer),
+    sa.column("category", sa.String),
+    sa.column("is_active", sa.Boolean),
+    sa.column("stock", sa.Integer),
+)
+catalog_stats = sa.table(
+    "catalog_stats",
+    sa.column("scope", sa.String),
+    sa.column("name", sa.String),
+    *(sa.column(counter, sa.Integer) for counter in COUNTERS),
+)
+
+
+def _backfill():
+    aggregates = [
+        sa.func.count(products.c.id),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.stock <= 0, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case(
+            ((products.c.stock > 0) & (products.c.stock <= LOW_STOCK_THRESHOLD), 1), else_=0
+        )), 0),
+    ]
+    columns = ["scope", "name", *COUNTERS]
+    op.execute(catalog_stats.insert().from_select(
+        columns, sa.select(sa.literal("catalog"), sa.literal(""), *aggregates)
+    ))
+    op.execute(catalog_stats.insert().from_select(
+        columns,
+        sa.select(sa.literal("category"), products.c.category, *aggregates)
+        .where(products.c.category.isnot(None))
+        .group_by(products.c.category)
+    ))
+
+
+def upgrade():
+    op.create_table(
+        "catalog_stats",
+        sa.Column("scope", sa.String(length=20), nullable=False),
+        sa.Column("name", sa.String(length=100), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("active", sa.Integer(), nullable=False),
+        sa.Column("out_of_stock", sa.Integer(), nullable=False),
+        sa.Column("low_stock", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+        sa.PrimaryKeyConstraint("scope", "name"),
+    )
+    _backfill()
+
+
+def downgrade():
+    op.drop_table("catalog_stats")
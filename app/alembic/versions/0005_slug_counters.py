@@ -0,0 +1,57 @@
+"""Per-base slug suffix counters
+
+slug_counters lets app.utils.slugs allocate unique slugs with one atomic
+upsert instead of probing slug, slug-1, slug-2, ... Counters are seeded lazily
+from products the first time a base is used, so nothing is backfilled here.
+
+On PostgreSQL the seeding query is a LIKE 'base-%' prefix match, which the
+unique slug index (default collation) cannot serve; a text_pattern_ops index
+is built concurrently for it. SQLite uses a range scan on the existing index.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+SLUG_PATTERN_INDEX = "ix_products_slug_pattern"
+
+
+def upgrade():
+    op.create_table(
+        "slug_counters",
+        sa.Column("base", sa.String(length=250), nullable=False),
+        sa.Column("next_index", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("base"),
+    )
+
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.create_index(
+                SLUG_PATTERN_INDEX, "products", ["slug"],
+                if_not_exists=True,
+                postgresql_concurrently=True,
+                postgresql_ops={"slug": "text_pattern_ops"}
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        with op.get_context().autocommit_block():
+            op.drop_index(
+                SLUG_PATTERN_INDEX, table_name="products",
+                if_exists=True,
+                postgresql_concurrently=True
+            )
+
+    op.drop_table("slug_counters")
@@ -0,0 +1,30 @@
+"""Responsive image variants for products
+
+products.image_variants holds the WebP/JPEG widths and LQIP placeholder
+generated by app.utils.images. Existing uploads are not processed here (that
+needs the image files, not just the database); run
+``python -m app.utils.images`` after upgrading.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 16:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("products", sa.Column("image_variants", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_column("image_variants")
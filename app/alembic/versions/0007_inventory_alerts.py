@@ -0,0 +1,119 @@
+"""Reorder thresholds and partial indexes for inventory alerts
+
+- products.reorder_threshold / categories.reorder_threshold: configurable
+  thresholds; products.alert_threshold: the effective one, maintained by
+  app.utils.inventory (every existing product starts at the default, as no
+  category has a threshold yet)
+- partial indexes on active products at or below their threshold and at zero
+  stock, built concurrently on PostgreSQL
+- catalog_stats counters for active out-of-stock / low-stock products; the
+  table is rebuilt here with the counters as defined at this revision
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+ALERT_INDEXES = [
+    ("ix_products_stock_alerts", "is_active = 1 AND stock <= alert_threshold", "is_active AND stock <= alert_threshold"),
+    ("ix_products_out_of_stock", "is_active = 1 AND stock <= 0", "is_active AND stock <= 0"),
+]
+
+STATS_COUNTERS = ("total", "active", "out_of_stock", "low_stock", "active_out_of_stock", "active_low_stock")
+
+products = sa.table(
+    "products",
+    sa.column("id", sa.Integer),
+    sa.column("category", sa.String),
+    sa.column("is_active", sa.Boolean),
+    sa.column("stock", sa.Integer),
+    sa.column("alert_threshold", sa.Integer),
+)
+catalog_stats = sa.table(
+    "catalog_stats",
+    sa.column("scope", sa.String),
+    sa.column("name", sa.String),
+    *(sa.column(counter, sa.Integer) for counter in STATS_COUNTERS),
+)
+
+
+def _rebuild_catalog_stats():
+    out_of_stock = products.c.stock <= 0
+    low_stock = (products.c.stock > 0) & (products.c.stock <= products.c.alert_threshold)
+    aggregates = [
+        sa.func.count(products.c.id),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((out_of_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((low_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active & out_of_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active & low_stock, 1), else_=0)), 0),
+    ]
+    columns = ["scope", "name", *STATS_COUNTERS]
+    op.execute(catalog_stats.delete())
+    op.execute(catalog_stats.insert().from_select(
+        columns, sa.select(sa.literal("catalog"), sa.literal(""), *aggregates)
+    ))
+    op.execute(catalog_stats.insert().from_select(
+        columns,
+        sa.select(sa.literal("category"), products.c.category, *aggregates)
+        .where(products.c.category.isnot(None))
+        .group_by(products.c.category)
+    ))
+
+
+def upgrade():
+    op.add_column("products", sa.Column("reorder_threshold", sa.Integer(), nullable=True))
+    op.add_column(
+        "products",
+        sa.Column("alert_threshold", sa.Integer(), nullable=False, server_default=sa.text("10"))
+    )
+    op.add_column("categories", sa.Column("reorder_threshold", sa.Integer(), nullable=True))
+    op.add_column(
+        "catalog_stats",
+        sa.Column("active_out_of_stock", sa.Integer(), nullable=False, server_default=sa.text("0"))
+    )
+    op.add_column(
+        "catalog_stats",
+        sa.Column("active_low_stock", sa.Integer(), nullable=False, server_default=sa.text("0"))
+    )
+    _rebuild_catalog_stats()
+
+    with op.get_context().autocommit_block():
+        for name, sqlite_where, postgresql_where in ALERT_INDEXES:
+            op.create_index(
+                name, "products", ["stock", "id"],
+                if_not_exists=True,
+                postgresql_concurrently=True,
+                sqlite_where=sa.text(sqlite_where),
+                postgresql_where=sa.text(postgresql_where)
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(ALERT_INDEXES):
+            op.drop_index(
+                name, table_name="products",
+                if_exists=True,
+                postgresql_concurrently=True
+            )
+
+    with op.batch_alter_table("catalog_stats") as batch_op:
+        batch_op.drop_column("active_low_stock")
+        batch_op.drop_column("active_out_of_stock")
+    with op.batch_alter_table("categories") as batch_op:
+        batch_op.drop_column("reorder_threshold")
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_column("alert_threshold")
+        batch_op.drop_column("reorder_threshold")
@@ -0,0 +1,150 @@
+"""Link products to categories and nest categories
+
+- categories.parent_id turns the categories into a tree
+- products.category_id references the product's category; products.category
+  stays as the denormalised name. Every distinct name in products gets a
+  categories row (if it has none) and the products are linked to it
+- catalog_stats stock and price sums for the category listings; the table is
+  rebuilt here with the counters as defined at this revision
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 20:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from slugify import slugify
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+categories = sa.table(
+    "categories",
+    sa.column("id", sa.Integer),
+    sa.column("name", sa.String),
+    sa.column("slug", sa.String),
+    sa.column("is_active", sa.Boolean),
+)
+products = sa.table(
+    "products",
+    sa.column("id", sa.Integer),
+    sa.column("category", sa.String),
+    sa.column("category_id", sa.Integer),
+    sa.column("is_active", sa.Boolean),
+    sa.column("stock", sa.Integer),
+    sa.column("alert_threshold", sa.Integer),
+    sa.column("price", sa.BigInteger),
+)
+STATS_COUNTERS = (
+    "total", "active", "out_of_stock", "low_stock", "active_out_of_stock", "active_low_stock",
+    "stock_total", "price_total",
+)
+catalog_stats = sa.table(
+    "catalog_stats",
+    sa.column("scope", sa.String),
+    sa.column("name", sa.String),
+    *(sa.column(counter, sa.BigInteger) for counter in STATS_COUNTERS),
+)
+
+
+def _backfill_categories(connection):
+    existing = {name: slug for name, slug in connection.execute(sa.select(categories.c.name, categories.c.slug))}
+    taken = set(existing.values())
+    names = connection.execute(
+        sa.select(products.c.category).where(products.c.category.isnot(None)).distinct()
+    ).scalars().all()
+
+    rows = []
+    for name in sorted(set(names) - existing.keys()):
+        base = slugify(name, allow_unicode=True) or "category"
+        slug, suffix = base, 1
+        while slug in taken:
+            suffix += 1
+            slug = f"{base}-{suffix}"
+        taken.add(slug)
+        rows.append({"name": name, "slug": slug, "is_active": True})
+    if rows:
+        connection.execute(categories.insert(), rows)
+
+    connection.execute(
+        products.update()
+        .where(products.c.category.isnot(None))
+        .values(category_id=(
+            sa.select(categories.c.id).where(categories.c.name == products.c.category).scalar_subquery()
+        ))
+    )
+
+
+def _rebuild_catalog_stats():
+    out_of_stock = products.c.stock <= 0
+    low_stock = (products.c.stock > 0) & (products.c.stock <= products.c.alert_threshold)
+    aggregates = [
+        sa.func.count(products.c.id),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((out_of_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((low_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active & out_of_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active & low_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(products.c.stock), 0),
+        sa.func.coalesce(sa.func.sum(products.c.price), 0),
+    ]
+    columns = ["scope", "name", *STATS_COUNTERS]
+    op.execute(catalog_stats.delete())
+    op.execute(catalog_stats.insert().from_select(
+        columns, sa.select(sa.literal("catalog"), sa.literal(""), *aggregates)
+    ))
+    op.execute(catalog_stats.insert().from_select(
+        columns,
+        sa.select(sa.literal("category"), products.c.category, *aggregates)
+        .where(products.c.category.isnot(None))
+        .group_by(products.c.category)
+    ))
+
+
+def upgrade():
+    with op.batch_alter_table("categories") as batch_op:
+        batch_op.add_column(sa.Column("parent_id", sa.Integer(), nullable=True))
+        batch_op.create_foreign_key("fk_categories_parent_id", "categories", ["parent_id"], ["id"])
+        batch_op.create_index("ix_categories_parent_id", ["parent_id"])
+
+    if op.get_bind().dialect.name == "sqlite":
+        # Batch mode would copy products and lose 0003's full-text triggers;
+        # SQLite can add a column with an inline REFERENCES clause instead
+        op.execute("ALTER TABLE products ADD COLUMN category_id INTEGER REFERENCES categories (id)")
+    else:
+        op.add_column("products", sa.Column("category_id", sa.Integer(), nullable=True))
+        op.create_foreign_key("fk_products_category_id", "products", "categories", ["category_id"], ["id"])
+    op.create_index("ix_products_category_id", "products", ["category_id"])
+
+    op.add_column(
+        "catalog_stats",
+        sa.Column("stock_total", sa.Integer(), nullable=False, server_default=sa.text("0"))
+    )
+    op.add_column(
+        "catalog_stats",
+        sa.Column("price_total", sa.BigInteger(), nullable=False, server_default=sa.text("0"))
+    )
+
+    _backfill_categories(op.get_bind())
+    _rebuild_catalog_stats()
+
+
+def downgrade():
+    with op.batch_alter_table("catalog_stats") as batch_op:
+        batch_op.drop_column("price_total")
+        batch_op.drop_column("stock_total")
+
+    op.drop_index("ix_products_category_id", table_name="products")
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_column("category_id")
+
+    with op.batch_alter_table("categories") as batch_op:
+        batch_op.drop_index("ix_categories_parent_id")
+        batch_op.drop_constraint("fk_categories_parent_id", type_="foreignkey")
+        batch_op.drop_column("parent_id")
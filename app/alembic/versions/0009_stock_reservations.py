@@ -0,0 +1,56 @@
+"""Stock reservations for unpaid orders
+
+- orders.holds_stock / orders.reserved_until: whether an order's stock is
+  set aside for it, and until when while its payment is pending
+  (app.utils.stock_reservations); existing orders never took stock and
+  start without a reservation
+- partial index on the reservations still awaiting payment, for the expiry
+  sweep, built concurrently on PostgreSQL
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 20:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+RESERVATION_PREDICATE = "reserved_until IS NOT NULL"
+
+
+def upgrade():
+    op.add_column(
+        "orders",
+        sa.Column("holds_stock", sa.Boolean(), nullable=False, server_default=sa.false())
+    )
+    op.add_column("orders", sa.Column("reserved_until", sa.DateTime(timezone=True), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_orders_reserved_until", "orders", ["reserved_until"],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+            sqlite_where=sa.text(RESERVATION_PREDICATE),
+            postgresql_where=sa.text(RESERVATION_PREDICATE)
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_orders_reserved_until", table_name="orders",
+            if_exists=True,
+            postgresql_concurrently=True
+        )
+
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.drop_column("reserved_until")
+        batch_op.drop_column("holds_stock")
@@ -0,0 +1,42 @@
+"""Guest carts
+
+- cart_items.guest_id: lines of a guest's cart, written behind from the
+  guest cart store (app.utils.guest_carts); such lines have no user, so
+  cart_items.user_id becomes nullable and a check constraint requires one
+  owner or the other
+- index on guest_id for reloading, flushing and merging a guest cart
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 22:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can't relax NOT NULL in place; batch mode copies the table
+    with op.batch_alter_table("cart_items") as batch_op:
+        batch_op.add_column(sa.Column("guest_id", sa.String(length=32), nullable=True))
+        batch_op.alter_column("user_id", existing_type=sa.Integer(), nullable=True)
+        batch_op.create_check_constraint("ck_cart_items_owner", "user_id IS NOT NULL OR guest_id IS NOT NULL")
+
+    op.create_index("ix_cart_items_guest_id", "cart_items", ["guest_id"])
+
+
+def downgrade():
+    op.drop_index("ix_cart_items_guest_id", table_name="cart_items")
+    op.execute("DELETE FROM cart_items WHERE user_id IS NULL")
+
+    with op.batch_alter_table("cart_items") as batch_op:
+        batch_op.drop_constraint("ck_cart_items_owner", type_="check")
+        batch_op.alter_column("user_id", existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column("guest_id")
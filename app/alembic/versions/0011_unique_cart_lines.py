@@ -0,0 +1,70 @@
+"""One cart line per product and user
+
+- duplicate (user_id, product_id) lines, left by concurrent adds, are merged
+  into the oldest one, which gets their total quantity
+- the index on (user_id, product_id) becomes unique, so adding to the cart
+  is a single INSERT ... ON CONFLICT DO UPDATE. Guest lines have no user
+  and aren't constrained (NULLs are distinct)
+
+The merge and the unique index share one transaction, so no duplicate can
+be added between them; building the index blocks cart writes meanwhile,
+which cart_items is small enough for.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17 23:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+cart_items = sa.table(
+    "cart_items",
+    sa.column("id", sa.Integer),
+    sa.column("user_id", sa.Integer),
+    sa.column("product_id", sa.Integer),
+    sa.column("quantity", sa.Integer),
+)
+
+
+def _merge_duplicates(connection):
+    lines = cart_items.alias("lines")
+    first_lines = (
+        sa.select(sa.func.min(cart_items.c.id))
+        .where(cart_items.c.user_id.isnot(None))
+        .group_by(cart_items.c.user_id, cart_items.c.product_id)
+    )
+    connection.execute(
+        cart_items.update()
+        .where(cart_items.c.id.in_(first_lines.having(sa.func.count() > 1)))
+        .values(quantity=(
+            sa.select(sa.func.sum(lines.c.quantity))
+            .where(lines.c.user_id == cart_items.c.user_id, lines.c.product_id == cart_items.c.product_id)
+            .scalar_subquery()
+        ))
+    )
+    connection.execute(
+        cart_items.delete()
+        .where(cart_items.c.user_id.isnot(None), cart_items.c.id.notin_(first_lines))
+    )
+
+
+def upgrade():
+    _merge_duplicates(op.get_bind())
+    op.create_index(
+        "uq_cart_items_user_id_product_id", "cart_items", ["user_id", "product_id"], unique=True
+    )
+    op.drop_index("ix_cart_items_user_id_product_id", table_name="cart_items")
+
+
+def downgrade():
+    op.create_index("ix_cart_items_user_id_product_id", "cart_items", ["user_id", "product_id"])
+    op.drop_index("uq_cart_items_user_id_product_id", table_name="cart_items")
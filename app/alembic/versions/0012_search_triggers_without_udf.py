@@ -0,0 +1,93 @@
+"""Products search triggers without the persian_normalize SQL function
+
+Revision 0003 used to create SQLite triggers that normalize products text
+through persian_normalize, a function only connections opened by
+app.database had, so writing products from any other SQLite client failed
+with "no such function". 0003 now creates triggers that normalize in plain
+SQL; this revision puts the same triggers on databases built by the old
+0003. The indexed text is normalized the same way, so products_fts is kept.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18 10:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+FTS_TABLE = "products_fts"
+
+COLUMNS = ["name", "category", "slug", "description"]
+
+# As in revision 0003: MAPPED_FROM[i] becomes MAPPED_TO[i], DROPPED characters are removed
+MAPPED_FROM = "يىكةۀؤأإآٱ\u200c" + "".join(chr(0x06F0 + i) for i in range(10)) + "".join(chr(0x0660 + i) for i in range(10))
+MAPPED_TO = "ییکههواااا " + "0123456789" * 2
+DROPPED = "".join(chr(c) for c in range(0x064B, 0x0656)) + "\u0670\u0640\u200d"
+REPLACEMENTS = list(zip(MAPPED_FROM, MAPPED_TO)) + [(char, "") for char in DROPPED]
+# SQLite's parser overflows past ~30 nested calls, so the replace() calls are
+# spread over nested subqueries, this many per level
+REPLACEMENTS_PER_LEVEL = 15
+
+
+def _sql_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def sqlite_normalized_rows(prefix=""):
+    """
+    SELECT of id and the normalized COLUMNS, for every product (``prefix``
+    empty) or for the row a trigger sees (``prefix`` "new.").
+    normalize_persian as replace() calls, SQLite having no translate().
+    """
+    normalized = ", ".join(f"lower(coalesce({prefix}{column}, '')) AS {column}" for column in COLUMNS)
+    query = f"SELECT {prefix}id AS id, {normalized}" + ("" if prefix else " FROM products")
+    for start in range(0, len(REPLACEMENTS), REPLACEMENTS_PER_LEVEL):
+        expressions = []
+        for column in COLUMNS:
+            expression = column
+            for source, target in REPLACEMENTS[start:start + REPLACEMENTS_PER_LEVEL]:
+                expression = f"replace({expression}, {_sql_literal(source)}, {_sql_literal(target)})"
+            expressions.append(f"{expression} AS {column}")
+        query = f"SELECT id, {', '.join(expressions)} FROM ({query})"
+    return query
+
+
+def _create_triggers():
+    column_list = ", ".join(COLUMNS)
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+        f"INSERT INTO {FTS_TABLE} (rowid, {column_list}) {sqlite_normalized_rows('new.')}; "
+        f"END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF {column_list} ON products BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"INSERT INTO {FTS_TABLE} (rowid, {column_list}) {sqlite_normalized_rows('new.')}; "
+        f"END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+        f"END"
+    )
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    op.execute("DROP TRIGGER IF EXISTS products_fts_delete")
+    op.execute("DROP TRIGGER IF EXISTS products_fts_update")
+    op.execute("DROP TRIGGER IF EXISTS products_fts_insert")
+    _create_triggers()
+
+
+def downgrade():
+    # The triggers 0003 creates are these ones now; nothing to undo
+    pass
@@ -0,0 +1,39 @@
+"""Index products by updated_at
+
+Worker processes using the in-memory search index (SEARCH_BACKEND=memory)
+poll products for rows changed since their last sync; the index keeps that
+poll from scanning the table.
+
+Built with CREATE INDEX CONCURRENTLY on PostgreSQL, as in 0002.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0013'
+down_revision = '0012'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_products_updated_at", "products", ["updated_at"],
+            if_not_exists=True,
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_products_updated_at", table_name="products",
+            if_exists=True,
+            postgresql_concurrently=True
+        )
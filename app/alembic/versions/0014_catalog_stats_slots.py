@@ -0,0 +1,102 @@
+"""Spread each catalog_stats row over slots
+
+Every product write adds to the catalog row, so a single row per (scope, name)
+serialises all writers on its row lock. catalog_stats.slot splits each row
+into CATALOG_STATS_SLOTS rows; a transaction adds its deltas to one slot and
+readers sum them (app.utils.catalog_stats).
+
+The primary key changes, so the table is recreated and rebuilt from products
+(the counters are derived data) rather than altered in place. The rebuild is
+frozen here, as the counters were defined at this revision.
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0014'
+down_revision = '0013'
+branch_labels = None
+depends_on = None
+
+
+COUNTERS = (
+    "total", "active", "out_of_stock", "low_stock", "active_out_of_stock", "active_low_stock",
+    "stock_total", "price_total",
+)
+
+products = sa.table(
+    "products",
+    sa.column("id", sa.Integer),
+    sa.column("category", sa.String),
+    sa.column("is_active", sa.Boolean),
+    sa.column("stock", sa.Integer),
+    sa.column("alert_threshold", sa.Integer),
+    sa.column("price", sa.BigInteger),
+)
+catalog_stats = sa.table(
+    "catalog_stats",
+    sa.column("scope", sa.String),
+    sa.column("name", sa.String),
+    *(sa.column(counter, sa.BigInteger) for counter in COUNTERS),
+)
+
+
+def _rebuild_catalog_stats():
+    """Fill the empty catalog_stats from products; slot is left to its server default"""
+    out_of_stock = products.c.stock <= 0
+    low_stock = (products.c.stock > 0) & (products.c.stock <= products.c.alert_threshold)
+    aggregates = [
+        sa.func.count(products.c.id),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((out_of_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((low_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active & out_of_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(sa.case((products.c.is_active & low_stock, 1), else_=0)), 0),
+        sa.func.coalesce(sa.func.sum(products.c.stock), 0),
+        sa.func.coalesce(sa.func.sum(products.c.price), 0),
+    ]
+    columns = ["scope", "name", *COUNTERS]
+    op.execute(catalog_stats.insert().from_select(
+        columns, sa.select(sa.literal("catalog"), sa.literal(""), *aggregates)
+    ))
+    op.execute(catalog_stats.insert().from_select(
+        columns,
+        sa.select(sa.literal("category"), products.c.category, *aggregates)
+        .where(products.c.category.isnot(None))
+        .group_by(products.c.category)
+    ))
+
+
+def _create_catalog_stats(*key):
+    columns = [
+        sa.Column("scope", sa.String(length=20), nullable=False),
+        sa.Column("name", sa.String(length=100), nullable=False),
+    ]
+    if "slot" in key:
+        columns.append(sa.Column("slot", sa.Integer(), nullable=False, server_default=sa.text("0")))
+    for counter in COUNTERS[:-1]:
+        columns.append(sa.Column(counter, sa.Integer(), nullable=False, server_default=sa.text("0")))
+    columns.append(sa.Column("price_total", sa.BigInteger(), nullable=False, server_default=sa.text("0")))
+    columns.append(
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True)
+    )
+    op.create_table("catalog_stats", *columns, sa.PrimaryKeyConstraint(*key))
+
+
+def upgrade():
+    op.drop_table("catalog_stats")
+    _create_catalog_stats("scope", "name", "slot")
+    # Every counter starts in slot 0
+    _rebuild_catalog_stats()
+
+
+def downgrade():
+    op.drop_table("catalog_stats")
+    _create_catalog_stats("scope", "name")
+    _rebuild_catalog_stats()
@@ -1,16 +1,10 @@
 import asyncio
 import re
 import os
-import hashlib
-import requests
 from typing import Optional, Dict, Any, List
 from datetime import datetime
-from PIL import Image
-import io
 import threading
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 # Telegram Bot imports
 from telegram import Update, Bot
@@ -18,7 +12,10 @@ from telegram.ext import Application, MessageHandler, CommandHandler, filters, C
 from telegram.constants import ParseMode
 
 from app.models import Product, ImportLog
-from app.database import DATABASE_URL
+from app.database import engine, SessionLocal
+from app.utils.slugs import allocate_slug
+from app.utils.images import build_variants
+from app.utils.uploads import store_remote
 import logging
 
 logger = logging.getLogger(__name__)
@@ -40,9 +37,9 @@ class TelegramProductImporter:
             'successful_imports': 0
         }
         
-        # Database session
-        self.engine = create_engine(DATABASE_URL)
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Database session (shares the application's engine and connection pool)
+        self.engine = engine
+        self.SessionLocal = SessionLocal
         
         # Initialize bot application
         self._setup_bot()
@@ -296,6 +293,7 @@ class TelegramProductImporter:
                 
                 if image_url:
                     product_data['image_url'] = image_url
+                    product_data['image_variants'] = await build_variants(image_url)
                 
                 # Save to database
                 success = await self.save_product_to_db(product_data)
@@ -517,6 +515,7 @@ class TelegramProductImporter:
             if hasattr(message, 'photo') and message.photo:
                 photo = message.photo[-1]  # Get highest resolution
                 product_data['image_url'] = await self.process_telegram_image(photo)
+                product_data['image_variants'] = await build_variants(product_data['image_url'])
             
             # Extract stock info if mentioned
             stock_patterns = [
@@ -546,8 +545,15 @@ class TelegramProductImporter:
     async def process_image(self, photo_data: Dict[str, Any]) -> str:
         """Process and save product image"""
         try:
-            # In a real implementation, we would download the image from Telegram
-            # For simulation, we return a placeholder
+            # Webhook updates carry every size of the photo; the last is the largest
+            photo = photo_data[-1] if isinstance(photo_data, list) else photo_data
+            if self.application and photo.get('file_id'):
+                file_info = await self.application.bot.get_file(photo['file_id'])
+                image_url = await self.download_and_save_image(file_info)
+                if image_url:
+                    return image_url
+            
+            # Bot not configured (or download failed): placeholder
             return '/static/products/telegram_import_placeholder.jpg'
             
         except Exception as e:
@@ -571,42 +577,15 @@ class TelegramProductImporter:
             # Get the full file URL from Telegram
             file_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_info.file_path}"
             
-            # Download the image
-            response = requests.get(file_url)
-            if response.status_code == 200:
-                # Create unique filename
-                file_ext = file_info.file_path.split('.')[-1] or 'jpg'
-                filename = f"telegram_{hashlib.md5(file_info.file_path.encode()).hexdigest()[:10]}.{file_ext}"
-                
-                # Create products directory
-                products_dir = os.path.join(os.getcwd(), 'static', 'products')
-                os.makedirs(products_dir, exist_ok=True)
-                
-                # Save file
-                file_path = os.path.join(products_dir, filename)
-                
-                with open(file_path, 'wb') as f:
-                    f.write(response.content)
-                
-                # Optionally process image (resize, optimize)
-                try:
-                    with Image.open(file_path) as img:
-                        # Resize if too large
-                        if img.width > 800 or img.height > 800:
-                            img.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                            img.save(file_path, optimize=True, quality=85)
-                except Exception as img_error:
-                    logger.warning(f"Image processing failed: {img_error}")
-                
-                return f'/static/products/{filename}'
-            else:
-                logger.error(f"Failed to download image: HTTP {response.status_code}")
+            # Streamed into the content-addressed upload store; resized
+            # variants are built from it by app.utils.images
+            return await store_remote(file_url)
             
         except Exception as e:
             logger.error(f"Error downloading image: {str(e)}")
         
         return ''
-
+    
     async def extract_product_data(self, message_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Extract product data from webhook message data"""
         try:
@@ -677,6 +656,7 @@ class TelegramProductImporter:
             # Handle images from webhook data
             if message_data.get('photo'):
                 product_data['image_url'] = await self.process_image(message_data['photo'])
+                product_data['image_variants'] = await build_variants(product_data['image_url'])
             
             # Generate description
             description_lines = []
@@ -728,15 +708,7 @@ class TelegramProductImporter:
                 logger.info(f"Updated existing product: {product_data['name']}")
             else:
                 # Ensure unique slug
-                base_slug = product_data['slug']
-                slug = base_slug
-                counter = 1
-                
-                while db.query(Product).filter(Product.slug == slug).first():
-                    slug = f"{base_slug}-{counter}"
-                    counter += 1
-                
-                product_data['slug'] = slug
+                product_data['slug'] = allocate_slug(db, product_data['slug'])
                 
                 # Create new product
                 new_product = Product(
@@ -746,6 +718,7 @@ class TelegramProductImporter:
                     price=product_data['price'],
                     currency=product_data['currency'],
                     image_url=product_data['image_url'],
+                    image_variants=product_data.get('image_variants'),
                     slug=product_data['slug'],
                     stock=product_data['stock'],
                     is_active=product_data['is_active']
@@ -0,0 +1,120 @@
+"""
+Catalog cache.
+
+Read-mostly catalog responses (product lists and details, category
+aggregates, banners) are cached in two tiers: a per-process LRU (L1) and an
+optional shared backend (L2, Redis or a local stand-in). Entries are tagged and
+invalidated when a session commits writes to the tagged rows; concurrent
+misses for the same key share one query, and expired entries are served while
+a background refresh runs (or when the database fails).
+
+Invalidations reach other worker processes only through a shared L2 (Redis).
+Without one, a worker would keep serving entries another worker invalidated,
+so when WEB_CONCURRENCY says there are several workers caching is turned off.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Callable, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from app.cache.backends import LocalBackend, create_l2_backend
+from app.cache.invalidation import (  # noqa: F401  (re-exported for routers)
+    BANNERS_TAG,
+    CATEGORIES_TAG,
+    PRODUCT_ROWS_TAG,
+    PRODUCTS_TAG,
+    install,
+    product_tag,
+    product_tags,
+    queue_tags,
+    slug_tag,
+)
+from app.cache.tiered import TieredCache
+from app.database import RoutingSession, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_L1_MAX_ENTRIES = int(os.getenv("CACHE_L1_MAX_ENTRIES", "2048"))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "60"))
+CACHE_STALE_TTL = float(os.getenv("CACHE_STALE_TTL", "300"))
+CACHE_L2 = os.getenv("CACHE_L2", "none").lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT", "0.2"))
+CACHE_TAG_SYNC_INTERVAL = float(os.getenv("CACHE_TAG_SYNC_INTERVAL", "1"))
+CACHE_SLUG_MAX_ENTRIES = int(os.getenv("CACHE_SLUG_MAX_ENTRIES", "10000"))
+CACHE_SLUG_TTL = float(os.getenv("CACHE_SLUG_TTL", "300"))
+CACHE_SLUG_NEGATIVE_TTL = float(os.getenv("CACHE_SLUG_NEGATIVE_TTL", "30"))
+# Worker processes serving the app; uvicorn and gunicorn take their worker count from it
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+shared_l2 = create_l2_backend(CACHE_L2, CACHE_REDIS_URL, CACHE_REDIS_TIMEOUT) if CACHE_ENABLED else None
+if CACHE_ENABLED and WEB_CONCURRENCY > 1 and (shared_l2 is None or isinstance(shared_l2, LocalBackend)):
+    logger.warning(
+        f"Catalog cache disabled: {WEB_CONCURRENCY} workers but no shared L2 to carry invalidations "
+        f"between them (set CACHE_L2=redis)"
+    )
+    CACHE_ENABLED = False
+    shared_l2 = None
+
+catalog_cache = TieredCache(
+    l2=shared_l2,
+    max_entries=CACHE_L1_MAX_ENTRIES,
+    default_ttl=CACHE_DEFAULT_TTL,
+    stale_ttl=CACHE_STALE_TTL,
+    tag_sync_interval=CACHE_TAG_SYNC_INTERVAL,
+    enabled=CACHE_ENABLED,
+)
+
+# Product detail by slug: entries stay in process, so bursts on one hot product
+# (e.g. a link shared on Telegram) are served from memory; misses are cached
+# too. Tag versions go through L2 so the other workers' invalidations apply
+product_slug_cache = TieredCache(
+    l2=shared_l2,
+    l2_entries=False,
+    max_entries=CACHE_SLUG_MAX_ENTRIES,
+    default_ttl=CACHE_SLUG_TTL,
+    stale_ttl=0,
+    negative_ttl=CACHE_SLUG_NEGATIVE_TTL,
+    tag_sync_interval=CACHE_TAG_SYNC_INTERVAL,
+    enabled=CACHE_ENABLED,
+)
+
+# RoutingSession backs both SessionLocal and the async sessions
+install(RoutingSession, catalog_cache, product_slug_cache)
+
+
+def cache_key(prefix: str, **params) -> str:
+    """Stable key for ``prefix`` and request parameters"""
+    if not params:
+        return prefix
+    encoded = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return f"{prefix}:{hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:20]}"
+
+
+def cached_read(
+    db: Session,
+    key: str,
+    load: Callable[[Session], Any],
+    tags: Iterable[str] = (),
+    ttl: Optional[float] = None,
+) -> Any:
+    """
+    ``load(db)`` through the catalog cache.
+
+    Misses run in the request's session; background refreshes of expired
+    entries get a session of their own.
+    """
+    def refresh():
+        session = SessionLocal()
+        try:
+            return load(session)
+        finally:
+            session.close()
+
+    return catalog_cache.get_or_load(key, lambda: load(db), tags=tags, ttl=ttl, refresh=refresh)
+
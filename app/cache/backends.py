@@ -0,0 +1,149 @@
+"""
+Storage layers for app.cache.
+
+L1 is a per-process LRU with TTL. L2 is optional and shared between worker
+processes: Redis (or anything speaking its protocol) in production, or
+``LocalBackend``, an in-process stand-in with the same small interface for
+development and single-process deployments.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    """A cached value with the tag versions it was computed under"""
+    value: Any
+    tags: Dict[str, int] = field(default_factory=dict)
+    fresh_until: float = 0.0
+    stale_until: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"v": self.value, "t": self.tags, "f": self.fresh_until, "s": self.stale_until}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CacheEntry":
+        return cls(data["v"], data.get("t") or {}, data.get("f", 0.0), data.get("s", 0.0))
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU of CacheEntry objects; drops entries past their stale window"""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.stale_until <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LocalBackend:
+    """
+    In-process stand-in for the Redis commands the cache uses
+    (GET, SET EX, MGET, INCR, DELETE).
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+            return False
+        return key in self._data
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            return self._data[key] if self._alive(key) else None
+
+    def mget(self, keys: Iterable[str]) -> List[Optional[bytes]]:
+        with self._lock:
+            return [self._data[key] if self._alive(key) else None for key in keys]
+
+    def set(self, key: str, value: bytes, ex: Optional[int] = None):
+        with self._lock:
+            self._data[key] = value
+            if ex:
+                self._expires[key] = time.time() + ex
+            else:
+                self._expires.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            value = int(self._data[key]) + 1 if self._alive(key) else 1
+            self._data[key] = str(value).encode()
+            return value
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+
+
+def create_l2_backend(kind: str, redis_url: str, timeout: float):
+    """
+    Shared backend for ``kind`` ("redis", "local" or "none").
+
+    Falls back to LocalBackend when Redis is requested but the client library
+    is missing, so a development box without Redis still starts.
+    """
+    if kind == "none":
+        return None
+    if kind == "local":
+        return LocalBackend()
+    if kind == "redis":
+        try:
+            import redis
+        except ImportError:
+            logger.warning("CACHE_L2=redis but the redis package is not installed; using the local stand-in")
+            return LocalBackend()
+        return redis.Redis.from_url(
+            redis_url,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+        )
+    raise ValueError(f"Unknown CACHE_L2 backend: {kind}")
@@ -0,0 +1,109 @@
+"""
+Cache tags for catalog data and the session hooks that invalidate them.
+
+Writes are picked up from session events rather than at each call site, so
+every writer that goes through SessionLocal / the async sessions - the
+routers, ProductImportProcessor and the Telegram importer - invalidates the
+cache, and only once its transaction has committed.
+"""
+
+from typing import Iterable, Set
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from app.models import Banner, Category, Product
+
+# Product lists, category aggregates and banner lists
+PRODUCTS_TAG = "products"
+CATEGORIES_TAG = "categories"
+BANNERS_TAG = "banners"
+# Every single-product entry; bumped by bulk statements that don't name rows
+PRODUCT_ROWS_TAG = "product-rows"
+
+_PENDING_KEY = "cache_pending_tags"
+
+
+def product_tag(product_id: int) -> str:
+    return f"product:{product_id}"
+
+
+def slug_tag(slug: str) -> str:
+    return f"slug:{slug}"
+
+
+def product_tags(product_ids: Iterable[int], slugs: Iterable[str] = ()) -> Set[str]:
+    """Tags to invalidate after writing the given products (and slugs they took or gave up)"""
+    tags = {PRODUCTS_TAG, CATEGORIES_TAG}
+    tags.update(product_tag(product_id) for product_id in product_ids)
+    tags.update(slug_tag(slug) for slug in slugs if slug)
+    return tags
+
+
+def tags_for(obj) -> Set[str]:
+    if isinstance(obj, Product):
+        # Old and new slug: a rename frees one slug and takes another
+        slugs = {obj.slug, *sa_inspect(obj).attrs.slug.history.deleted}
+        return product_tags([obj.id], slugs)
+    if isinstance(obj, Banner):
+        return {BANNERS_TAG}
+    if isinstance(obj, Category):
+        return {CATEGORIES_TAG}
+    return set()
+
+
+def queue_tags(session, tags: Iterable[str]):
+    """Invalidate ``tags`` when ``session`` commits (for writes the hooks can't see)"""
+    session.info.setdefault(_PENDING_KEY, set()).update(tags)
+
+
+# Tags for UPDATE/DELETE statements issued through the ORM without loading rows
+_BULK_TAGS = {
+    Product: {PRODUCTS_TAG, CATEGORIES_TAG, PRODUCT_ROWS_TAG},
+    Banner: {BANNERS_TAG},
+    Category: {CATEGORIES_TAG},
+}
+
+
+def _load_previous_slug(target, value, oldvalue, initiator):
+    """No-op; registered with active_history=True for its side effect"""
+
+
+def install(session_class, *caches):
+    """Invalidate ``caches`` after commits that wrote catalog rows through ``session_class``"""
+
+    # Renaming an expired product must still load the slug it gives up
+    event.listen(Product.slug, "set", _load_previous_slug, active_history=True)
+
+    @event.listens_for(session_class, "before_flush")
+    def collect_deleted_tags(session, flush_context, instances):
+        # Before the DELETE, while an expired row can still be loaded
+        pending = session.info.setdefault(_PENDING_KEY, set())
+        for obj in session.deleted:
+            pending.update(tags_for(obj))
+
+    @event.listens_for(session_class, "after_flush")
+    def collect_tags(session, flush_context):
+        # After the INSERT/UPDATE, once new rows have their ids
+        pending = session.info.setdefault(_PENDING_KEY, set())
+        for obj in session.new | session.dirty:
+            pending.update(tags_for(obj))
+
+    @event.listens_for(session_class, "do_orm_execute")
+    def collect_bulk_tags(orm_execute_state):
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        mapper = orm_execute_state.bind_mapper
+        tags = _BULK_TAGS.get(mapper.class_) if mapper is not None else None
+        if tags:
+            orm_execute_state.session.info.setdefault(_PENDING_KEY, set()).update(tags)
+
+    @event.listens_for(session_class, "after_commit")
+    def invalidate_tags(session):
+        pending = session.info.pop(_PENDING_KEY, None)
+        if pending:
+            for cache in caches:
+                cache.invalidate(pending)
+
+    @event.listens_for(session_class, "after_rollback")
+    def discard_tags(session):
+        session.info.pop(_PENDING_KEY, None)
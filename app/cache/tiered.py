@@ -0,0 +1,297 @@
+"""
+Two-tier cache with tag invalidation, single-flight loading and
+stale-while-revalidate.
+
+Every entry records the version of each of its tags at the time its value was
+*read from the database*. Invalidating a tag bumps its version (in L2 when
+there is one, so all processes see it), which makes every entry carrying the
+tag invalid without having to find those entries. Tag versions are re-read
+from L2 at most every ``tag_sync_interval`` seconds per tag, which bounds how
+long another process can keep serving an invalidated L1 entry. A cache whose
+entries are too hot or too small to be worth a round trip can keep them in L1
+and use L2 for tag versions only (``l2_entries=False``).
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from app.cache.backends import CacheEntry, LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """A load in progress that concurrent callers for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class TieredCache:
+    """L1 LRU in front of an optional shared L2 backend"""
+
+    def __init__(
+        self,
+        l2=None,
+        max_entries: int = 2048,
+        default_ttl: float = 60,
+        stale_ttl: float = 300,
+        tag_sync_interval: float = 1.0,
+        load_timeout: float = 30,
+        refresh_workers: int = 2,
+        key_prefix: str = "ishop:cache:",
+        enabled: bool = True,
+        negative_ttl: Optional[float] = None,
+        l2_entries: bool = True,
+    ):
+        self.l1 = LRUCache(max_entries)
+        self.l2 = l2
+        self.l2_entries = l2_entries
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.tag_sync_interval = tag_sync_interval
+        self.load_timeout = load_timeout
+        self.key_prefix = key_prefix
+        self.enabled = enabled
+        self.negative_ttl = negative_ttl
+
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._tag_versions: Dict[str, int] = {}
+        self._tag_synced_at: Dict[str, float] = {}
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="cache-refresh")
+        self._stats = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "stale_served": 0,
+            "stale_fallbacks": 0,
+            "coalesced": 0,
+            "loads": 0,
+            "load_errors": 0,
+            "refreshes": 0,
+            "invalidations": 0,
+            "l2_errors": 0,
+        }
+
+    # Tags ---------------------------------------------------------------
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self.key_prefix}tag:{tag}"
+
+    def _versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        """Current version of each tag, refreshed from L2 when the local copy is old"""
+        tags = sorted(set(tags))
+        if self.l2 is not None and tags:
+            now = time.time()
+            stale = [tag for tag in tags if now - self._tag_synced_at.get(tag, 0.0) > self.tag_sync_interval]
+            if stale:
+                try:
+                    remote = self.l2.mget([self._tag_key(tag) for tag in stale])
+                except Exception as e:
+                    self._count("l2_errors")
+                    logger.warning(f"Cache L2 unavailable reading tag versions: {e}")
+                else:
+                    with self._lock:
+                        for tag, raw in zip(stale, remote):
+                            self._tag_versions[tag] = max(self._tag_versions.get(tag, 0), int(raw or 0))
+                            self._tag_synced_at[tag] = now
+        return {tag: self._tag_versions.get(tag, 0) for tag in tags}
+
+    def invalidate(self, tags: Iterable[str]):
+        """Invalidate every entry carrying any of ``tags``, in this and (through L2) other processes"""
+        tags = set(tags)
+        if not tags:
+            return
+        for tag in tags:
+            version = None
+            if self.l2 is not None:
+                try:
+                    version = int(self.l2.incr(self._tag_key(tag)))
+                except Exception as e:
+                    self._count("l2_errors")
+                    logger.warning(f"Cache L2 unavailable invalidating {tag}: {e}")
+            with self._lock:
+                current = self._tag_versions.get(tag, 0)
+                self._tag_versions[tag] = max(current + 1, version or 0)
+        self._count("invalidations", len(tags))
+
+    # Entries -------------------------------------------------------------
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _read(self, key: str) -> Tuple[Optional[CacheEntry], str]:
+        """Entry for ``key`` and the layer it came from"""
+        entry = self.l1.get(key)
+        if entry is not None or self.l2 is None or not self.l2_entries:
+            return entry, "l1"
+        try:
+            raw = self.l2.get(self.key_prefix + key)
+        except Exception as e:
+            self._count("l2_errors")
+            logger.warning(f"Cache L2 unavailable reading {key}: {e}")
+            return None, "l2"
+        if raw is None:
+            return None, "l2"
+        entry = CacheEntry.from_dict(json.loads(raw))
+        if entry.stale_until <= time.time():
+            return None, "l2"
+        self.l1.set(key, entry)
+        return entry, "l2"
+
+    def _write(self, key: str, entry: CacheEntry):
+        self.l1.set(key, entry)
+        if self.l2 is None or not self.l2_entries:
+            return
+        try:
+            ttl = max(1, int(entry.stale_until - time.time()) + 1)
+            payload = json.dumps(entry.to_dict(), ensure_ascii=False, separators=(",", ":"), default=str)
+            self.l2.set(self.key_prefix + key, payload.encode("utf-8"), ex=ttl)
+        except Exception as e:
+            self._count("l2_errors")
+            logger.warning(f"Cache L2 unavailable writing {key}: {e}")
+
+    def delete(self, key: str):
+        self.l1.delete(key)
+        if self.l2 is not None and self.l2_entries:
+            try:
+                self.l2.delete(self.key_prefix + key)
+            except Exception as e:
+                self._count("l2_errors")
+                logger.warning(f"Cache L2 unavailable deleting {key}: {e}")
+
+    def clear(self):
+        """Drop this process's L1 and forget the tag versions it has seen"""
+        self.l1.clear()
+        with self._lock:
+            self._tag_synced_at.clear()
+
+    # Loading ------------------------------------------------------------
+
+    def _load(self, key, loader, tags, ttl, stale_ttl, negative_ttl, fallback: Optional[CacheEntry]):
+        """Run ``loader`` once per key across concurrent callers (single-flight)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            if not flight.done.wait(self.load_timeout):
+                raise TimeoutError(f"Timed out waiting for cache load of {key}")
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            # Snapshot tag versions before reading: a write that commits while
+            # the loader runs bumps a version and makes this entry invalid
+            versions = self._versions(tags)
+            self._count("loads")
+            try:
+                value = loader()
+            except Exception as e:
+                self._count("load_errors")
+                if fallback is not None and fallback.stale_until > time.time():
+                    # Database slow or down: keep serving what we had
+                    logger.warning(f"Serving stale cache entry for {key}: {e}")
+                    self._count("stale_fallbacks")
+                    flight.value = fallback.value
+                    return fallback.value
+                flight.error = e
+                raise
+            now = time.time()
+            if value is not None:
+                self._write(key, CacheEntry(value, versions, now + ttl, now + ttl + stale_ttl))
+            elif negative_ttl:
+                # Remember the miss so repeated lookups of a missing key skip the database
+                self._write(key, CacheEntry(None, versions, now + negative_ttl, now + negative_ttl))
+            flight.value = value
+            return value
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _refresh_in_background(self, key, refresh, tags, ttl, stale_ttl, negative_ttl, entry):
+        with self._lock:
+            if key in self._flights:
+                return
+
+        def run():
+            try:
+                self._load(key, refresh, tags, ttl, stale_ttl, negative_ttl, entry)
+                self._count("refreshes")
+            except Exception as e:
+                logger.warning(f"Background refresh of {key} failed: {e}")
+
+        self._refresher.submit(run)
+
+    def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Any],
+        tags: Iterable[str] = (),
+        ttl: Optional[float] = None,
+        stale_ttl: Optional[float] = None,
+        refresh: Optional[Callable[[], Any]] = None,
+        negative_ttl: Optional[float] = None,
+    ) -> Any:
+        """
+        Cached value for ``key``, computed with ``loader`` on a miss.
+
+        ``loader`` must return JSON-serializable data. None means "not found"
+        and is only cached when ``negative_ttl`` is set (per call or on the
+        cache), for that many seconds. Entries older than ``ttl`` are served for another ``stale_ttl``
+        seconds while ``refresh`` (a loader that is safe to call from a
+        background thread, i.e. that opens its own session) recomputes them;
+        without ``refresh`` they are recomputed in the foreground, falling back
+        to the stale value if that fails.
+        """
+        if not self.enabled:
+            return loader()
+
+        ttl = self.default_ttl if ttl is None else ttl
+        stale_ttl = self.stale_ttl if stale_ttl is None else stale_ttl
+        negative_ttl = self.negative_ttl if negative_ttl is None else negative_ttl
+        tags = tuple(tags)
+
+        entry, layer = self._read(key)
+        if entry is not None and entry.tags == self._versions(tags):
+            now = time.time()
+            if now < entry.fresh_until:
+                self._count(f"{layer}_hits")
+                if entry.value is None:
+                    self._count("negative_hits")
+                return entry.value
+            if refresh is not None and now < entry.stale_until:
+                self._count("stale_served")
+                self._refresh_in_background(key, refresh, tags, ttl, stale_ttl, negative_ttl, entry)
+                return entry.value
+
+        self._count("misses")
+        return self._load(key, loader, tags, ttl, stale_ttl, negative_ttl, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["l1_hits"] + stats["l2_hits"] + stats["stale_served"] + stats["misses"]
+        hits = lookups - stats["misses"]
+        stats.update({
+            "enabled": self.enabled,
+            "l2": type(self.l2).__name__ if self.l2 is not None else None,
+            "l1_entries": len(self.l1),
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+        })
+        return stats
@@ -82,6 +82,8 @@ class SecuritySettings(BaseSettings):
     class Config:
         env_file = ".env"
         env_prefix = "SECURITY_"
+        # .env holds every other setting of the app too
+        extra = "ignore"
 
 
 # Password validation regex patterns
@@ -1,30 +1,678 @@
+import asyncio
+import itertools
 import os
-from sqlalchemy import create_engine
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.requests import Request
+
+from app.config.security import SecuritySettings
 
 # Database URL - use environment variable or default to SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./ishop.db")
 
-# Handle different database URL formats
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
+settings = SecuritySettings()
+
+# SQLite connection profile: "production" enables WAL and the pragmas below plus
+# serialized writes; "default" leaves SQLite's stock behaviour untouched
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, i.e. 64MB
+}
+
+# Serialized writer tuning
+SQLITE_WRITE_LOCK_TIMEOUT = float(os.getenv("SQLITE_WRITE_LOCK_TIMEOUT", "10"))
+SQLITE_WRITE_MAX_RETRIES = int(os.getenv("SQLITE_WRITE_MAX_RETRIES", "5"))
+SQLITE_WRITE_BACKOFF_BASE = float(os.getenv("SQLITE_WRITE_BACKOFF_BASE", "0.01"))
+SQLITE_WRITE_BACKOFF_MAX = float(os.getenv("SQLITE_WRITE_BACKOFF_MAX", "0.5"))
+
+# Read replicas - comma separated URLs; read-only requests are spread across them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# Seconds a client keeps reading from the primary after it wrote (read-your-writes)
+DB_READ_AFTER_WRITE_WINDOW = float(os.getenv("DB_READ_AFTER_WRITE_WINDOW", "5"))
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records checkout wait time and timeouts"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_time_total += waited
+                self.wait_time_max = max(self.wait_time_max, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            checkouts = self.checkouts
+            return {
+                "pool_size": self.size(),
+                "max_overflow": self._max_overflow,
+                "timeout": self.timeout(),
+                "checked_out": self.checkedout(),
+                "checked_in": self.checkedin(),
+                "overflow": max(self.overflow(), 0),
+                "checkouts": checkouts,
+                "timeouts": self.timeouts,
+                "wait_time_total_ms": round(self.wait_time_total * 1000, 3),
+                "wait_time_avg_ms": round(self.wait_time_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max * 1000, 3),
+            }
+
+
+class InstrumentedAsyncQueuePool(InstrumentedQueuePool, AsyncAdaptedQueuePool):
+    """Instrumented pool for asyncio engines"""
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the production pragmas to every new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma}={value}")
+    finally:
+        cursor.close()
+
+
+def _async_url(url: str) -> URL:
+    """Map a sync DATABASE_URL onto the matching asyncio driver"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite")
+    if backend == "postgresql":
+        return parsed.set(drivername="postgresql+asyncpg")
+    return parsed
+
+
+def _build_engine(url: str, use_async: bool = False):
+    """Create an engine for ``url`` using the pool settings from SecuritySettings"""
+    parsed = _async_url(url) if use_async else make_url(url)
+    create = create_async_engine if use_async else create_engine
+    pool_args = {
+        "poolclass": InstrumentedAsyncQueuePool if use_async else InstrumentedQueuePool,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+    }
+
+    # Handle different database URL formats
+    if parsed.get_backend_name() == "sqlite":
+        connect_args = {} if use_async else {"check_same_thread": False}
+        in_memory = parsed.database in (None, "", ":memory:")
+        if in_memory:
+            # In-memory databases live inside a single connection; keep SQLAlchemy's default pool
+            sqlite_engine = create(parsed, connect_args=connect_args)
+        else:
+            sqlite_engine = create(parsed, connect_args=connect_args, **pool_args)
+        sync_engine = sqlite_engine.sync_engine if use_async else sqlite_engine
+        if SQLITE_PROFILE == "production" and not in_memory:
+            event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+
     # For PostgreSQL, handle SSL configuration
     connect_args = {}
-    if DATABASE_URL.startswith("postgresql"):
-        # Add SSL configuration for PostgreSQL
-        connect_args = {"sslmode": "prefer"}
-    engine = create_engine(DATABASE_URL, connect_args=connect_args, pool_pre_ping=True)
+    if parsed.get_backend_name() == "postgresql":
+        # Add SSL configuration for PostgreSQL (asyncpg spells it "ssl")
+        connect_args = {"ssl": "prefer"} if use_async else {"sslmode": "prefer"}
+    return create(parsed, connect_args=connect_args, pool_pre_ping=True, **pool_args)
+
+
+# Engine registry - one engine (and therefore one pool) per URL per process,
+# shared by the API, the Telegram bot and the CLI tools
+_engines: Dict[str, Engine] = {}
+_async_engines: Dict[str, AsyncEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url: Optional[str] = None) -> Engine:
+    """Return the shared engine for ``url`` (defaults to DATABASE_URL), creating it once"""
+    url = url or DATABASE_URL
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _build_engine(url)
+            _engines[url] = engine
+        return engine
+
+
+def get_async_engine(url: Optional[str] = None) -> AsyncEngine:
+    """Return the shared asyncio engine for ``url`` (aiosqlite / asyncpg)"""
+    url = url or DATABASE_URL
+    with _engines_lock:
+        engine = _async_engines.get(url)
+        if engine is None:
+            engine = _build_engine(url, use_async=True)
+            _async_engines[url] = engine
+        return engine
+
+
+def get_pool_stats() -> List[Dict[str, Any]]:
+    """Live pool statistics for every engine in this process"""
+    with _engines_lock:
+        engines = list(_engines.values()) + list(_async_engines.values())
+
+    stats = []
+    for registered in engines:
+        entry = {
+            "url": registered.url.render_as_string(hide_password=True),
+            "pid": os.getpid(),
+            "pool_class": type(registered.pool).__name__,
+        }
+        if isinstance(registered.pool, InstrumentedQueuePool):
+            entry.update(registered.pool.stats())
+        stats.append(entry)
+    return stats
+
+
+def _set_sqlite_query_only(dbapi_connection, connection_record):
+    """Replica connections never write"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA query_only=1")
+    finally:
+        cursor.close()
+
+
+def get_replica_engine(url: str, use_async: bool = False):
+    """
+    Shared engine for a read replica, configured for cheap read-only work:
+    PostgreSQL runs in autocommit with read-only transactions, so no
+    BEGIN/COMMIT round trips or write locks; SQLite replicas are query_only.
+    """
+    replica = get_async_engine(url) if use_async else get_engine(url)
+    if replica.dialect.name == "postgresql":
+        return replica.execution_options(isolation_level="AUTOCOMMIT", postgresql_readonly=True)
+    if replica.dialect.name == "sqlite":
+        sync_engine = replica.sync_engine if use_async else replica
+        if not event.contains(sync_engine, "connect", _set_sqlite_query_only):
+            event.listen(sync_engine, "connect", _set_sqlite_query_only)
+    return replica
+
+
+class ReplicaRouter:
+    """
+    Chooses the engine for a session: writes and anything following a write go
+    to the primary, read-only sessions are spread round-robin over replicas.
+    A client that committed a write keeps reading from the primary for
+    ``window`` seconds so it always sees its own changes.
+    """
+
+    def __init__(self, primary: Engine, replicas: List[Engine], window: float = DB_READ_AFTER_WRITE_WINDOW):
+        self.primary = primary
+        self.replicas = replicas
+        self.window = window
+        self._next_replica = itertools.cycle(replicas) if replicas else None
+        self._recent_writes: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.counters = {"primary_reads": 0, "replica_reads": 0, "sticky_reads": 0, "writes": 0}
+
+    def mark_write(self, client_key: Optional[str]):
+        now = time.monotonic()
+        with self._lock:
+            self.counters["writes"] += 1
+            if not client_key:
+                return
+            self._recent_writes[client_key] = now + self.window
+            if len(self._recent_writes) > 10000:
+                self._recent_writes = {key: until for key, until in self._recent_writes.items() if until > now}
+
+    def engine_for_read(self, client_key: Optional[str]) -> Engine:
+        with self._lock:
+            until = self._recent_writes.get(client_key) if client_key else None
+            if until is not None and until > time.monotonic():
+                self.counters["sticky_reads"] += 1
+                return self.primary
+            if self._next_replica is None:
+                self.counters["primary_reads"] += 1
+                return self.primary
+            self.counters["replica_reads"] += 1
+            return next(self._next_replica)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+        counters["replicas"] = [replica.url.render_as_string(hide_password=True) for replica in self.replicas]
+        counters["read_after_write_window"] = self.window
+        return counters
+
+
+class RoutingSession(Session):
+    """Session that sends read-only work to replicas via ``router``"""
+
+    router: Optional[ReplicaRouter] = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        router = self.router
+        if router is None or not self.info.get("read_only") or self.info.get("wrote") or self._flushing:
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+        if "read_engine" not in self.info:
+            # Pin one engine per session so a request sees a single snapshot
+            self.info["read_engine"] = router.engine_for_read(self.info.get("client_key"))
+        return self.info["read_engine"]
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def _routing_before_flush(session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _routing_do_orm_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _routing_after_commit(session):
+    if session.info.pop("wrote", False) and session.router is not None:
+        session.info.pop("read_engine", None)
+        session.router.mark_write(session.info.get("client_key"))
+
+
+def read_only(endpoint):
+    """Mark a non-GET endpoint as read-only so its sessions may use a replica"""
+    endpoint.__db_read_only__ = True
+    return endpoint
+
+
+def read_write(endpoint):
+    """Keep a GET endpoint that writes on the primary"""
+    endpoint.__db_read_only__ = False
+    return endpoint
+
+
+def _bind_request(db, request: Optional[Request]):
+    """Record whether the request is read-only and who issued it"""
+    if request is None:
+        return
+    marked = getattr(request.scope.get("endpoint"), "__db_read_only__", None)
+    db.info["read_only"] = marked if marked is not None else request.method in ("GET", "HEAD")
+    db.info["client_key"] = request.headers.get("authorization") or (request.client.host if request.client else None)
+
+
+def _on_event_loop() -> bool:
+    """True when called from a thread that is running an asyncio event loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class SQLiteWriter:
+    """
+    Per-process serialized writer for SQLite.
+
+    SQLite allows a single writer per database. Instead of letting every
+    session race for the file lock (and fail with "database is locked" once
+    busy_timeout runs out), sessions of this process queue on a local lock
+    before their first write, then open the write transaction with
+    BEGIN IMMEDIATE, retrying with exponential backoff while another process
+    holds the database. The lock is released when the transaction ends.
+
+    Nothing waits on the lock from the event loop thread: async sessions wait
+    in ``begin_write_async``, and sync sessions used there fail immediately
+    when the lock is taken (run them in a worker thread, i.e. plain ``def``
+    endpoints, instead).
+    """
+
+    def __init__(
+        self,
+        lock_timeout: float = SQLITE_WRITE_LOCK_TIMEOUT,
+        max_retries: int = SQLITE_WRITE_MAX_RETRIES,
+        backoff_base: float = SQLITE_WRITE_BACKOFF_BASE,
+        backoff_max: float = SQLITE_WRITE_BACKOFF_MAX,
+    ):
+        self.lock_timeout = lock_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {
+            "write_transactions": 0,
+            "lock_waits": 0,
+            "lock_timeouts": 0,
+            "lock_wait_time_total_ms": 0.0,
+            "lock_wait_time_max_ms": 0.0,
+            "busy_retries": 0,
+            "busy_failures": 0,
+        }
+
+    def _count(self, key: str, value=1):
+        with self._stats_lock:
+            self.counters[key] += value
+
+    def _acquire_lock(self) -> bool:
+        if self._lock.acquire(blocking=False):
+            return True
+
+        self._count("lock_waits")
+        started = time.perf_counter()
+        acquired = self._lock.acquire(timeout=self.lock_timeout)
+        waited_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.counters["lock_wait_time_total_ms"] += waited_ms
+            self.counters["lock_wait_time_max_ms"] = max(self.counters["lock_wait_time_max_ms"], waited_ms)
+            if not acquired:
+                self.counters["lock_timeouts"] += 1
+        return acquired
+
+    async def _acquire_lock_async(self) -> bool:
+        if self._lock.acquire(blocking=False):
+            return True
+
+        # Wait in a worker thread; shielded so a cancelled request can't lose
+        # track of a lock the thread goes on to acquire
+        waiter = asyncio.get_running_loop().run_in_executor(None, self._acquire_lock)
+        try:
+            return await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            waiter.add_done_callback(self._release_abandoned)
+            raise
+
+    def _release_abandoned(self, waiter):
+        if not waiter.cancelled() and waiter.exception() is None and waiter.result():
+            self._lock.release()
+
+    def _retry_delay(self, error, attempt: int) -> Optional[float]:
+        """Backoff before retrying BEGIN IMMEDIATE, or None if ``error`` is final"""
+        message = str(error).lower()
+        if "locked" not in message and "busy" not in message:
+            return None
+        if attempt >= self.max_retries:
+            self._count("busy_failures")
+            return None
+        self._count("busy_retries")
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _begin_immediate(self, dbapi_connection, retry: bool = True):
+        attempt = 0
+        while True:
+            try:
+                cursor = dbapi_connection.cursor()
+                try:
+                    cursor.execute("BEGIN IMMEDIATE")
+                finally:
+                    cursor.close()
+                return
+            except sqlite3.OperationalError as e:
+                delay = self._retry_delay(e, attempt) if retry else None
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def begin_write(self, session):
+        """Serialize ``session`` as a writer before it issues its first write"""
+        if session.info.get("sqlite_writer_active"):
+            return
+
+        connection = session.connection()
+        if connection.dialect.name != "sqlite":
+            return
+
+        dbapi_connection = connection.connection.dbapi_connection
+        if connection.connection.driver_connection.in_transaction:
+            # A write transaction is already open on this connection
+            return
+
+        if connection.dialect.is_async:
+            # A write WriterAsyncSession didn't announce: this runs in
+            # SQLAlchemy's greenlet, which can't wait on the lock, so take it
+            # only if it is free and leave any waiting to busy_timeout
+            acquired = self._lock.acquire(blocking=False)
+            retry = False
+        elif _on_event_loop():
+            # A sync session used from an ``async def`` endpoint: waiting would
+            # stall the loop, and with it the WriterAsyncSession holding the
+            # lock, so fail at once instead
+            if not self._lock.acquire(blocking=False):
+                self._count("lock_timeouts")
+                raise sqlite3.OperationalError(
+                    "database is locked: the writer lock is taken and this session runs on the event loop"
+                )
+            acquired = True
+            retry = False
+        else:
+            acquired = self._acquire_lock()
+            retry = True
+
+        # On lock timeout fall through to BEGIN IMMEDIATE, which still waits on SQLite itself
+        session.info["sqlite_writer_locked"] = acquired
+        session.info["sqlite_writer_active"] = True
+        try:
+            self._begin_immediate(dbapi_connection, retry)
+        except Exception:
+            self.end_write(session)
+            raise
+        self._count("write_transactions")
+
+    async def begin_write_async(self, session: AsyncSession):
+        """``begin_write`` for an AsyncSession, waiting on the lock with ``await``"""
+        sync_session = session.sync_session
+        if sync_session.info.get("sqlite_writer_active"):
+            return
+
+        # The write goes to the primary, so must the transaction opened here
+        sync_session.info["wrote"] = True
+        connection = await session.connection()
+        if connection.dialect.name != "sqlite":
+            return
+
+        raw_connection = await connection.get_raw_connection()
+        if raw_connection.driver_connection.in_transaction:
+            return
+
+        acquired = await self._acquire_lock_async()
+        sync_session.info["sqlite_writer_locked"] = acquired
+        sync_session.info["sqlite_writer_active"] = True
+        try:
+            attempt = 0
+            while True:
+                try:
+                    await connection.exec_driver_sql("BEGIN IMMEDIATE")
+                    break
+                except DBAPIError as e:
+                    delay = self._retry_delay(e.orig, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        except BaseException:
+            self.end_write(sync_session)
+            raise
+        self._count("write_transactions")
+
+    def end_write(self, session):
+        session.info.pop("sqlite_writer_active", None)
+        if session.info.pop("sqlite_writer_locked", False):
+            self._lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            counters = dict(self.counters)
+        counters["lock_wait_time_total_ms"] = round(counters["lock_wait_time_total_ms"], 3)
+        counters["lock_wait_time_max_ms"] = round(counters["lock_wait_time_max_ms"], 3)
+        counters["pid"] = os.getpid()
+        return counters
+
+    def install(self, session_factory):
+        """Hook the writer into every session created by ``session_factory``"""
+
+        @event.listens_for(session_factory, "before_flush")
+        def _before_flush(session, flush_context, instances):
+            if session.new or session.dirty or session.deleted:
+                self.begin_write(session)
+
+        @event.listens_for(session_factory, "do_orm_execute")
+        def _do_orm_execute(orm_execute_state):
+            if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+                self.begin_write(orm_execute_state.session)
+
+        @event.listens_for(session_factory, "after_transaction_end")
+        def _after_transaction_end(session, transaction):
+            if transaction.parent is None:
+                self.end_write(session)
+
+
+sqlite_writer: Optional[SQLiteWriter] = None
+
+
+def get_sqlite_writer_stats() -> Optional[Dict[str, Any]]:
+    """Contention counters of the serialized SQLite writer, if enabled"""
+    return sqlite_writer.stats() if sqlite_writer else None
+
+
+def dispose_engines():
+    """Close pooled connections, e.g. after a fork or on shutdown"""
+    with _engines_lock:
+        for registered in _engines.values():
+            registered.dispose()
+
+
+async def dispose_async_engines():
+    """Close pooled asyncio connections on shutdown"""
+    with _engines_lock:
+        engines = list(_async_engines.values())
+    for registered in engines:
+        await registered.dispose()
+
+
+engine = get_engine()
+
+RoutingSession.router = ReplicaRouter(engine, [get_replica_engine(url) for url in DATABASE_REPLICA_URLS])
+
+SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+if engine.dialect.name == "sqlite" and SQLITE_PROFILE == "production":
+    sqlite_writer = SQLiteWriter()
+    sqlite_writer.install(SessionLocal)
+
+
+class AsyncBackingSession(RoutingSession):
+    """Sync session class behind AsyncSessionLocal, used as the event target"""
+
+
+class WriterAsyncSession(AsyncSession):
+    """
+    AsyncSession that queues on the SQLite writer before it writes.
+
+    The writer's session events run inside SQLAlchemy's greenlet where the
+    lock can't be awaited, so writes are announced here, on the event loop,
+    before they reach the sync session.
+    """
+
+    async def _begin_write(self):
+        if sqlite_writer is not None:
+            await sqlite_writer.begin_write_async(self)
+
+    def _has_changes(self) -> bool:
+        return bool(self.sync_session.new or self.sync_session.dirty or self.sync_session.deleted)
+
+    async def execute(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._begin_write()
+        return await super().execute(statement, *args, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._begin_write()
+        return await super().scalar(statement, *args, **kwargs)
+
+    async def scalars(self, statement, *args, **kwargs):
+        if getattr(statement, "is_dml", False):
+            await self._begin_write()
+        return await super().scalars(statement, *args, **kwargs)
+
+    async def flush(self, objects=None):
+        if self._has_changes():
+            await self._begin_write()
+        await super().flush(objects)
+
+    async def commit(self):
+        if self._has_changes():
+            await self._begin_write()
+        await super().commit()
+
+    async def run_sync(self, fn, *args, **kwargs):
+        # The callable may write anything; only read-only requests skip the lock
+        if not self.info.get("read_only"):
+            await self._begin_write()
+        return await super().run_sync(fn, *args, **kwargs)
+
+
+async_engine = get_async_engine()
+
+AsyncBackingSession.router = ReplicaRouter(
+    async_engine.sync_engine,
+    [get_replica_engine(url, use_async=True).sync_engine for url in DATABASE_REPLICA_URLS],
+)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=WriterAsyncSession,
+    sync_session_class=AsyncBackingSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+if sqlite_writer is not None:
+    sqlite_writer.install(AsyncBackingSession)
 
 Base = declarative_base()
 
+def get_replica_stats() -> Dict[str, Any]:
+    """Read/write routing counters for the sync and async session factories"""
+    return {"sync": RoutingSession.router.stats(), "async": AsyncBackingSession.router.stats()}
+
+
 # Dependency to get DB session
-def get_db():
+def get_db(request: Request = None):
     db = SessionLocal()
+    _bind_request(db, request)
     try:
         yield db
     finally:
         db.close()
+
+
+# Dependency to get an async DB session for ``async def`` handlers
+async def get_async_db(request: Request = None):
+    async with AsyncSessionLocal() as db:
+        _bind_request(db, request)
+        yield db
@@ -12,19 +12,20 @@ from sqlalchemy import text
 # Add the parent directory to the path so we can import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.database import engine, SessionLocal
-from app.models import Base, User
+from app.database import SessionLocal
+from app.models import User
 from app.auth import get_password_hash
+from app.migrations import upgrade_database
 
 def init_database():
     """Initialize database with tables and default data"""
     
     print("Initializing iShop database...")
     
-    # Create all tables
-    print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
-    print("Database tables created successfully")
+    # Apply Alembic migrations
+    print("Applying database migrations...")
+    upgrade_database()
+    print("Database schema is up to date")
     
     # Create database session
     db: Session = SessionLocal()
@@ -1,15 +1,25 @@
+import asyncio
+import logging
 import os
 from datetime import datetime
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, JSONResponse
 from app.routers import auth, admin, orders, products, cart, product_import, bot_management, telegram_webhook
-from app.database import engine
-from app.models import Base
+from app.auth import require_admin
+from app.database import SessionLocal, get_pool_stats, get_replica_stats, get_sqlite_writer_stats, dispose_engines, dispose_async_engines
+from app.migrations import check_schema_current
+from app.utils.search_index import SEARCH_BACKEND, SEARCH_INDEX_SYNC_INTERVAL, product_index, run_syncer as run_search_index_syncer
+from app.utils.images import shutdown_pool as shutdown_image_pool
+from app.utils.query_profiler import QueryProfilerMiddleware
+from app.utils.static_media import StaticMediaMiddleware
+from app.utils.guest_carts import GUEST_CART_FLUSH_INTERVAL, flush_guest_carts, run_flusher as run_guest_cart_flusher
+from app.utils.stock_reservations import STOCK_RESERVATION_SWEEP_INTERVAL, run_sweeper as run_reservation_sweeper
+from app.utils.uploads import UPLOAD_FOLDER, UPLOAD_URL_PREFIX
+from app.cache import catalog_cache, product_slug_cache
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="iShop API",
@@ -23,8 +33,18 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Next-Cursor", "X-Prev-Cursor"],
 )
 
+# Per-request query count, DB time and N+1 detection (Server-Timing header)
+app.add_middleware(QueryProfilerMiddleware)
+
+# Product media, answered before the middleware above (added last = outermost)
+app.add_middleware(StaticMediaMiddleware, mounts={
+    UPLOAD_URL_PREFIX: UPLOAD_FOLDER,
+    "/static/products": os.path.join("static", "products"),
+})
+
 # Root endpoint for production
 @app.get("/")
 async def root():
@@ -46,6 +66,91 @@ def health():
         "timestamp": datetime.now().isoformat()
     }
 
+# Connection pool statistics for this worker process; admins only, as they
+# expose database hosts and load (/api/v1/health is the public probe)
+@app.get("/api/v1/health/db", dependencies=[Depends(require_admin())])
+def health_db():
+    return {
+        "status": "healthy",
+        "pools": get_pool_stats(),
+        "sqlite_writer": get_sqlite_writer_stats(),
+        "routing": get_replica_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Catalog cache hit ratio and invalidations for this worker process; admins only
+@app.get("/api/v1/health/cache", dependencies=[Depends(require_admin())])
+def health_cache():
+    return {
+        "status": "healthy",
+        "cache": catalog_cache.stats(),
+        "product_slugs": product_slug_cache.stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+# Schema is managed by Alembic (app/alembic); refuse to serve an unmigrated database
+@app.on_event("startup")
+def verify_db_schema():
+    check_schema_current()
+
+@app.on_event("startup")
+def load_search_index():
+    if SEARCH_BACKEND == "memory":
+        db = SessionLocal()
+        try:
+            product_index.load(db)
+        finally:
+            db.close()
+
+# Pick up product writes made by the other workers and the bot
+@app.on_event("startup")
+async def start_search_index_syncer():
+    if SEARCH_BACKEND == "memory" and SEARCH_INDEX_SYNC_INTERVAL > 0:
+        app.state.search_index_syncer = asyncio.create_task(run_search_index_syncer())
+
+@app.on_event("shutdown")
+async def stop_search_index_syncer():
+    syncer = getattr(app.state, "search_index_syncer", None)
+    if syncer is not None:
+        syncer.cancel()
+
+# Return the stock of orders left unpaid past their reservation deadline
+@app.on_event("startup")
+async def start_reservation_sweeper():
+    if STOCK_RESERVATION_SWEEP_INTERVAL > 0:
+        app.state.reservation_sweeper = asyncio.create_task(run_reservation_sweeper())
+
+@app.on_event("shutdown")
+async def stop_reservation_sweeper():
+    sweeper = getattr(app.state, "reservation_sweeper", None)
+    if sweeper is not None:
+        sweeper.cancel()
+
+# Write guest carts behind to cart_items, and once more before the pools close
+@app.on_event("startup")
+async def start_guest_cart_flusher():
+    if GUEST_CART_FLUSH_INTERVAL > 0:
+        app.state.guest_cart_flusher = asyncio.create_task(run_guest_cart_flusher())
+
+@app.on_event("shutdown")
+async def stop_guest_cart_flusher():
+    flusher = getattr(app.state, "guest_cart_flusher", None)
+    if flusher is not None:
+        flusher.cancel()
+    try:
+        await asyncio.to_thread(flush_guest_carts)
+    except Exception as e:
+        logger.error(f"Final guest cart flush failed: {e}")
+
+@app.on_event("shutdown")
+async def close_db_pools():
+    dispose_engines()
+    await dispose_async_engines()
+
+@app.on_event("shutdown")
+def stop_image_workers():
+    shutdown_image_pool()
+
 # Include routers (ordered from most specific to most general)
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])
@@ -0,0 +1,94 @@
+"""
+Alembic helpers for iShop.
+
+The schema is owned by the Alembic revisions in app/alembic/versions; the app no
+longer calls Base.metadata.create_all at import. Run ``python -m app.migrations``
+(or ``alembic upgrade head``) before starting the server.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import List
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect
+
+from app.database import get_engine
+
+logger = logging.getLogger(__name__)
+
+# Revision matching the schema that create_all used to produce
+BASELINE_REVISION = "0001"
+
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() == "true"
+
+_APP_DIR = Path(__file__).resolve().parent
+_ALEMBIC_INI = _APP_DIR.parent / "alembic.ini"
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Keep search and slug index objects that are not mapped on the models out of autogenerate"""
+    if type_ == "table" and name.startswith("products_fts"):
+        return False
+    if type_ == "column" and name == "search_vector":
+        return False
+    if type_ == "index" and name == "ix_products_slug_pattern":
+        return False
+    return True
+
+
+def alembic_config() -> Config:
+    """Alembic config that works with or without alembic.ini next to the app"""
+    config = Config(str(_ALEMBIC_INI)) if _ALEMBIC_INI.exists() else Config()
+    config.set_main_option("script_location", str(_APP_DIR / "alembic"))
+    return config
+
+
+def pending_revisions(engine=None) -> List[str]:
+    """Revisions between the database's current version and head"""
+    engine = engine or get_engine()
+    script = ScriptDirectory.from_config(alembic_config())
+    with engine.connect() as connection:
+        current = MigrationContext.configure(connection).get_current_heads()
+
+    pending = []
+    for revision in script.iterate_revisions("heads", current or "base"):
+        if revision.revision not in current:
+            pending.append(revision.revision)
+    return list(reversed(pending))
+
+
+def upgrade_database():
+    """Upgrade DATABASE_URL to head, adopting databases that were built by create_all"""
+    config = alembic_config()
+
+    tables = set(inspect(get_engine()).get_table_names())
+    if "alembic_version" not in tables and "users" in tables:
+        logger.info(f"Existing schema without version table, stamping {BASELINE_REVISION}")
+        command.stamp(config, BASELINE_REVISION)
+
+    command.upgrade(config, "head")
+
+
+def check_schema_current():
+    """Fail fast at startup if migrations have not been applied"""
+    if DB_AUTO_MIGRATE:
+        upgrade_database()
+        return
+
+    pending = pending_revisions()
+    if pending:
+        raise RuntimeError(
+            f"Database schema is not up to date (pending revisions: {', '.join(pending)}). "
+            "Run `python -m app.migrations` or `alembic upgrade head`."
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade_database()
+    print("Database schema is up to date")
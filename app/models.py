@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Float, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Boolean, DateTime, Float, ForeignKey, Index, CheckConstraint, JSON, false, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -43,23 +43,65 @@ class Banner(Base):
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Storefront listing: active products, optionally by category, newest first
+        Index("ix_products_active_created_at", "created_at",
+              sqlite_where=text("is_active = 1"), postgresql_where=text("is_active")),
+        Index("ix_products_active_category_created_at", "category", "created_at",
+              sqlite_where=text("is_active = 1"), postgresql_where=text("is_active")),
+        Index("ix_products_created_at", "created_at"),
+        # Search index sync (app.utils.search_index): rows changed since the last poll
+        Index("ix_products_updated_at", "updated_at"),
+        # Inventory alerts (app.utils.inventory): active products at or below their threshold
+        Index("ix_products_stock_alerts", "stock", "id",
+              sqlite_where=text("is_active = 1 AND stock <= alert_threshold"),
+              postgresql_where=text("is_active AND stock <= alert_threshold")),
+        Index("ix_products_out_of_stock", "stock", "id",
+              sqlite_where=text("is_active = 1 AND stock <= 0"),
+              postgresql_where=text("is_active AND stock <= 0")),
+    )
+    # Return server-generated timestamps from INSERT/UPDATE (RETURNING) so that
+    # flushed rows are complete without a reload - the search index snapshots them
+    __mapper_args__ = {"eager_defaults": True}
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(200), nullable=False, index=True)
     description = Column(Text, nullable=True)
+    # Category name, kept in step with category_id (app.utils.category_tree)
     category = Column(String(100), nullable=True, index=True)
+    category_id = Column(Integer, ForeignKey("categories.id"), nullable=True, index=True)
     price = Column(Integer, nullable=False, default=0)  # Price in smallest currency unit
     currency = Column(String(10), nullable=False, default="IRT")
     image_url = Column(Text, nullable=True)
+    # Responsive derivatives of image_url (app.utils.images.build_variants)
+    image_variants = Column(JSON, nullable=True)
     slug = Column(String(250), nullable=False, unique=True, index=True)
     stock = Column(Integer, nullable=False, default=0)
+    # Per-product reorder threshold; NULL falls back to the category's
+    reorder_threshold = Column(Integer, nullable=True)
+    # Effective threshold (product, else category, else the default), kept by app.utils.inventory
+    alert_threshold = Column(Integer, nullable=False, default=10, server_default=text("10"))
     is_active = Column(Boolean, nullable=False, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    # Relationships (read-only: category_id is set by the category hooks)
+    category_ref = relationship("Category", back_populates="products", viewonly=True)
 
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Admin order list filters and the user's order history, newest first
+        Index("ix_orders_created_at", "created_at"),
+        Index("ix_orders_status_created_at", "status", "created_at"),
+        Index("ix_orders_payment_status_created_at", "payment_status", "created_at"),
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+        # Unpaid stock reservations, for the expiry sweep (app.utils.stock_reservations)
+        Index("ix_orders_reserved_until", "reserved_until",
+              sqlite_where=text("reserved_until IS NOT NULL"),
+              postgresql_where=text("reserved_until IS NOT NULL")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     order_number = Column(String(20), unique=True, nullable=False, index=True)
@@ -99,6 +141,10 @@ class Order(Base):
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     shipped_at = Column(DateTime(timezone=True), nullable=True)
     delivered_at = Column(DateTime(timezone=True), nullable=True)
+    # Stock reservation (app.utils.stock_reservations): whether the order's
+    # stock is set aside for it, and until when while payment is pending
+    holds_stock = Column(Boolean, nullable=False, default=False, server_default=false())
+    reserved_until = Column(DateTime(timezone=True), nullable=True)
     
     # Relationships
     user = relationship("User", back_populates="orders")
@@ -108,6 +154,9 @@ class Order(Base):
 
 class OrderItem(Base):
     __tablename__ = "order_items"
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
@@ -125,6 +174,9 @@ class OrderItem(Base):
 
 class OrderStatusHistory(Base):
     __tablename__ = "order_status_history"
+    __table_args__ = (
+        Index("ix_order_status_history_order_id_created_at", "order_id", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"), nullable=False)
@@ -141,9 +193,17 @@ class OrderStatusHistory(Base):
 
 class CartItem(Base):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # One line per product in a user's cart; adds upsert against it
+        Index("uq_cart_items_user_id_product_id", "user_id", "product_id", unique=True),
+        Index("ix_cart_items_guest_id", "guest_id"),
+        CheckConstraint("user_id IS NOT NULL OR guest_id IS NOT NULL", name="ck_cart_items_owner"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # A line belongs to a user, or to a guest cart (app.utils.guest_carts)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    guest_id = Column(String(32), nullable=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False, default=1)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -161,12 +221,44 @@ class Category(Base):
     name = Column(String(255), nullable=False, unique=True)
     slug = Column(String(255), nullable=False, unique=True)
     description = Column(Text, nullable=True)
+    parent_id = Column(Integer, ForeignKey("categories.id"), nullable=True, index=True)
     is_active = Column(Boolean, default=True)
+    # Reorder threshold for the category's products without their own
+    reorder_threshold = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Relationships
-    products = relationship("Product", back_populates="category")
+    products = relationship("Product", back_populates="category_ref", viewonly=True)
+
+
+class CatalogStats(Base):
+    """Product counters maintained incrementally by app.utils.catalog_stats"""
+    __tablename__ = "catalog_stats"
+    
+    scope = Column(String(20), primary_key=True)  # catalog, category
+    name = Column(String(100), primary_key=True)  # category name; "" for the catalog row
+    # Writers spread over CATALOG_STATS_SLOTS rows per (scope, name); readers sum them
+    slot = Column(Integer, primary_key=True, autoincrement=False, server_default=text("0"))
+    total = Column(Integer, nullable=False, default=0)
+    active = Column(Integer, nullable=False, default=0)
+    out_of_stock = Column(Integer, nullable=False, default=0)
+    low_stock = Column(Integer, nullable=False, default=0)
+    # Inventory alert counts: active products only
+    active_out_of_stock = Column(Integer, nullable=False, default=0)
+    active_low_stock = Column(Integer, nullable=False, default=0)
+    # Sums for category listings (total stock, average price)
+    stock_total = Column(Integer, nullable=False, default=0)
+    price_total = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SlugCounter(Base):
+    """Next free suffix index per base slug, used by app.utils.slugs"""
+    __tablename__ = "slug_counters"
+    
+    base = Column(String(250), primary_key=True)
+    next_index = Column(Integer, nullable=False, default=0)
 
 
 class ImportLog(Base):
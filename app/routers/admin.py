@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
 from jose import jwt
+from sqlalchemy.orm import Session
 from typing import Optional
 
+from ..database import get_db
+from ..utils.category_tree import category_tree
+from ..utils.inventory import list_alerts
+
 router = APIRouter()
 security = HTTPBearer()
 
@@ -815,43 +820,36 @@ async def toggle_product_status(product_id: int, current_user: str = Depends(ver
     }
 
 @router.get("/products/categories")
-async def get_product_categories(current_user: str = Depends(verify_token)):
+def get_product_categories(current_user: str = Depends(verify_token), db: Session = Depends(get_db)):
     return {
         "data": [
-            {"id": 1, "name": "کیف و کوله", "slug": "bags", "products_count": 25},
-            {"id": 2, "name": "کفش", "slug": "shoes", "products_count": 18},
-            {"id": 3, "name": "الکترونیک", "slug": "electronics", "products_count": 32},
-            {"id": 4, "name": "پوشاک", "slug": "clothing", "products_count": 45},
-            {"id": 5, "name": "آرایشی و بهداشتی", "slug": "cosmetics", "products_count": 28}
+            {"id": category["id"], "name": category["name"], "slug": category["slug"],
+             "products_count": category["product_count"]}
+            for category in category_tree.categories(db)
         ]
     }
 
 @router.get("/products/low-stock")
-async def get_low_stock_products(current_user: str = Depends(verify_token)):
+def get_low_stock_products(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    current_user: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    # Same partial-index listing as /products/admin/inventory-alerts
+    alerts, next_cursor, _ = list_alerts(db, cursor=cursor, limit=limit)
     return {
         "data": [
             {
-                "id": 2,
-                "name": "کفش مجلسی طلایی",
-                "stock": 5,
-                "min_stock": 10,
-                "category": "کفش"
-            },
-            {
-                "id": 15,
-                "name": "کیف چرمی مشکی",
-                "stock": 3,
-                "min_stock": 8,
-                "category": "کیف و کوله"
-            },
-            {
-                "id": 28,
-                "name": "هدفون بی‌سیم",
-                "stock": 2,
-                "min_stock": 5,
-                "category": "الکترونیک"
+                "id": alert.id,
+                "name": alert.name,
+                "stock": alert.stock,
+                "min_stock": alert.alert_threshold,
+                "category": alert.category
             }
-        ]
+            for alert in alerts
+        ],
+        "next_cursor": next_cursor
     }
 
 # User Management APIs (Enhanced)
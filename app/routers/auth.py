@@ -1,5 +1,6 @@
+import logging
 from datetime import timedelta
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 
@@ -7,12 +8,34 @@ from ..database import get_db
 from ..auth import authenticate_user, create_access_token, create_access_token_with_role, get_current_user, get_password_hash, require_admin, ACCESS_TOKEN_EXPIRE_MINUTES
 from ..schemas import Token, User, UserRegister
 from ..models import User as UserModel
+from ..utils.guest_carts import clear_guest_cookie, guest_id_from_request, merge_guest_cart
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def adopt_guest_cart(request: Request, response: Response, db: Session, user: UserModel):
+    """Merge the cart built before logging in into the user's cart and drop the guest cookie"""
+    guest_id = guest_id_from_request(request)
+    if not guest_id:
+        return
+    try:
+        merged = merge_guest_cart(db, guest_id, user.id)
+        clear_guest_cookie(response)
+        logger.info(f"Merged {merged} guest cart lines into the cart of {user.username}")
+    except Exception as e:
+        # The login still succeeds; the cookie stays, so the next one retries
+        db.rollback()
+        logger.error(f"Guest cart merge failed for {user.username}: {e}")
+
+
+# Plain def: the session (guest cart merge, SQLite writer lock) blocks, so
+# these run in the threadpool rather than on the event loop
 @router.post("/login", response_model=Token)
-async def login_for_access_token(
+def login_for_access_token(
+    request: Request,
+    response: Response,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
@@ -28,12 +51,15 @@ async def login_for_access_token(
     print(f"[AUTH] Login successful for user: {user.username} ({user.email}) - Role: {user.role}")
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token_with_role(user, expires_delta=access_token_expires)
+    adopt_guest_cart(request, response, db, user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 @router.post("/register", response_model=Token)
-async def register_user(
+def register_user(
     user_data: UserRegister,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db)
 ):
     # Check if username or email already exists
@@ -65,6 +91,7 @@ async def register_user(
     # Generate access token with role
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token_with_role(db_user, expires_delta=access_token_expires)
+    adopt_guest_cart(request, response, db, db_user)
     
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -6,19 +6,32 @@ from ..database import get_db
 from ..auth import get_current_user
 from ..models import Banner as BannerModel, User
 from ..schemas import Banner, BannerUpdate
+from ..cache import BANNERS_TAG, cached_read
 
 router = APIRouter()
 
 
+def _serialize(banner: BannerModel) -> dict:
+    """JSON-ready banner, as stored in the catalog cache"""
+    return Banner.model_validate(banner).model_dump(mode="json")
+
+
 @router.get("", response_model=List[Banner])
 def get_banners(db: Session = Depends(get_db)):
-    banners = db.query(BannerModel).order_by(BannerModel.position).all()
-    return banners
+    def load(session: Session):
+        banners = session.query(BannerModel).order_by(BannerModel.position).all()
+        return [_serialize(banner) for banner in banners]
+    
+    return cached_read(db, "banners:list", load, tags=[BANNERS_TAG])
 
 
 @router.get("/{key}", response_model=Banner)
 def get_banner(key: str, db: Session = Depends(get_db)):
-    banner = db.query(BannerModel).filter(BannerModel.key == key).first()
+    def load(session: Session):
+        banner = session.query(BannerModel).filter(BannerModel.key == key).first()
+        return _serialize(banner) if banner else None
+    
+    banner = cached_read(db, f"banner:{key}", load, tags=[BANNERS_TAG])
     if not banner:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
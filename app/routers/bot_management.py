@@ -213,7 +213,7 @@ async def get_import_history(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/import-history/{import_id}")
-async def delete_import_log(
+def delete_import_log(
     import_id: str,
     db: Session = Depends(get_db),
     current_user: User = Depends(require_admin)
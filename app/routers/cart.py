@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, bindparam, delete, func, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from typing import Dict, List, Optional
 
-from ..database import get_db
-from ..auth import get_current_user
+from ..database import get_async_db
+from ..auth import get_optional_user
 from ..models import User, CartItem as CartItemModel, Product as ProductModel
-from ..schemas import CartItemCreate, CartItemUpdate, CartItem, CartResponse
+from ..schemas import CartItemCreate, CartItemUpdate, CartItem, CartResponse, CartBatch, CartOperation
+from ..utils.guest_carts import (
+    GUEST_CART_MAX_LINES, GUEST_CART_WRITE_THROUGH, guest_cart_store, guest_id_from_request, new_guest_id,
+    set_guest_cookie, stored_lines, write_lines
+)
 
 router = APIRouter(
     prefix="/api/v1/cart",
@@ -14,59 +21,239 @@ router = APIRouter(
 )
 
 
-@router.get("", response_model=CartResponse)
-async def get_cart(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Get user's cart items"""
-    cart_items = db.query(CartItemModel).filter(
-        CartItemModel.user_id == current_user.id
-    ).all()
+def cart_statement(user_id: int):
+    """
+    A user's cart in one query: each line with its product and line total,
+    and the cart's quantity and amount repeated on every row (window sums)
+    """
+    line_total = (ProductModel.price * CartItemModel.quantity).label("total_price")
+    return (
+        select(
+            CartItemModel.id,
+            CartItemModel.user_id,
+            CartItemModel.product_id,
+            CartItemModel.quantity,
+            ProductModel.name.label("product_name"),
+            ProductModel.price.label("product_price"),
+            ProductModel.image_url.label("product_image_url"),
+            line_total,
+            CartItemModel.created_at,
+            CartItemModel.updated_at,
+            func.sum(CartItemModel.quantity).over().label("cart_quantity"),
+            func.sum(ProductModel.price * CartItemModel.quantity).over().label("cart_amount"),
+        )
+        .join(ProductModel, ProductModel.id == CartItemModel.product_id)
+        .where(CartItemModel.user_id == user_id)
+        .order_by(CartItemModel.id)
+    )
+
+
+async def add_cart_line(db: AsyncSession, user_id: int, product_id: int, quantity: int):
+    """
+    Add ``quantity`` units of a product to a user's cart with one statement.
+
+    Returns the cart line with the product's name, price and image, or None
+    if that would take the line past the product's stock (or the product
+    isn't for sale). On SQLite and PostgreSQL:
+
+        INSERT INTO cart_items (user_id, product_id, quantity)
+        SELECT :user_id, id, :quantity FROM products
+        WHERE id = :product_id AND is_active AND stock >= :quantity
+        ON CONFLICT (user_id, product_id) DO UPDATE
+        SET quantity = cart_items.quantity + excluded.quantity
+        WHERE cart_items.quantity + excluded.quantity <= (SELECT stock ...)
+        RETURNING ...
+
+    so concurrent adds of one product add up on a single line.
+    """
+    items = CartItemModel.__table__
+    products = ProductModel.__table__
+    dialect_name = (await db.connection()).dialect.name
     
-    # Calculate cart totals
-    total_quantity = sum(item.quantity for item in cart_items)
+    # The line's product is known, so the subqueries needn't be correlated
+    def product_column(column):
+        return select(column).where(products.c.id == product_id).scalar_subquery()
     
-    # Build response with product details
-    cart_response_items = []
-    total_amount = 0
+    line = (
+        items.c.id, items.c.user_id, items.c.product_id, items.c.quantity, items.c.created_at, items.c.updated_at,
+        product_column(products.c.name).label("product_name"),
+        product_column(products.c.price).label("product_price"),
+        product_column(products.c.image_url).label("product_image_url"),
+    )
+    source = select(literal(user_id), products.c.id, literal(quantity)).where(
+        products.c.id == product_id, products.c.is_active == True, products.c.stock >= quantity
+    )
     
-    for cart_item in cart_items:
-        product = cart_item.product
-        item_total = product.price * cart_item.quantity
-        total_amount += item_total
-        
-        cart_response_items.append(CartItem(
-            id=cart_item.id,
-            user_id=cart_item.user_id,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            product_name=product.name,
-            product_price=product.price,
-            product_image_url=product.image_url,
-            total_price=item_total,
-            created_at=cart_item.created_at,
-            updated_at=cart_item.updated_at
-        ))
-    
-    return CartResponse(
-        items=cart_response_items,
-        total_quantity=total_quantity,
-        total_amount=total_amount,
-        currency="IRR"
+    if dialect_name in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+        stmt = dialect_insert(items).from_select(["user_id", "product_id", "quantity"], source)
+        stock = select(products.c.stock).where(products.c.id == stmt.excluded.product_id).scalar_subquery()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "product_id"],
+            set_={"quantity": items.c.quantity + stmt.excluded.quantity, "updated_at": func.now()},
+            where=items.c.quantity + stmt.excluded.quantity <= stock
+        ).returning(*line)
+        return (await db.execute(stmt)).first()
+    
+    # Elsewhere: a conditional UPDATE, and an INSERT if there was no line
+    # (the unique index turns a racing second INSERT into an error)
+    this_line = (items.c.user_id == user_id, items.c.product_id == product_id)
+    stock = select(products.c.stock).where(products.c.id == product_id).scalar_subquery()
+    result = await db.execute(
+        update(items)
+        .where(*this_line, items.c.quantity + quantity <= stock)
+        .values(quantity=items.c.quantity + quantity, updated_at=func.now())
     )
+    if not result.rowcount:
+        if (await db.execute(select(items.c.id).where(*this_line))).first():
+            return None
+        await db.execute(insert(items).from_select(["user_id", "product_id", "quantity"], source))
+    return (await db.execute(select(*line).where(*this_line))).first()
 
 
-@router.post("/add", response_model=CartItem)
-async def add_to_cart(
-    cart_item_data: CartItemCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+# Without a login token the cart is the guest cart of the guest_cart cookie
+# (app.utils.guest_carts). Its lines live in the guest cart store and use the
+# product id as their item id; serving them only reads the database, unless
+# GUEST_CART_WRITE_THROUGH keeps them in cart_items alone.
+
+async def load_guest_cart(db: AsyncSession, guest_id: str) -> Dict[int, int]:
+    """A guest's cart from the store, reloaded from cart_items if the store doesn't hold it"""
+    if GUEST_CART_WRITE_THROUGH:
+        return dict((await db.execute(stored_lines(guest_id))).all())
+    cart = guest_cart_store.get(guest_id)
+    if cart is None:
+        rows = (await db.execute(stored_lines(guest_id))).all()
+        cart = guest_cart_store.load(guest_id, rows)
+    return cart
+
+
+async def save_guest_cart(db: AsyncSession, guest_id: str, changes: Dict[int, Optional[int]]):
+    """Apply ``changes`` to a guest's cart; a None quantity removes the line"""
+    if not GUEST_CART_WRITE_THROUGH:
+        guest_cart_store.apply(guest_id, changes)
+        return
+    for statement in write_lines(guest_id, changes):
+        await db.execute(statement)
+    await db.commit()
+
+
+def guest_line(product: ProductModel, quantity: int) -> CartItem:
+    return CartItem(
+        id=product.id,
+        user_id=None,
+        product_id=product.id,
+        quantity=quantity,
+        product_name=product.name,
+        product_price=product.price,
+        product_image_url=product.image_url,
+        total_price=product.price * quantity
+    )
+
+
+async def guest_cart_response(db: AsyncSession, cart: Dict[int, int]) -> JSONResponse:
+    products = {}
+    if cart:
+        result = await db.execute(
+            select(ProductModel.id, ProductModel.name, ProductModel.price, ProductModel.image_url)
+            .where(ProductModel.id.in_(list(cart)))
+        )
+        products = {row.id: row for row in result}
+    
+    # In the order the lines were added; products deleted since are left out
+    items = [
+        guest_line(products[product_id], quantity).model_dump(mode="json")
+        for product_id, quantity in cart.items() if product_id in products
+    ]
+    return JSONResponse({
+        "items": items,
+        "total_quantity": sum(item["quantity"] for item in items),
+        "total_amount": sum(item["total_price"] for item in items),
+        "currency": "IRR",
+    })
+
+
+async def add_to_guest_cart(
+    request: Request, response: Response, db: AsyncSession, product: ProductModel, quantity: int
+) -> CartItem:
+    guest_id = guest_id_from_request(request)
+    if guest_id:
+        cart = await load_guest_cart(db, guest_id)
+    else:
+        # First add: a new guest, whose cart nothing needs reloading for
+        guest_id = new_guest_id()
+        cart = {} if GUEST_CART_WRITE_THROUGH else guest_cart_store.load(guest_id, [])
+        set_guest_cookie(response, guest_id)
+    
+    if quantity <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Quantity must be greater than 0"
+        )
+    
+    if product.id not in cart and len(cart) >= GUEST_CART_MAX_LINES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cart is full. At most {GUEST_CART_MAX_LINES} products"
+        )
+    
+    if cart.get(product.id, 0) + quantity > product.stock:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Total quantity would exceed stock. Available: {product.stock}"
+        )
+    
+    if GUEST_CART_WRITE_THROUGH:
+        new_quantity = cart.get(product.id, 0) + quantity
+        await save_guest_cart(db, guest_id, {product.id: new_quantity})
+    else:
+        new_quantity = guest_cart_store.add(guest_id, product.id, quantity)
+    return guest_line(product, new_quantity)
+
+
+@router.get("", response_model=CartResponse)
+async def get_cart(
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Add item to cart or update quantity if already exists"""
+    """Get user's cart items"""
+    if current_user is None:
+        guest_id = guest_id_from_request(request)
+        return await guest_cart_response(db, await load_guest_cart(db, guest_id) if guest_id else {})
+    
+    return await user_cart_response(db, current_user.id)
+
+
+async def user_cart_response(db: AsyncSession, user_id: int) -> JSONResponse:
+    rows = (await db.execute(cart_statement(user_id))).all()
     
-    # Check if product exists
-    product = db.query(ProductModel).filter(ProductModel.id == cart_item_data.product_id).first()
+    # Serialized straight from the rows: the query already did the arithmetic
+    items = [
+        {
+            "id": row.id,
+            "user_id": row.user_id,
+            "product_id": row.product_id,
+            "quantity": row.quantity,
+            "product_name": row.product_name,
+            "product_price": row.product_price,
+            "product_image_url": row.product_image_url,
+            "total_price": row.total_price,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+            "updated_at": row.updated_at.isoformat() if row.updated_at else None,
+        }
+        for row in rows
+    ]
+    return JSONResponse({
+        "items": items,
+        "total_quantity": int(rows[0].cart_quantity) if rows else 0,
+        "total_amount": int(rows[0].cart_amount) if rows else 0,
+        "currency": "IRR",
+    })
+
+
+async def available_product(db: AsyncSession, product_id: int, quantity: int) -> ProductModel:
+    """The product, if it is for sale with at least ``quantity`` in stock"""
+    product = await db.get(ProductModel, product_id)
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -79,74 +266,112 @@ async def add_to_cart(
             detail="Product is not available"
         )
     
-    if cart_item_data.quantity > product.stock:
+    if quantity > product.stock:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Insufficient stock. Available: {product.stock}"
         )
+    return product
+
+
+@router.post("/add", response_model=CartItem)
+async def add_to_cart(
+    cart_item_data: CartItemCreate,
+    request: Request,
+    response: Response,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Add item to cart or update quantity if already exists"""
     
-    # Check if item already in cart
-    existing_cart_item = db.query(CartItemModel).filter(
-        and_(
-            CartItemModel.user_id == current_user.id,
-            CartItemModel.product_id == cart_item_data.product_id
+    if cart_item_data.quantity <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Quantity must be greater than 0"
         )
-    ).first()
     
-    if existing_cart_item:
-        # Update existing item quantity
-        new_quantity = existing_cart_item.quantity + cart_item_data.quantity
-        if new_quantity > product.stock:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Total quantity would exceed stock. Available: {product.stock}"
-            )
-        existing_cart_item.quantity = new_quantity
-        db.commit()
-        db.refresh(existing_cart_item)
-        cart_item = existing_cart_item
-    else:
-        # Create new cart item
-        cart_item = CartItemModel(
-            user_id=current_user.id,
-            product_id=cart_item_data.product_id,
-            quantity=cart_item_data.quantity
+    if current_user is None:
+        product = await available_product(db, cart_item_data.product_id, cart_item_data.quantity)
+        return await add_to_guest_cart(request, response, db, product, cart_item_data.quantity)
+    
+    # Insert the line or add to it, within the stock, in one statement; the
+    # product is only looked up to explain a refusal
+    cart_item = await add_cart_line(db, current_user.id, cart_item_data.product_id, cart_item_data.quantity)
+    if cart_item is None:
+        await db.rollback()
+        product = await available_product(db, cart_item_data.product_id, cart_item_data.quantity)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Total quantity would exceed stock. Available: {product.stock}"
         )
-        db.add(cart_item)
-        db.commit()
-        db.refresh(cart_item)
+    await db.commit()
     
     # Return response with product details
-    item_total = product.price * cart_item.quantity
     return CartItem(
         id=cart_item.id,
         user_id=cart_item.user_id,
         product_id=cart_item.product_id,
         quantity=cart_item.quantity,
-        product_name=product.name,
-        product_price=product.price,
-        product_image_url=product.image_url,
-        total_price=item_total,
+        product_name=cart_item.product_name,
+        product_price=cart_item.product_price,
+        product_image_url=cart_item.product_image_url,
+        total_price=cart_item.product_price * cart_item.quantity,
         created_at=cart_item.created_at,
         updated_at=cart_item.updated_at
     )
 
 
+async def update_guest_cart_item(request: Request, db: AsyncSession, product_id: int, quantity: int) -> CartItem:
+    guest_id = guest_id_from_request(request)
+    product = None
+    if guest_id and product_id in await load_guest_cart(db, guest_id):
+        product = await db.get(ProductModel, product_id)
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Cart item not found"
+        )
+    
+    if quantity > product.stock:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock. Available: {product.stock}"
+        )
+    
+    if quantity <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Quantity must be greater than 0"
+        )
+    
+    await save_guest_cart(db, guest_id, {product_id: quantity})
+    return guest_line(product, quantity)
+
+
 @router.put("/update/{item_id}", response_model=CartItem)
 async def update_cart_item(
     item_id: int,
     update_data: CartItemUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update cart item quantity"""
     
-    cart_item = db.query(CartItemModel).filter(
-        and_(
-            CartItemModel.id == item_id,
-            CartItemModel.user_id == current_user.id
+    if current_user is None:
+        return await update_guest_cart_item(request, db, item_id, update_data.quantity)
+    
+    result = await db.execute(
+        select(CartItemModel)
+        .options(selectinload(CartItemModel.product))
+        .where(
+            and_(
+                CartItemModel.id == item_id,
+                CartItemModel.user_id == current_user.id
+            )
         )
-    ).first()
+    )
+    cart_item = result.scalars().first()
     
     if not cart_item:
         raise HTTPException(
@@ -168,8 +393,8 @@ async def update_cart_item(
         )
     
     cart_item.quantity = update_data.quantity
-    db.commit()
-    db.refresh(cart_item)
+    await db.commit()
+    await db.refresh(cart_item)
     
     # Return response with product details
     item_total = product.price * cart_item.quantity
@@ -190,17 +415,31 @@ async def update_cart_item(
 @router.delete("/remove/{item_id}")
 async def remove_from_cart(
     item_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Remove item from cart"""
     
-    cart_item = db.query(CartItemModel).filter(
-        and_(
-            CartItemModel.id == item_id,
-            CartItemModel.user_id == current_user.id
+    if current_user is None:
+        guest_id = guest_id_from_request(request)
+        if not guest_id or item_id not in await load_guest_cart(db, guest_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Cart item not found"
+            )
+        await save_guest_cart(db, guest_id, {item_id: None})
+        return {"message": "Item removed from cart successfully"}
+    
+    result = await db.execute(
+        select(CartItemModel).where(
+            and_(
+                CartItemModel.id == item_id,
+                CartItemModel.user_id == current_user.id
+            )
         )
-    ).first()
+    )
+    cart_item = result.scalars().first()
     
     if not cart_item:
         raise HTTPException(
@@ -208,37 +447,226 @@ async def remove_from_cart(
             detail="Cart item not found"
         )
     
-    db.delete(cart_item)
-    db.commit()
+    await db.delete(cart_item)
+    await db.commit()
     
     return {"message": "Item removed from cart successfully"}
 
 
+def apply_cart_operations(
+    cart: Dict[int, int], operations: List[CartOperation], products: Dict[int, ProductModel]
+) -> Dict[int, int]:
+    """
+    ``cart`` (product id -> quantity) after ``operations``, applied in order.
+
+    The final quantity of every product the operations touch is checked
+    against its stock once, so a batch may pass through a quantity it ends
+    below. Raises HTTPException for the first operation that can't apply.
+    """
+    cart = dict(cart)
+    for index, operation in enumerate(operations):
+        product_id = operation.product_id
+        if operation.op == "remove":
+            if cart.pop(product_id, None) is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"Operation {index}: Cart item not found"
+                )
+            continue
+        
+        if operation.quantity is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Operation {index}: Quantity is required for {operation.op}"
+            )
+        
+        if operation.op == "update" and product_id not in cart:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Operation {index}: Cart item not found"
+            )
+        
+        # Both leave the product in the cart, so it must still be for sale
+        product = products.get(product_id)
+        if not product:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Operation {index}: Product not found"
+            )
+        if not product.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Operation {index}: Product is not available"
+            )
+        
+        if operation.op == "add":
+            cart[product_id] = cart.get(product_id, 0) + operation.quantity
+        else:
+            cart[product_id] = operation.quantity
+    
+    for product_id in {operation.product_id for operation in operations}:
+        quantity = cart.get(product_id)
+        if quantity is None:
+            continue
+        product = products.get(product_id)
+        if not product:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Product {product_id} not found"
+            )
+        if quantity > product.stock:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient stock for product {product_id}. Available: {product.stock}"
+            )
+    return cart
+
+
+async def write_user_cart(db: AsyncSession, user_id: int, lines: list, cart: Dict[int, int]):
+    """Turn a user's cart ``lines`` into ``cart`` with at most one DELETE, UPDATE and INSERT"""
+    items = CartItemModel.__table__
+    kept = set()
+    removed, changed = [], []
+    for line in lines:
+        quantity = cart.get(line.product_id)
+        if quantity is None:
+            removed.append(line.id)
+            continue
+        kept.add(line.product_id)
+        if line.quantity != quantity:
+            changed.append({"line_id": line.id, "new_quantity": quantity})
+    added = [
+        {"user_id": user_id, "product_id": product_id, "quantity": quantity}
+        for product_id, quantity in cart.items() if product_id not in kept
+    ]
+    
+    if removed:
+        await db.execute(delete(items).where(items.c.id.in_(removed)))
+    if changed:
+        await db.execute(
+            update(items)
+            .where(items.c.id == bindparam("line_id"))
+            .values(quantity=bindparam("new_quantity"), updated_at=func.now()),
+            changed
+        )
+    if added:
+        dialect_name = (await db.connection()).dialect.name
+        if dialect_name in ("sqlite", "postgresql"):
+            # A line added since the cart was read takes the batch's quantity
+            dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+            stmt = dialect_insert(items).values(added)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["user_id", "product_id"],
+                set_={"quantity": stmt.excluded.quantity, "updated_at": func.now()}
+            )
+        else:
+            stmt = insert(items).values(added)
+        await db.execute(stmt)
+
+
+@router.post("/batch", response_model=CartResponse)
+async def batch_update_cart(
+    batch: CartBatch,
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Apply add/update/remove operations in one go and return the cart.
+
+    Operations reference products by id and apply in order, all or none.
+    The products they touch are loaded with a single query and their stock
+    checked against the final quantities.
+    """
+    guest_id = None
+    if current_user is None:
+        guest_id = guest_id_from_request(request)
+        cart = await load_guest_cart(db, guest_id) if guest_id else {}
+    else:
+        lines = (await db.execute(
+            select(CartItemModel.id, CartItemModel.product_id, CartItemModel.quantity)
+            .where(CartItemModel.user_id == current_user.id)
+            .order_by(CartItemModel.id)
+        )).all()
+        cart = {line.product_id: line.quantity for line in lines}
+    
+    product_ids = {operation.product_id for operation in batch.operations}
+    result = await db.execute(select(ProductModel).where(ProductModel.id.in_(product_ids)))
+    products = {product.id: product for product in result.scalars()}
+    new_cart = apply_cart_operations(cart, batch.operations, products)
+    
+    if current_user is not None:
+        await write_user_cart(db, current_user.id, lines, new_cart)
+        await db.commit()
+        return await user_cart_response(db, current_user.id)
+    
+    if len(new_cart) > max(len(cart), GUEST_CART_MAX_LINES):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cart is full. At most {GUEST_CART_MAX_LINES} products"
+        )
+    
+    new_guest = guest_id is None
+    if new_guest and not new_cart:
+        return await guest_cart_response(db, new_cart)
+    if new_guest:
+        guest_id = new_guest_id()
+        if not GUEST_CART_WRITE_THROUGH:
+            guest_cart_store.load(guest_id, [])
+    await save_guest_cart(db, guest_id, {
+        product_id: new_cart.get(product_id)
+        for product_id in cart.keys() | new_cart.keys()
+        if cart.get(product_id) != new_cart.get(product_id)
+    })
+    
+    response = await guest_cart_response(db, new_cart)
+    if new_guest:
+        set_guest_cookie(response, guest_id)
+    return response
+
+
 @router.delete("/clear")
 async def clear_cart(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Clear all items from user's cart"""
     
-    db.query(CartItemModel).filter(
-        CartItemModel.user_id == current_user.id
-    ).delete()
-    db.commit()
+    if current_user is None:
+        guest_id = guest_id_from_request(request)
+        if GUEST_CART_WRITE_THROUGH and guest_id:
+            await save_guest_cart(db, guest_id, dict.fromkeys(await load_guest_cart(db, guest_id)))
+        elif guest_id:
+            guest_cart_store.clear(guest_id)
+        return {"message": "Cart cleared successfully"}
+    
+    await db.execute(
+        delete(CartItemModel).where(CartItemModel.user_id == current_user.id)
+    )
+    await db.commit()
     
     return {"message": "Cart cleared successfully"}
 
 
 @router.get("/count")
 async def get_cart_count(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: Optional[User] = Depends(get_optional_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get total number of items in cart"""
     
-    from sqlalchemy import func
-    total_quantity = db.query(func.sum(CartItemModel.quantity)).filter(
-        CartItemModel.user_id == current_user.id
-    ).scalar() or 0
+    if current_user is None:
+        guest_id = guest_id_from_request(request)
+        cart = await load_guest_cart(db, guest_id) if guest_id else {}
+        return {"count": sum(cart.values())}
+    
+    result = await db.execute(
+        select(func.sum(CartItemModel.quantity)).where(
+            CartItemModel.user_id == current_user.id
+        )
+    )
+    total_quantity = result.scalar() or 0
     
     return {"count": int(total_quantity)}
\ No newline at end of file
@@ -1,26 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, asc
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, or_, select
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel, Field
 from datetime import datetime, date
+from collections import defaultdict
 import secrets
 
-from ..database import get_db
+from ..database import get_async_db
 from ..models import User, Order, OrderItem, OrderStatusHistory
 from ..auth import get_current_user
+from ..utils.pagination import KeysetPaginator, set_cursor_headers
+from ..utils.stock_reservations import (
+    StockUnavailable, apply_status_change, commit_reservation, reservation_deadline, reserve_stock
+)
 
 router = APIRouter()
 
+# Sort keys that can back a pagination cursor
+order_paginator = KeysetPaginator(
+    Order, ["created_at", "updated_at", "total", "status", "payment_status", "order_number", "id"]
+)
+
 # Request Models
 class OrderItemCreate(BaseModel):
+    # Name and price are taken from the product when its stock is reserved
     product_id: int
-    product_name: str
     quantity: int = Field(gt=0)
-    unit_price: int = Field(gt=0)
 
 class OrderCreate(BaseModel):
-    items: List[OrderItemCreate]
+    items: List[OrderItemCreate] = Field(min_length=1)
     customer_name: str
     customer_email: str
     customer_phone: Optional[str] = None
@@ -34,6 +44,10 @@ class OrderStatusUpdate(BaseModel):
     tracking_number: Optional[str] = None
     shipping_company: Optional[str] = None
 
+class OrderPaymentUpdate(BaseModel):
+    payment_status: str = Field(pattern="^(pending|paid|failed|refunded)$")
+    payment_reference: Optional[str] = None
+
 class OrderFilter(BaseModel):
     status: Optional[str] = None
     payment_status: Optional[str] = None
@@ -91,6 +105,7 @@ class OrderResponse(BaseModel):
     updated_at: datetime
     shipped_at: Optional[datetime]
     delivered_at: Optional[datetime]
+    reserved_until: Optional[datetime] = None
     items: List[OrderItemResponse] = []
     status_history: List[OrderStatusHistoryResponse] = []
     
@@ -132,9 +147,19 @@ def generate_order_number() -> str:
     random_part = secrets.token_hex(3).upper()
     return f"{prefix}-{year}-{random_part}"
 
-def calculate_order_totals(items: List[OrderItemCreate], shipping_cost: int = 0, tax_rate: float = 0.09) -> dict:
+async def load_order(db: AsyncSession, *criteria) -> Optional[Order]:
+    """Load an order with its items and status history for OrderResponse"""
+    result = await db.execute(
+        select(Order)
+        .options(selectinload(Order.items), selectinload(Order.status_history))
+        .where(*criteria)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+def calculate_order_totals(items: List[OrderItem], shipping_cost: int = 0, tax_rate: float = 0.09) -> dict:
     """Calculate order totals"""
-    subtotal = sum(item.unit_price * item.quantity for item in items)
+    subtotal = sum(item.total_price for item in items)
     tax_amount = int(subtotal * tax_rate)
     total = subtotal + shipping_cost + tax_amount
     
@@ -149,16 +174,32 @@ def calculate_order_totals(items: List[OrderItemCreate], shipping_cost: int = 0,
 async def create_order(
     order_data: OrderCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new order"""
     try:
+        # Take the stock first; names and prices come from the product rows it updates
+        quantities = defaultdict(int)
+        for item_data in order_data.items:
+            quantities[item_data.product_id] += item_data.quantity
+        products = await db.run_sync(reserve_stock, quantities)
+        order_items = [
+            OrderItem(
+                product_id=item_data.product_id,
+                product_name=products[item_data.product_id]["name"],
+                quantity=item_data.quantity,
+                unit_price=products[item_data.product_id]["price"],
+                total_price=products[item_data.product_id]["price"] * item_data.quantity
+            )
+            for item_data in order_data.items
+        ]
+        
         # Calculate totals
-        totals = calculate_order_totals(order_data.items, shipping_cost=150000)  # 150,000 IRT shipping
+        totals = calculate_order_totals(order_items, shipping_cost=150000)  # 150,000 IRT shipping
         
         # Generate unique order number
         order_number = generate_order_number()
-        while db.query(Order).filter(Order.order_number == order_number).first():
+        while (await db.execute(select(Order.id).where(Order.order_number == order_number))).first():
             order_number = generate_order_number()
         
         # Create the order
@@ -176,21 +217,16 @@ async def create_order(
             customer_email=order_data.customer_email,
             customer_phone=order_data.customer_phone,
             shipping_address=order_data.shipping_address,
-            customer_notes=order_data.customer_notes
+            customer_notes=order_data.customer_notes,
+            holds_stock=True,
+            reserved_until=reservation_deadline(order_data.payment_method)
         )
         db.add(db_order)
-        db.flush()
+        await db.flush()
         
         # Create order items
-        for item_data in order_data.items:
-            order_item = OrderItem(
-                order_id=db_order.id,
-                product_id=item_data.product_id,
-                product_name=item_data.product_name,
-                quantity=item_data.quantity,
-                unit_price=item_data.unit_price,
-                total_price=item_data.unit_price * item_data.quantity
-            )
+        for order_item in order_items:
+            order_item.order_id = db_order.id
             db.add(order_item)
         
         # Create initial status history
@@ -203,41 +239,50 @@ async def create_order(
         )
         db.add(status_history)
         
-        db.commit()
-        db.refresh(db_order)
+        await db.commit()
         
-        return db_order
+        return await load_order(db, Order.id == db_order.id)
         
+    except StockUnavailable as e:
+        await db.rollback()
+        if e.available is None:
+            raise HTTPException(status_code=400, detail=f"Product {e.product_id} is not available")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient stock for product {e.product_id}. Available: {e.available}"
+        )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to create order: {str(e)}")
 
 # Admin routes
 @router.get("/admin", response_model=List[OrderListResponse])
 async def get_all_orders(
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
     status: Optional[str] = Query(None),
     payment_status: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
     sort_by: str = Query("created_at"),
-    sort_order: str = Query("desc")
+    sort_order: str = Query("desc"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor / X-Prev-Cursor; replaces page")
 ):
     """Get all orders (admin only)"""
     if current_user.role not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    query = db.query(Order)
+    query = select(Order)
     
     # Apply filters
     if status:
-        query = query.filter(Order.status == status)
+        query = query.where(Order.status == status)
     if payment_status:
-        query = query.filter(Order.payment_status == payment_status)
+        query = query.where(Order.payment_status == payment_status)
     if search:
-        query = query.filter(
+        query = query.where(
             or_(
                 Order.order_number.ilike(f"%{search}%"),
                 Order.customer_name.ilike(f"%{search}%"),
@@ -245,16 +290,13 @@ async def get_all_orders(
             )
         )
     
-    # Apply sorting
-    sort_column = getattr(Order, sort_by, Order.created_at)
-    if sort_order.lower() == "desc":
-        query = query.order_by(desc(sort_column))
-    else:
-        query = query.order_by(asc(sort_column))
-    
-    # Apply pagination
-    offset = (page - 1) * limit
-    orders = query.offset(offset).limit(limit).all()
+    # Apply sorting and pagination (keyset when a cursor is given)
+    query, page_state = order_paginator.apply(
+        query, sort_by, sort_order, cursor, limit, (page - 1) * limit, db.bind.dialect.name
+    )
+    result = await db.execute(query)
+    orders, next_cursor, prev_cursor = order_paginator.page(result.scalars().all(), page_state)
+    set_cursor_headers(response, next_cursor, prev_cursor)
     
     return orders
 
@@ -262,13 +304,13 @@ async def get_all_orders(
 async def get_order_by_id(
     order_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get order by ID (admin only)"""
     if current_user.role not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await load_order(db, Order.id == order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -279,18 +321,27 @@ async def update_order_status(
     order_id: int,
     status_update: OrderStatusUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Update order status (admin only)"""
     if current_user.role not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.get(Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     old_status = order.status
     
+    try:
+        await db.run_sync(apply_status_change, order.id, old_status, status_update.status)
+    except StockUnavailable as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail=f"Cannot reopen the order: insufficient stock for product {e.product_id}"
+        )
+    
     # Update order
     order.status = status_update.status
     if status_update.tracking_number:
@@ -318,24 +369,58 @@ async def update_order_status(
     db.add(status_history)
     
     try:
-        db.commit()
-        db.refresh(order)
-        return order
+        await db.commit()
+        return await load_order(db, Order.id == order.id)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to update order: {str(e)}")
 
+@router.put("/admin/{order_id}/payment", response_model=OrderResponse)
+async def update_payment_status(
+    order_id: int,
+    payment_update: OrderPaymentUpdate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Update payment status (admin only); a payment keeps the order's stock past its deadline"""
+    if current_user.role not in ["admin", "super_admin"]:
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+    
+    order = await db.get(Order, order_id)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    if payment_update.payment_status == "paid" and order.payment_status != "paid":
+        # The expiry sweep may have released the stock since the order was loaded
+        if order.status == "cancelled" or (
+            order.reserved_until is not None and not await db.run_sync(commit_reservation, order.id)
+        ):
+            await db.rollback()
+            raise HTTPException(status_code=400, detail="Order is cancelled; its stock is no longer reserved")
+    
+    order.payment_status = payment_update.payment_status
+    if payment_update.payment_reference:
+        order.payment_reference = payment_update.payment_reference
+    
+    try:
+        await db.commit()
+        return await load_order(db, Order.id == order.id)
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Failed to update payment: {str(e)}")
+
 @router.post("/admin/bulk-update")
 async def bulk_update_orders(
     bulk_update: BulkOrderUpdate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Bulk update orders (admin only)"""
     if current_user.role not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    orders = db.query(Order).filter(Order.id.in_(bulk_update.order_ids)).all()
+    result = await db.execute(select(Order).where(Order.id.in_(bulk_update.order_ids)))
+    orders = result.scalars().all()
     if not orders:
         raise HTTPException(status_code=404, detail="No orders found")
     
@@ -346,6 +431,7 @@ async def bulk_update_orders(
             old_status = order.status
             
             if bulk_update.action == "update_status" and bulk_update.status:
+                await db.run_sync(apply_status_change, order.id, old_status, bulk_update.status)
                 order.status = bulk_update.status
                 
                 # Create status history
@@ -359,6 +445,7 @@ async def bulk_update_orders(
                 db.add(status_history)
                 
             elif bulk_update.action == "cancel":
+                await db.run_sync(apply_status_change, order.id, old_status, "cancelled")
                 order.status = "cancelled"
                 
                 status_history = OrderStatusHistory(
@@ -372,17 +459,17 @@ async def bulk_update_orders(
             
             updated_orders.append(order.id)
         
-        db.commit()
+        await db.commit()
         return {"message": f"Updated {len(updated_orders)} orders", "updated_orders": updated_orders}
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=f"Failed to bulk update orders: {str(e)}")
 
 @router.get("/admin/analytics", response_model=OrderAnalytics)
 async def get_order_analytics(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     date_from: Optional[date] = Query(None),
     date_to: Optional[date] = Query(None)
 ):
@@ -390,14 +477,15 @@ async def get_order_analytics(
     if current_user.role not in ["admin", "super_admin"]:
         raise HTTPException(status_code=403, detail="Not enough permissions")
     
-    query = db.query(Order)
+    query = select(Order)
     
     if date_from:
-        query = query.filter(Order.created_at >= date_from)
+        query = query.where(Order.created_at >= date_from)
     if date_to:
-        query = query.filter(Order.created_at <= date_to)
+        query = query.where(Order.created_at <= date_to)
     
-    orders = query.all()
+    result = await db.execute(query)
+    orders = result.scalars().all()
     
     # Calculate analytics
     total_orders = len(orders)
@@ -428,22 +516,23 @@ async def get_order_analytics(
 @router.get("/", response_model=List[OrderListResponse])
 async def get_user_orders(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all orders for the current user"""
-    orders = db.query(Order).filter(Order.user_id == current_user.id).order_by(Order.created_at.desc()).all()
+    result = await db.execute(
+        select(Order).where(Order.user_id == current_user.id).order_by(Order.created_at.desc())
+    )
+    orders = result.scalars().all()
     return orders
 
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_user_order(
     order_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get a specific order for the current user"""
-    order = db.query(Order).filter(
-        and_(Order.id == order_id, Order.user_id == current_user.id)
-    ).first()
+    order = await load_order(db, and_(Order.id == order_id, Order.user_id == current_user.id))
     
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
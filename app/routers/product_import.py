@@ -29,8 +29,11 @@ logger = logging.getLogger(__name__)
 # In-memory storage for import progress (in production, use Redis or database)
 import_progress = {}
 
+# Rows per slug allocation batch
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "200"))
+
 @router.post("/products/upload", response_model=ImportResponse)
-async def upload_products_file(
+def upload_products_file(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
@@ -45,8 +48,8 @@ async def upload_products_file(
             detail="فرمت فایل پشتیبانی نمی‌شود. لطفاً فایل CSV یا Excel ارسال کنید"
         )
     
-    # Check file size (max 10MB)
-    content = await file.read()
+    # Check file size (max 10MB); sync handler, so the upload is read from its spooled file
+    content = file.file.read()
     if len(content) > 10 * 1024 * 1024:
         raise HTTPException(
             status_code=400,
@@ -237,6 +240,14 @@ async def process_import_file(
         errors = []
         
         for i, row in enumerate(rows):
+            if i % IMPORT_CHUNK_SIZE == 0:
+                # Allocate slugs for the chunk's new products in one batch
+                try:
+                    processor.reserve_slugs(rows[i:i + IMPORT_CHUNK_SIZE])
+                except Exception as e:
+                    db.rollback()
+                    logger.warning(f"Import {import_id}: batch slug allocation failed, falling back per row: {e}")
+            
             try:
                 result = await processor.process_product_row(row, user_id)
                 if result.success:
@@ -1,51 +1,90 @@
+import json
 import os
-import uuid
 from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Header, Query
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile, Form, Header, Query, Request, Response
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_, desc, asc
+from sqlalchemy import and_, desc
+from pydantic import TypeAdapter, ValidationError
 from slugify import slugify
 
 from ..database import get_db
-from ..auth import get_current_user, verify_importer_token
-from ..models import Product as ProductModel, User
-from ..schemas import Product, ProductCreate, ProductUpdate
+from ..auth import get_current_user, get_optional_user, verify_importer_token
+from ..models import Category as CategoryModel, Product as ProductModel, User
+from ..schemas import (
+    CategoryUpdate, InventoryAlert, Product, ProductBulkItem, ProductBulkResponse, ProductBulkResult, ProductCreate,
+    ProductUpdate, ReorderThresholdUpdate
+)
+from ..utils.product_search import apply_text_search
+from ..utils.search_index import SEARCH_BACKEND, product_index
+from ..utils.pagination import KeysetPaginator, set_cursor_headers
+from ..utils.bulk_products import bulk_update, upsert_products
+from ..utils.catalog_stats import read_alert_counts, read_stats as read_catalog_stats
+from ..utils.category_tree import category_tree, would_cycle
+from ..utils.inventory import ALERT_STATUSES, list_alerts, set_category_threshold
+from ..utils.slugs import allocate_slug
+from ..utils.images import build_variants
+from ..utils.uploads import UploadTooLarge, store_upload
+from ..cache import (
+    PRODUCT_ROWS_TAG, PRODUCTS_TAG, cache_key, cached_read, product_slug_cache, product_tag, slug_tag
+)
 
 router = APIRouter()
 
+# Largest body accepted by POST /bulk
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+bulk_items_adapter = TypeAdapter(List[ProductBulkItem])
 
-def save_uploaded_file(file: UploadFile) -> str:
-    """Save uploaded file and return the URL"""
-    # Create uploads directory if it doesn't exist
-    upload_dir = "uploads"
-    if not os.path.exists(upload_dir):
-        os.makedirs(upload_dir)
-    
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1] if file.filename else ".jpg"
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(upload_dir, unique_filename)
-    
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = file.file.read()
-        buffer.write(content)
-    
-    # Return URL (assuming the app serves static files from /uploads)
-    return f"/uploads/{unique_filename}"
+# Sort keys that can back a pagination cursor
+product_paginator = KeysetPaginator(ProductModel, ["created_at", "updated_at", "price", "name", "stock", "id"])
+
+
+def _serialize(product: ProductModel) -> dict:
+    """JSON-ready product, as stored in the catalog cache"""
+    return Product.model_validate(product).model_dump(mode="json")
+
+
+async def save_uploaded_file(file: UploadFile) -> str:
+    """Stream an uploaded file into the content-addressed upload store and return its URL"""
+    try:
+        return await store_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
 
 
 @router.get("", response_model=List[Product])
 def get_products(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     category: str = None,
     query: str = None,
     active_only: bool = True,
+    cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor / X-Prev-Cursor; replaces skip"),
     db: Session = Depends(get_db)
 ):
+    if SEARCH_BACKEND == "memory" and query and len(query.strip()) >= 2:
+        products, _ = product_index.search(query, skip, limit, active_only, category)
+        return products
+    
+    def load(session: Session):
+        return _load_product_page(session, skip, limit, category, query, active_only, cursor)
+    
+    key = cache_key(
+        "products:list", skip=skip, limit=limit, category=category,
+        query=query, active_only=active_only, cursor=cursor
+    )
+    page = cached_read(db, key, load, tags=[PRODUCTS_TAG])
+    set_cursor_headers(response, page["next_cursor"], page["prev_cursor"])
+    return page["products"]
+
+
+def _load_product_page(db: Session, skip, limit, category, query, active_only, cursor) -> dict:
     db_query = db.query(ProductModel)
     
     if active_only:
@@ -54,22 +93,68 @@ def get_products(
     if category:
         db_query = db_query.filter(ProductModel.category == category)
     
-    # Search functionality
+    # Full-text search, ranked by relevance
+    relevance = None
     if query and len(query.strip()) >= 2:
-        search_term = f"%{query.strip()}%"
-        db_query = db_query.filter(
-            ProductModel.name.ilike(search_term) |
-            ProductModel.description.ilike(search_term) |
-            ProductModel.category.ilike(search_term)
+        db_query, relevance = apply_text_search(db_query, query, db.get_bind().dialect.name)
+    
+    next_cursor = prev_cursor = None
+    if relevance is not None:
+        if cursor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cursor pagination is not available for search results"
+            )
+        db_query = db_query.order_by(relevance, ProductModel.created_at.desc())
+        products = db_query.offset(skip).limit(limit).all()
+    else:
+        db_query, page_state = product_paginator.apply(
+            db_query, "created_at", "desc", cursor, limit, skip, db.get_bind().dialect.name
         )
+        products, next_cursor, prev_cursor = product_paginator.page(db_query.all(), page_state)
     
-    products = db_query.order_by(ProductModel.created_at.desc()).offset(skip).limit(limit).all()
-    return products
+    return {
+        "products": [_serialize(product) for product in products],
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor
+    }
+
+
+@router.get("/categories/tree")
+def get_category_tree(active_only: bool = True, db: Session = Depends(get_db)):
+    """Nested categories with product counts (including subcategories)"""
+    return category_tree.tree(db, active_only)
+
+
+@router.get("/by-slug/{slug}", response_model=Product)
+def get_product_by_slug(slug: str, db: Session = Depends(get_db)):
+    """Product detail by slug, served from the in-process slug cache when hot"""
+    def load():
+        product = db.query(ProductModel).filter(ProductModel.slug == slug).first()
+        return _serialize(product) if product else None
+    
+    # Found: invalidated by writes to the product (rename, delete).
+    # Missing: cached briefly, invalidated when a product takes the slug.
+    product = product_slug_cache.get_or_load(
+        slug, load, tags=[slug_tag(slug), PRODUCT_ROWS_TAG]
+    )
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    return product
 
 
 @router.get("/{product_id}", response_model=Product)
 def get_product(product_id: int, db: Session = Depends(get_db)):
-    product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
+    def load(session: Session):
+        product = session.query(ProductModel).filter(ProductModel.id == product_id).first()
+        return _serialize(product) if product else None
+    
+    product = cached_read(
+        db, f"product:{product_id}", load, tags=[product_tag(product_id), PRODUCT_ROWS_TAG]
+    )
     if not product:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -79,7 +164,7 @@ def get_product(product_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("", response_model=Product)
-async def create_product(
+def create_product(
     name: str = Form(...),
     description: str = Form(None),
     category: str = Form(None),
@@ -89,6 +174,7 @@ async def create_product(
     is_active: bool = Form(True),
     image_url: str = Form(None),
     image_file: UploadFile = File(None),
+    reorder_threshold: Optional[int] = Form(None, ge=0),
     db: Session = Depends(get_db),
     x_importer_key: str = Header(None),
     current_user: User = Depends(get_current_user, use_cache=False)
@@ -111,20 +197,23 @@ async def create_product(
     final_image_url = image_url
     if image_file:
         try:
-            final_image_url = save_uploaded_file(image_file)
+            # Sync handler (its session may wait on the SQLite writer lock) runs
+            # in a worker thread; the upload streams on the event loop
+            final_image_url = anyio.from_thread.run(save_uploaded_file, image_file)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to save image: {str(e)}"
             )
     
+    # Resized WebP/JPEG variants, generated in the image process pool
+    image_variants = anyio.from_thread.run(build_variants, final_image_url)
+    
     # Generate unique slug
     base_slug = slugify(name, allow_unicode=True) if name else "product"
-    slug = base_slug
-    counter = 1
-    while db.query(ProductModel).filter(ProductModel.slug == slug).first():
-        slug = f"{base_slug}-{counter}"
-        counter += 1
+    slug = allocate_slug(db, base_slug)
     
     # Create product
     product_data = {
@@ -136,6 +225,8 @@ async def create_product(
         "stock": stock,
         "is_active": is_active,
         "image_url": final_image_url,
+        "image_variants": image_variants,
+        "reorder_threshold": reorder_threshold,
         "slug": slug
     }
     
@@ -149,9 +240,97 @@ async def create_product(
 
 # Override the dependency for create_product to make auth optional
 @router.post("", response_model=Product, dependencies=[])
-async def create_product_override(*args, **kwargs):
+def create_product_override(*args, **kwargs):
     # Remove the current_user dependency and handle auth manually
-    return await create_product(*args, **kwargs)
+    return create_product(*args, **kwargs)
+
+
+@router.post("/bulk", response_model=ProductBulkResponse)
+def bulk_upsert_products(
+    request: Request,
+    db: Session = Depends(get_db),
+    x_importer_key: str = Header(None),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Create or update many products from a JSON array or NDJSON body.
+    
+    Items are matched by slug, else by name (see upsert_products); the
+    response has one result per item, in order. Authentication via admin JWT
+    or X-Importer-Key header (supplier feeds, the Telegram bot).
+    """
+    has_admin_auth = current_user is not None and current_user.role in ['admin', 'super_admin']
+    has_importer_auth = x_importer_key and verify_importer_token(x_importer_key)
+    if not has_admin_auth and not has_importer_auth:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication required"
+        )
+    
+    # Sync handler runs in a worker thread; the body is read on the event loop
+    body = anyio.from_thread.run(request.body)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    
+    # Parse errors in NDJSON lines are per item; a malformed JSON document fails the request
+    parse_errors = {}
+    if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        raw_items = []
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                raw_items.append(json.loads(line))
+            except ValueError as e:
+                parse_errors[len(raw_items)] = [f"Invalid JSON: {e}"]
+                raw_items.append(None)
+    else:
+        try:
+            document = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid JSON: {e}"
+            )
+        raw_items = document.get("products") if isinstance(document, dict) else document
+        if not isinstance(raw_items, list):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Expected a JSON array of products or {\"products\": [...]}"
+            )
+    
+    if len(raw_items) > BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BULK_MAX_ITEMS} products per request"
+        )
+    
+    # One validation pass over the whole list; failing items are reported, the rest upserted
+    errors = dict(parse_errors)
+    try:
+        bulk_items_adapter.validate_python([item for item in raw_items if item is not None])
+    except ValidationError as e:
+        positions = [index for index, item in enumerate(raw_items) if item is not None]
+        for error in e.errors():
+            index = positions[error["loc"][0]]
+            field = ".".join(str(part) for part in error["loc"][1:])
+            errors.setdefault(index, []).append(f"{field}: {error['msg']}" if field else error["msg"])
+    valid_indexes = [index for index in range(len(raw_items)) if index not in errors]
+    valid_items = bulk_items_adapter.validate_python([raw_items[index] for index in valid_indexes])
+    
+    results = [
+        ProductBulkResult(index=index, status="error", errors=item_errors)
+        for index, item_errors in errors.items()
+    ]
+    for index, result in zip(valid_indexes, upsert_products(db, valid_items)):
+        results.append(ProductBulkResult(index=index, **result))
+    results.sort(key=lambda result: result.index)
+    
+    return ProductBulkResponse(
+        created=sum(1 for result in results if result.status == "created"),
+        updated=sum(1 for result in results if result.status == "updated"),
+        failed=sum(1 for result in results if result.status == "error"),
+        results=results
+    )
 
 
 def get_current_user_optional(db: Session = Depends(get_db)):
@@ -177,30 +356,13 @@ def get_product_stats(
             detail="Admin access required"
         )
     
-    # Basic stats
-    total_products = db.query(ProductModel).count()
-    active_products = db.query(ProductModel).filter(ProductModel.is_active == True).count()
-    out_of_stock = db.query(ProductModel).filter(ProductModel.stock <= 0).count()
-    low_stock = db.query(ProductModel).filter(and_(ProductModel.stock > 0, ProductModel.stock <= 10)).count()
+    # Counters come from the catalog_stats summary table
+    stats = read_catalog_stats(db)
     
-    # Category distribution
-    categories = db.query(
-        ProductModel.category,
-        func.count(ProductModel.id).label('count')
-    ).filter(ProductModel.category.isnot(None)).group_by(ProductModel.category).all()
+    # Recent products (index scan on created_at)
+    stats["recent_products"] = db.query(ProductModel).order_by(desc(ProductModel.created_at)).limit(5).all()
     
-    # Recent products
-    recent_products = db.query(ProductModel).order_by(desc(ProductModel.created_at)).limit(5).all()
-    
-    return {
-        "total_products": total_products,
-        "active_products": active_products,
-        "inactive_products": total_products - active_products,
-        "out_of_stock": out_of_stock,
-        "low_stock": low_stock,
-        "categories": [{"name": cat[0], "count": cat[1]} for cat in categories],
-        "recent_products": recent_products
-    }
+    return stats
 
 
 @router.get("/admin/search")
@@ -209,10 +371,11 @@ def admin_search_products(
     category: Optional[str] = Query(None, description="Filter by category"),
     status: Optional[str] = Query(None, description="Filter by status (active/inactive)"),
     stock_filter: Optional[str] = Query(None, description="Filter by stock (in_stock/out_of_stock/low_stock)"),
-    sort_by: Optional[str] = Query("created_at", description="Sort by field"),
+    sort_by: Optional[str] = Query(None, description="Sort by field (defaults to relevance when searching, else created_at)"),
     sort_order: Optional[str] = Query("desc", description="Sort order (asc/desc)"),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(20, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from pagination.next_cursor / prev_cursor; replaces page"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
@@ -226,16 +389,9 @@ def admin_search_products(
     query = db.query(ProductModel)
     
     # Apply filters
-    if q:
-        search_term = f"%{q.strip()}%"
-        query = query.filter(
-            or_(
-                ProductModel.name.ilike(search_term),
-                ProductModel.description.ilike(search_term),
-                ProductModel.category.ilike(search_term),
-                ProductModel.slug.ilike(search_term)
-            )
-        )
+    relevance = None
+    if q and q.strip():
+        query, relevance = apply_text_search(query, q, db.get_bind().dialect.name)
     
     if category:
         query = query.filter(ProductModel.category == category)
@@ -245,26 +401,33 @@ def admin_search_products(
     elif status == "inactive":
         query = query.filter(ProductModel.is_active == False)
     
+    # Low stock is relative to each product's reorder threshold
     if stock_filter == "out_of_stock":
         query = query.filter(ProductModel.stock <= 0)
     elif stock_filter == "low_stock":
-        query = query.filter(and_(ProductModel.stock > 0, ProductModel.stock <= 10))
+        query = query.filter(and_(ProductModel.stock > 0, ProductModel.stock <= ProductModel.alert_threshold))
     elif stock_filter == "in_stock":
-        query = query.filter(ProductModel.stock > 10)
-    
-    # Apply sorting
-    sort_field = getattr(ProductModel, sort_by, ProductModel.created_at)
-    if sort_order == "asc":
-        query = query.order_by(asc(sort_field))
-    else:
-        query = query.order_by(desc(sort_field))
+        query = query.filter(ProductModel.stock > ProductModel.alert_threshold)
     
     # Get total count for pagination
     total = query.count()
-    
-    # Apply pagination
     offset = (page - 1) * per_page
-    products = query.offset(offset).limit(per_page).all()
+    
+    # Apply sorting and pagination
+    next_cursor = prev_cursor = None
+    if relevance is not None and sort_by in (None, "relevance"):
+        if cursor:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cursor pagination is not available for relevance ordering"
+            )
+        query = query.order_by(relevance, desc(ProductModel.created_at))
+        products = query.offset(offset).limit(per_page).all()
+    else:
+        query, page_state = product_paginator.apply(
+            query, sort_by, sort_order, cursor, per_page, offset, db.get_bind().dialect.name
+        )
+        products, next_cursor, prev_cursor = product_paginator.page(query.all(), page_state)
     
     return {
         "products": products,
@@ -272,7 +435,9 @@ def admin_search_products(
             "page": page,
             "per_page": per_page,
             "total": total,
-            "pages": (total + per_page - 1) // per_page
+            "pages": (total + per_page - 1) // per_page,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor
         }
     }
 
@@ -310,24 +475,23 @@ def update_product(
     final_image_url = image_url or product.image_url
     if image_file:
         try:
-            final_image_url = save_uploaded_file(image_file)
+            # Sync handler runs in a worker thread; the upload streams on the event loop
+            final_image_url = anyio.from_thread.run(save_uploaded_file, image_file)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to save image: {str(e)}"
             )
     
+    if final_image_url != product.image_url:
+        product.image_variants = anyio.from_thread.run(build_variants, final_image_url)
+    
     # Update slug if name changed
     if name != product.name:
         base_slug = slugify(name, allow_unicode=True) if name else "product"
-        slug = base_slug
-        counter = 1
-        while db.query(ProductModel).filter(
-            and_(ProductModel.slug == slug, ProductModel.id != product_id)
-        ).first():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        product.slug = slug
+        product.slug = allocate_slug(db, base_slug, current_slug=product.slug)
     
     # Update fields
     product.name = name
@@ -387,35 +551,21 @@ def bulk_update_products(
             detail="Admin access required"
         )
     
-    products = db.query(ProductModel).filter(ProductModel.id.in_(product_ids)).all()
+    # Chunked set-based UPDATE/DELETE; also updates stats, caches and the search index
+    try:
+        updated_count = bulk_update(db, product_ids, action, category)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     
-    if not products:
+    if not updated_count:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="No products found"
         )
     
-    updated_count = 0
-    
-    for product in products:
-        if action == "activate":
-            product.is_active = True
-            updated_count += 1
-        elif action == "deactivate":
-            product.is_active = False
-            updated_count += 1
-        elif action == "update_category" and category:
-            product.category = category
-            updated_count += 1
-        elif action == "delete":
-            db.delete(product)
-            updated_count += 1
-        
-        if action != "delete":
-            product.updated_at = datetime.utcnow()
-    
-    db.commit()
-    
     return {
         "message": f"Bulk {action} completed",
         "updated_count": updated_count
@@ -427,53 +577,159 @@ def get_categories(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get all unique categories with product counts"""
+    """Get all categories with product counts"""
     if not current_user or current_user.role not in ['admin', 'super_admin']:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
     
-    categories = db.query(
-        ProductModel.category,
-        func.count(ProductModel.id).label('product_count'),
-        func.sum(ProductModel.stock).label('total_stock'),
-        func.avg(ProductModel.price).label('avg_price')
-    ).filter(ProductModel.category.isnot(None)).group_by(ProductModel.category).all()
-    
-    return [
-        {
-            "name": cat[0],
-            "product_count": cat[1],
-            "total_stock": cat[2] or 0,
-            "avg_price": float(cat[3]) if cat[3] else 0
-        }
-        for cat in categories
-    ]
+    # In-memory category tree; counters follow product writes
+    return category_tree.categories(db)
+
+
+@router.put("/admin/categories/{category_id}")
+def update_category(
+    category_id: int,
+    category_update: CategoryUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Move a category in the tree, activate/deactivate it or change its description"""
+    if not current_user or current_user.role not in ['admin', 'super_admin']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    
+    category = db.query(CategoryModel).filter(CategoryModel.id == category_id).first()
+    if not category:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Category not found"
+        )
+    
+    values = category_update.model_dump(exclude_unset=True)
+    parent_id = values.get("parent_id")
+    if parent_id is not None:
+        if not db.query(CategoryModel.id).filter(CategoryModel.id == parent_id).first():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Parent category not found"
+            )
+        if would_cycle(db.connection(), category_id, parent_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="A category cannot be moved under itself or its subcategories"
+            )
+    
+    for key, value in values.items():
+        setattr(category, key, value)
+    db.commit()
+    
+    return {
+        "id": category.id,
+        "name": category.name,
+        "slug": category.slug,
+        "parent_id": category.parent_id,
+        "description": category.description,
+        "is_active": category.is_active
+    }
 
 
 @router.get("/admin/inventory-alerts")
 def get_inventory_alerts(
+    alert_status: Optional[str] = Query(None, alias="status", description="Only out_of_stock or low_stock products"),
+    category: Optional[str] = Query(None, description="Filter by category"),
+    count_only: bool = Query(False, description="Return only the counts (for badges)"),
+    limit: int = Query(50, ge=1, le=200, description="Products per page"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from pagination.next_cursor / prev_cursor"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Get products that need inventory attention"""
+    """Active products at or below their reorder threshold, lowest stock first"""
     if not current_user or current_user.role not in ['admin', 'super_admin']:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
     
-    out_of_stock = db.query(ProductModel).filter(
-        and_(ProductModel.stock <= 0, ProductModel.is_active == True)
-    ).all()
+    if alert_status is not None and alert_status not in ALERT_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"status must be one of: {', '.join(ALERT_STATUSES)}"
+        )
+    
+    # Counts come from catalog_stats; the listing walks a partial index of alerting products
+    counts = read_alert_counts(db, category)
+    if count_only:
+        return counts
     
-    low_stock = db.query(ProductModel).filter(
-        and_(ProductModel.stock > 0, ProductModel.stock <= 10, ProductModel.is_active == True)
-    ).all()
+    alerts, next_cursor, prev_cursor = list_alerts(db, alert_status, category, cursor, limit)
     
     return {
-        "out_of_stock": out_of_stock,
-        "low_stock": low_stock,
-        "alerts_count": len(out_of_stock) + len(low_stock)
+        **counts,
+        "alerts": [InventoryAlert.model_validate(alert) for alert in alerts],
+        "pagination": {
+            "limit": limit,
+            "next_cursor": next_cursor,
+            "prev_cursor": prev_cursor
+        }
     }
+
+
+@router.put("/admin/inventory-thresholds/categories/{category_name}")
+def set_category_reorder_threshold(
+    category_name: str,
+    threshold: ReorderThresholdUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Set the reorder threshold of a category's products that don't have their own"""
+    if not current_user or current_user.role not in ['admin', 'super_admin']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    
+    updated_count = set_category_threshold(db, category_name, threshold.reorder_threshold)
+    if updated_count is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Category not found"
+        )
+    
+    return {
+        "category": category_name,
+        "reorder_threshold": threshold.reorder_threshold,
+        "updated_count": updated_count
+    }
+
+
+@router.put("/admin/inventory-thresholds/products/{product_id}", response_model=InventoryAlert)
+def set_product_reorder_threshold(
+    product_id: int,
+    threshold: ReorderThresholdUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Set a product's own reorder threshold; null falls back to its category's"""
+    if not current_user or current_user.role not in ['admin', 'super_admin']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    
+    product = db.query(ProductModel).filter(ProductModel.id == product_id).first()
+    if not product:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Product not found"
+        )
+    
+    # alert_threshold and the alert counters follow in the flush hooks
+    product.reorder_threshold = threshold.reorder_threshold
+    db.commit()
+    db.refresh(product)
+    
+    return product
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, HttpUrl
-from typing import Optional, List, Any
+from pydantic import BaseModel, Field, HttpUrl, computed_field
+from typing import Optional, List, Any, Literal
 from datetime import datetime
 
 
@@ -97,12 +97,100 @@ class ProductUpdate(BaseModel):
     is_active: Optional[bool] = None
 
 
+class ImageSource(BaseModel):
+    width: int
+    webp: str
+    jpeg: str
+
+
+class ProductImageVariants(BaseModel):
+    width: int
+    height: int
+    placeholder: str  # tiny blurred preview as a data: URI
+    sources: List[ImageSource]
+
+
 class Product(ProductBase):
     id: int
     slug: str
+    category_id: Optional[int] = None
+    image_variants: Optional[ProductImageVariants] = None
     created_at: datetime
     updated_at: datetime
     
+    @computed_field
+    @property
+    def image_srcset(self) -> Optional[str]:
+        """JPEG srcset for <img>; None when only image_url is available"""
+        if not self.image_variants:
+            return None
+        return ", ".join(f"{source.jpeg} {source.width}w" for source in self.image_variants.sources)
+    
+    @computed_field
+    @property
+    def image_webp_srcset(self) -> Optional[str]:
+        """WebP srcset for a <picture> <source type="image/webp">"""
+        if not self.image_variants:
+            return None
+        return ", ".join(f"{source.webp} {source.width}w" for source in self.image_variants.sources)
+    
+    class Config:
+        from_attributes = True
+
+
+class ProductBulkItem(ProductBase):
+    name: str = Field(..., min_length=1, max_length=200)
+    category: Optional[str] = Field(None, max_length=100)
+    price: int = Field(..., ge=0)
+    currency: str = Field("IRT", max_length=10)
+    stock: int = Field(0, ge=0)
+    # None falls back to the category's threshold
+    reorder_threshold: Optional[int] = Field(None, ge=0)
+    # Upsert key; items without one update the product with the same name, if any
+    slug: Optional[str] = Field(None, min_length=1, max_length=250)
+
+
+class ProductBulkResult(BaseModel):
+    index: int
+    status: str  # "created", "updated" or "error"
+    id: Optional[int] = None
+    slug: Optional[str] = None
+    errors: Optional[List[str]] = None
+
+
+class ProductBulkResponse(BaseModel):
+    created: int
+    updated: int
+    failed: int
+    results: List[ProductBulkResult]
+
+
+class CategoryUpdate(BaseModel):
+    parent_id: Optional[int] = None  # None makes the category a root
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
+
+
+class ReorderThresholdUpdate(BaseModel):
+    # None clears the threshold (products fall back to their category's, categories to the default)
+    reorder_threshold: Optional[int] = Field(None, ge=0)
+
+
+class InventoryAlert(BaseModel):
+    id: int
+    name: str
+    slug: str
+    category: Optional[str] = None
+    stock: int
+    reorder_threshold: Optional[int] = None
+    alert_threshold: int
+    
+    @computed_field
+    @property
+    def status(self) -> str:
+        """out_of_stock at zero (or negative) stock, otherwise low_stock"""
+        return "out_of_stock" if self.stock <= 0 else "low_stock"
+    
     class Config:
         from_attributes = True
 
@@ -121,14 +209,16 @@ class CartItemUpdate(BaseModel):
 
 
 class CartItem(CartItemBase):
+    # Guest cart lines (user_id None) use the product id as their id and
+    # have no timestamps
     id: int
-    user_id: int
+    user_id: Optional[int] = None
     product_name: str
     product_price: int
     product_image_url: Optional[str] = None
     total_price: int
-    created_at: datetime
-    updated_at: datetime
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
@@ -141,6 +231,17 @@ class CartResponse(BaseModel):
     currency: str = "IRR"
 
 
+class CartOperation(BaseModel):
+    """One step of POST /cart/batch; products are referenced by id, and remove takes no quantity"""
+    op: Literal["add", "update", "remove"]
+    product_id: int
+    quantity: Optional[int] = Field(None, gt=0)
+
+
+class CartBatch(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=100)
+
+
 class OrderItemBase(BaseModel):
     product_id: int
     product_name: str
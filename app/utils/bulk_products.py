@@ -0,0 +1,289 @@
+"""
+Set-based bulk product writes.
+
+``bulk_update`` (admin bulk actions) and ``upsert_products`` (the bulk JSON
+API) work in chunks: one narrow SELECT for the old values the catalog_stats
+deltas and cache tags need, then one UPDATE, DELETE or multi-row
+``INSERT ... ON CONFLICT`` per chunk, instead of loading and flushing an ORM
+object per product. The statements are Core statements, so the session hooks
+that normally follow ORM writes don't see them; this module feeds
+catalog_stats, the catalog caches and the search index itself, batched per
+call.
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from slugify import slugify
+from sqlalchemy import case, delete, func, insert, null, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.cache import product_tags, queue_tags
+from app.models import Product as ProductModel
+from app.schemas import ProductBulkItem
+from app.utils.catalog_stats import TRACKED_ATTRIBUTES, add_product, apply_deltas, new_deltas
+from app.utils.category_tree import ensure_categories
+from app.utils.inventory import THRESHOLD_SOURCES, category_thresholds, resolve_threshold
+from app.utils.search_index import queue_changes as queue_index_changes
+from app.utils.slugs import allocate_slugs
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# Rows per multi-row INSERT (x 10 columns stays under SQLite's bound-parameter limit)
+BULK_UPSERT_CHUNK_SIZE = int(os.getenv("BULK_UPSERT_CHUNK_SIZE", "500"))
+
+ACTIONS = ("activate", "deactivate", "update_category", "delete")
+
+
+def _chunks(ids: List[int], size: int) -> Iterable[List[int]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _new_values(action: str, category: Optional[str]) -> Dict[str, object]:
+    if action == "activate":
+        return {"is_active": True}
+    if action == "deactivate":
+        return {"is_active": False}
+    return {"category": category}
+
+
+def bulk_update(
+    db: Session,
+    product_ids: Iterable[int],
+    action: str,
+    category: Optional[str] = None,
+    chunk_size: int = BULK_CHUNK_SIZE,
+) -> int:
+    """
+    Apply ``action`` to the given products and commit; returns the number of rows affected.
+
+    ``action`` is one of ACTIONS; update_category needs ``category``.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown bulk action: {action}")
+    if action == "update_category" and not category:
+        raise ValueError("category is required for update_category")
+
+    table = ProductModel.__table__
+    ids = sorted(set(product_ids))
+    values = None if action == "delete" else _new_values(action, category)
+    returning = db.get_bind().dialect.update_returning
+
+    category_threshold = None
+    if action == "update_category":
+        values["category_id"] = ensure_categories(db, [category])[category]
+        # Products without their own threshold take the new category's
+        category_threshold = category_thresholds(db.connection(), [category]).get(category)
+        values["alert_threshold"] = func.coalesce(
+            table.c.reorder_threshold, resolve_threshold(None, category_threshold)
+        )
+
+    affected = 0
+    deltas = new_deltas()
+    touched_ids: List[int] = []
+    slugs: List[str] = []
+    updated_rows: List[dict] = []
+
+    for chunk in _chunks(ids, chunk_size):
+        # Row locks (PostgreSQL) keep the old values valid until the statement below
+        old_rows = db.execute(
+            select(
+                table.c.id, table.c.slug, table.c.category, table.c.is_active, table.c.stock,
+                table.c.reorder_threshold, table.c.alert_threshold, table.c.price
+            )
+            .where(table.c.id.in_(chunk))
+            .with_for_update()
+        ).all()
+        if not old_rows:
+            continue
+
+        for row in old_rows:
+            add_product(deltas, row.category, row.is_active, row.stock, row.alert_threshold, row.price, sign=-1)
+            if values is not None:
+                threshold = row.alert_threshold
+                if action == "update_category":
+                    threshold = resolve_threshold(row.reorder_threshold, category_threshold)
+                add_product(
+                    deltas, values.get("category", row.category), values.get("is_active", row.is_active), row.stock,
+                    threshold, row.price
+                )
+            touched_ids.append(row.id)
+            slugs.append(row.slug)
+
+        if values is None:
+            result = db.execute(delete(table).where(table.c.id.in_(chunk)))
+            affected += result.rowcount
+            continue
+
+        statement = update(table).where(table.c.id.in_(chunk)).values(updated_at=func.now(), **values)
+        if returning:
+            rows = db.execute(statement.returning(*table.c)).all()
+            affected += len(rows)
+        else:
+            affected += db.execute(statement).rowcount
+            rows = db.execute(select(table).where(table.c.id.in_(chunk))).all()
+        updated_rows.extend(row._asdict() for row in rows)
+
+    if touched_ids:
+        apply_deltas(db, deltas)
+        queue_tags(db, product_tags(touched_ids, slugs))
+        if values is None:
+            queue_index_changes(db, removed_ids=touched_ids)
+        else:
+            queue_index_changes(db, rows=updated_rows)
+    db.commit()
+    return affected
+
+
+def _upsert_statement(table, dialect_name: str, rows: List[Dict[str, Any]], fields: Iterable[str]):
+    """Multi-row ``INSERT ... ON CONFLICT (slug) DO UPDATE`` of ``fields``"""
+    dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+    stmt = dialect_insert(table).values(rows)
+    set_ = {field: stmt.excluded[field] for field in fields}
+    set_["updated_at"] = func.now()
+    if "image_url" in set_:
+        # Variants belong to the old image; the new one has none yet
+        set_["image_variants"] = case(
+            (table.c.image_url.is_not_distinct_from(stmt.excluded.image_url), table.c.image_variants),
+            else_=null()
+        )
+    return stmt.on_conflict_do_update(index_elements=["slug"], set_=set_).returning(*table.c)
+
+
+def upsert_products(db: Session, items: List[ProductBulkItem]) -> List[Dict[str, Any]]:
+    """
+    Create or update ``items`` and commit; one result dict per item, in order.
+
+    An item updates the product with its ``slug`` or, without one, the
+    product with the same name (like the CSV and Telegram importers); other
+    items are created with a freshly allocated slug. Updates only overwrite
+    the fields the item sets. Repeated keys within one call are rejected.
+    """
+    table = ProductModel.__table__
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+
+    # Reject repeated keys: one statement can't upsert the same row twice
+    first_index: Dict[tuple, int] = {}
+    pending: List[int] = []
+    for index, item in enumerate(items):
+        key = ("slug", item.slug) if item.slug else ("name", item.name)
+        if key in first_index:
+            results[index] = {"status": "error", "errors": [f"Duplicate of item {first_index[key]}"]}
+        else:
+            first_index[key] = index
+            pending.append(index)
+
+    # Match slug-less items to existing products by name
+    slugs: Dict[int, str] = {index: items[index].slug for index in pending if items[index].slug}
+    by_name = [index for index in pending if index not in slugs]
+    names = list({items[index].name for index in by_name})
+    existing_by_name: Dict[str, str] = {}
+    for chunk in _chunks(names, BULK_CHUNK_SIZE):
+        for name, slug in db.execute(
+            select(table.c.name, table.c.slug).where(table.c.name.in_(chunk)).order_by(table.c.id.desc())
+        ):
+            existing_by_name[name] = slug
+    claimed = {slug: index for index, slug in slugs.items()}
+    unmatched = []
+    for index in by_name:
+        slug = existing_by_name.get(items[index].name)
+        if slug is None:
+            unmatched.append(index)
+        elif slug in claimed:
+            results[index] = {"status": "error", "errors": [f"Duplicate of item {claimed[slug]}"]}
+            pending.remove(index)
+        else:
+            slugs[index] = claimed[slug] = slug
+    # Fresh slugs are free in products, but may be one an item names explicitly
+    while unmatched:
+        allocated = allocate_slugs(db, [slugify(items[index].name, allow_unicode=True) for index in unmatched])
+        clashing = []
+        for index, slug in zip(unmatched, allocated):
+            if slug in claimed:
+                clashing.append(index)
+            else:
+                slugs[index] = claimed[slug] = slug
+        unmatched = clashing
+
+    # Old values of the rows about to be updated
+    existing: Dict[str, Any] = {}
+    for chunk in _chunks(list(slugs.values()), BULK_CHUNK_SIZE):
+        for row in db.execute(
+            select(
+                table.c.slug, table.c.category, table.c.is_active, table.c.stock, table.c.image_url,
+                table.c.reorder_threshold, table.c.alert_threshold, table.c.price
+            )
+            .where(table.c.slug.in_(chunk))
+            .with_for_update()
+        ):
+            existing[row.slug] = row
+
+    # Items setting the same fields share a statement
+    groups: Dict[frozenset, List[int]] = {}
+    for index in pending:
+        fields = frozenset(items[index].model_fields_set - {"slug"})
+        if "category" in fields:
+            fields |= {"category_id"}
+        if fields & set(THRESHOLD_SOURCES):
+            fields |= {"alert_threshold"}
+        groups.setdefault(fields, []).append(index)
+
+    category_ids = ensure_categories(db, [items[index].category for index in pending])
+
+    thresholds = category_thresholds(
+        db.connection(), [items[index].category for index in pending] + [old.category for old in existing.values()]
+    )
+
+    dialect_name = db.get_bind().dialect.name
+    written: Dict[str, dict] = {}
+    for fields, indexes in groups.items():
+        for chunk in _chunks(indexes, BULK_UPSERT_CHUNK_SIZE):
+            rows = [dict(items[index].model_dump(exclude={"slug"}), slug=slugs[index]) for index in chunk]
+            for row in rows:
+                row["category_id"] = category_ids.get(row["category"])
+                # Resolved from the values the row will have after the statement
+                old = existing.get(row["slug"])
+                if old is not None:
+                    source = {key: row[key] if key in fields else getattr(old, key) for key in THRESHOLD_SOURCES}
+                else:
+                    source = row
+                row["alert_threshold"] = resolve_threshold(
+                    source["reorder_threshold"], thresholds.get(source["category"])
+                )
+            if dialect_name in ("sqlite", "postgresql"):
+                returned = db.execute(_upsert_statement(table, dialect_name, rows, fields)).all()
+            else:
+                new_rows = [row for row in rows if row["slug"] not in existing]
+                if new_rows:
+                    db.execute(insert(table), new_rows)
+                for row in rows:
+                    old = existing.get(row["slug"])
+                    if old is None:
+                        continue
+                    values = {field: row[field] for field in fields}
+                    if "image_url" in values and values["image_url"] != old.image_url:
+                        values["image_variants"] = None
+                    db.execute(update(table).where(table.c.slug == row["slug"]).values(updated_at=func.now(), **values))
+                returned = db.execute(select(table).where(table.c.slug.in_([row["slug"] for row in rows]))).all()
+            for row in returned:
+                written[row.slug] = row._asdict()
+
+    deltas = new_deltas()
+    for old in existing.values():
+        add_product(deltas, old.category, old.is_active, old.stock, old.alert_threshold, old.price, sign=-1)
+    for row in written.values():
+        add_product(deltas, *(row[key] for key in TRACKED_ATTRIBUTES))
+    apply_deltas(db, deltas)
+    queue_tags(db, product_tags([row["id"] for row in written.values()], written))
+    queue_index_changes(db, rows=written.values())
+    db.commit()
+
+    for index in pending:
+        row = written[slugs[index]]
+        results[index] = {
+            "status": "updated" if slugs[index] in existing else "created",
+            "id": row["id"],
+            "slug": row["slug"],
+        }
+    return results
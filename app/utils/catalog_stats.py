@@ -0,0 +1,323 @@
+"""
+Product counters for the admin dashboard.
+
+catalog_stats holds one row for the whole catalog (scope "catalog") and one per
+category (scope "category") with total / active / out-of-stock / low-stock
+product counts, the out-of-stock / low-stock counts of active products that
+the inventory alerts (app.utils.inventory) report, and stock and price sums
+for the category listings (app.utils.category_tree). Low stock means at or
+below the product's ``alert_threshold``.
+
+Session hooks turn each flush's product inserts, updates and deletes into
+counter deltas and apply them in the same transaction, so every writer that
+goes through SessionLocal keeps the table exact and reading it costs the same
+however large the catalog is. Statements that bypass the ORM unit of work must
+call ``apply_deltas`` themselves, or ``rebuild`` afterwards. Once a
+transaction commits, its deltas are passed to the ``subscribe``d callbacks.
+
+Every product write touches the catalog row, so each (scope, name) is split
+over CATALOG_STATS_SLOTS rows: a session adds its deltas to one randomly picked
+slot, concurrent writers rarely wait on each other's row locks, and readers
+sum the slots (``summed_stats``).
+
+Rebuild from scratch with ``python -m app.utils.catalog_stats`` or
+``python manage_db.py rebuild-stats``.
+"""
+
+import logging
+import os
+import random
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import case, cast, delete, event, func, inspect as sa_inspect, insert, literal, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database import RoutingSession, SessionLocal
+from app.models import CatalogStats, Product as ProductModel
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SCOPE = "catalog"
+CATEGORY_SCOPE = "category"
+COUNTERS = (
+    "total", "active", "out_of_stock", "low_stock", "active_out_of_stock", "active_low_stock",
+    "stock_total", "price_total",
+)
+
+# Product attributes the counters depend on, in add_product's argument order
+TRACKED_ATTRIBUTES = ("category", "is_active", "stock", "alert_threshold", "price")
+
+# Rows per (scope, name) that writers spread their deltas over
+CATALOG_STATS_SLOTS = max(1, int(os.getenv("CATALOG_STATS_SLOTS", "16")))
+
+_PENDING_KEY = "catalog_stats_pending"
+_APPLIED_KEY = "catalog_stats_applied"
+_SLOT_KEY = "catalog_stats_slot"
+
+Deltas = Dict[Tuple[str, str], Dict[str, int]]
+
+_subscribers: List[Callable[[Deltas], None]] = []
+
+
+def new_deltas() -> Deltas:
+    return defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+
+def add_product(
+    deltas: Deltas,
+    category: Optional[str],
+    is_active: Any,
+    stock: Optional[int],
+    alert_threshold: Optional[int],
+    price: Optional[int],
+    sign: int = 1,
+):
+    """Add (sign=1) or remove (sign=-1) one product's contribution to ``deltas``"""
+    stock = stock or 0
+    out_of_stock = stock <= 0
+    low_stock = 0 < stock <= (alert_threshold or 0)
+    counts = {
+        "total": 1,
+        "active": 1 if is_active else 0,
+        "out_of_stock": 1 if out_of_stock else 0,
+        "low_stock": 1 if low_stock else 0,
+        "active_out_of_stock": 1 if is_active and out_of_stock else 0,
+        "active_low_stock": 1 if is_active and low_stock else 0,
+        "stock_total": stock,
+        "price_total": price or 0,
+    }
+    keys = [(CATALOG_SCOPE, "")]
+    if category is not None:
+        keys.append((CATEGORY_SCOPE, category))
+    for key in keys:
+        bucket = deltas[key]
+        for counter, value in counts.items():
+            bucket[counter] += sign * value
+
+
+def merge_deltas(target: Deltas, deltas: Deltas):
+    for key, counts in deltas.items():
+        bucket = target[key]
+        for counter, value in counts.items():
+            bucket[counter] += value
+
+
+def apply_deltas(session: Session, deltas: Deltas):
+    """Add ``deltas`` to the session's slot of the stored counters, creating missing rows"""
+    table = CatalogStats.__table__
+    connection = session.connection()
+    dialect_name = connection.dialect.name
+    merge_deltas(session.info.setdefault(_APPLIED_KEY, new_deltas()), deltas)
+    slot = session.info.setdefault(_SLOT_KEY, random.randrange(CATALOG_STATS_SLOTS))
+
+    # Sorted so that transactions touching the same rows lock them in the same order
+    for (scope, name), counts in sorted(deltas.items()):
+        if not any(counts.values()):
+            continue
+
+        if dialect_name in ("sqlite", "postgresql"):
+            dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+            stmt = dialect_insert(table).values(scope=scope, name=name, slot=slot, **counts)
+            set_ = {counter: table.c[counter] + stmt.excluded[counter] for counter in COUNTERS}
+            set_["updated_at"] = func.now()
+            connection.execute(stmt.on_conflict_do_update(index_elements=["scope", "name", "slot"], set_=set_))
+            continue
+
+        values = {counter: table.c[counter] + counts[counter] for counter in COUNTERS}
+        result = connection.execute(
+            update(table)
+            .where(table.c.scope == scope, table.c.name == name, table.c.slot == slot)
+            .values(updated_at=func.now(), **values)
+        )
+        if result.rowcount == 0:
+            connection.execute(insert(table).values(scope=scope, name=name, slot=slot, **counts))
+
+
+def subscribe(callback: Callable[[Deltas], None]):
+    """Call ``callback(deltas)`` with the counter changes of every committed transaction"""
+    _subscribers.append(callback)
+
+
+def summed_stats():
+    """SELECT of scope, name and COUNTERS with each (scope, name)'s slots added up"""
+    table = CatalogStats.__table__
+    # Cast back: PostgreSQL sums bigint columns as numeric
+    sums = [cast(func.sum(table.c[counter]), table.c[counter].type).label(counter) for counter in COUNTERS]
+    return select(table.c.scope, table.c.name, *sums).group_by(table.c.scope, table.c.name)
+
+
+def rebuild_statements():
+    """Statements that recompute catalog_stats from the products table"""
+    table = CatalogStats.__table__
+    # Core columns: usable from migrations without configuring the ORM mappers
+    products = ProductModel.__table__.c
+    # slot is left to its server default, which also keeps these statements
+    # valid in migrations that run before the column exists
+    columns = ["scope", "name", *COUNTERS]
+    out_of_stock = products.stock <= 0
+    low_stock = (products.stock > 0) & (products.stock <= products.alert_threshold)
+    aggregates = [
+        func.count(products.id),
+        func.coalesce(func.sum(case((products.is_active, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((out_of_stock, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((low_stock, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((products.is_active & out_of_stock, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((products.is_active & low_stock, 1), else_=0)), 0),
+        func.coalesce(func.sum(products.stock), 0),
+        func.coalesce(func.sum(products.price), 0),
+    ]
+    catalog = select(literal(CATALOG_SCOPE), literal(""), *aggregates)
+    categories = (
+        select(literal(CATEGORY_SCOPE), products.category, *aggregates)
+        .where(products.category.isnot(None))
+        .group_by(products.category)
+    )
+    return [
+        delete(table),
+        insert(table).from_select(columns, catalog),
+        insert(table).from_select(columns, categories),
+    ]
+
+
+def rebuild(db: Session):
+    """Recompute every counter from scratch in one transaction"""
+    for statement in rebuild_statements():
+        db.execute(statement)
+    db.commit()
+
+
+def read_stats(db: Session) -> Dict[str, Any]:
+    """Dashboard counters: catalog totals and per-category product counts"""
+    rows = db.execute(summed_stats()).all()
+    catalog = next((row for row in rows if row.scope == CATALOG_SCOPE), None)
+    total = catalog.total if catalog else 0
+    active = catalog.active if catalog else 0
+    categories = sorted(
+        (row for row in rows if row.scope == CATEGORY_SCOPE and row.total > 0),
+        key=lambda row: row.name
+    )
+    return {
+        "total_products": total,
+        "active_products": active,
+        "inactive_products": total - active,
+        "out_of_stock": catalog.out_of_stock if catalog else 0,
+        "low_stock": catalog.low_stock if catalog else 0,
+        "categories": [{"name": row.name, "count": row.total} for row in categories],
+    }
+
+
+def read_product_total(db: Session) -> int:
+    """Number of products, from the catalog row"""
+    table = CatalogStats.__table__
+    return db.scalar(
+        select(func.coalesce(func.sum(table.c.total), 0))
+        .where(table.c.scope == CATALOG_SCOPE, table.c.name == "")
+    )
+
+
+def read_alert_counts(db: Session, category: Optional[str] = None) -> Dict[str, int]:
+    """Out-of-stock / low-stock counts of active products, catalog-wide or for one category"""
+    table = CatalogStats.__table__
+    scope, name = (CATEGORY_SCOPE, category) if category is not None else (CATALOG_SCOPE, "")
+    row = db.execute(
+        select(func.sum(table.c.active_out_of_stock), func.sum(table.c.active_low_stock))
+        .where(table.c.scope == scope, table.c.name == name)
+    ).first()
+    out_of_stock, low_stock = row if row and row[0] is not None else (0, 0)
+    return {
+        "out_of_stock": out_of_stock,
+        "low_stock": low_stock,
+        "alerts_count": out_of_stock + low_stock,
+    }
+
+
+def _current_values(product) -> Tuple[Any, ...]:
+    return tuple(getattr(product, key) for key in TRACKED_ATTRIBUTES)
+
+
+def _committed_values(product) -> Optional[Tuple[Any, ...]]:
+    """TRACKED_ATTRIBUTES as last loaded from the database; None if none changed"""
+    state = sa_inspect(product)
+    values = []
+    changed = False
+    for key in TRACKED_ATTRIBUTES:
+        history = state.attrs[key].history
+        if history.deleted:
+            values.append(history.deleted[0])
+            changed = True
+        elif history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            values.append(getattr(product, key))
+    return tuple(values) if changed else None
+
+
+def _load_previous_value(target, value, oldvalue, initiator):
+    """No-op; registered with active_history=True for its side effect"""
+
+
+def install(session_class):
+    """Keep catalog_stats in step with Product writes flushed through ``session_class``"""
+
+    # Make assignments load the previous value so deltas can be computed even
+    # when a product was expired (e.g. after a commit) before being modified
+    for key in TRACKED_ATTRIBUTES:
+        event.listen(getattr(ProductModel, key), "set", _load_previous_value, active_history=True)
+
+    @event.listens_for(session_class, "before_flush")
+    def collect_changes(session, flush_context, instances):
+        # Old values must be read before the flush: deleted rows are gone afterwards
+        deltas = new_deltas()
+        for obj in session.dirty:
+            if isinstance(obj, ProductModel) and obj not in session.deleted:
+                old = _committed_values(obj)
+                if old is not None:
+                    add_product(deltas, *old, sign=-1)
+                    add_product(deltas, *_current_values(obj))
+        for obj in session.deleted:
+            if isinstance(obj, ProductModel):
+                old = _committed_values(obj) or _current_values(obj)
+                add_product(deltas, *old, sign=-1)
+        if deltas:
+            session.info[_PENDING_KEY] = deltas
+
+    @event.listens_for(session_class, "after_flush")
+    def apply_changes(session, flush_context):
+        deltas = session.info.pop(_PENDING_KEY, None) or new_deltas()
+        # New rows are counted after the INSERT, once column defaults are applied
+        for obj in session.new:
+            if isinstance(obj, ProductModel):
+                add_product(deltas, *_current_values(obj))
+        if deltas:
+            apply_deltas(session, deltas)
+
+    @event.listens_for(session_class, "after_commit")
+    def publish_changes(session):
+        applied = session.info.pop(_APPLIED_KEY, None)
+        if applied:
+            for callback in _subscribers:
+                try:
+                    callback(applied)
+                except Exception as e:
+                    logger.error(f"catalog_stats subscriber failed: {e}")
+
+    @event.listens_for(session_class, "after_rollback")
+    def discard_changes(session):
+        session.info.pop(_PENDING_KEY, None)
+        session.info.pop(_APPLIED_KEY, None)
+
+
+# RoutingSession backs both SessionLocal and the async sessions
+install(RoutingSession)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        logger.info(f"catalog_stats rebuilt: {read_stats(db)}")
+    finally:
+        db.close()
@@ -0,0 +1,282 @@
+"""
+Product categories: the products -> categories link and the category tree.
+
+Products reference ``categories`` through ``category_id``; ``products.category``
+keeps the category name as a denormalised copy, so name filters, the search
+index and the existing indexes keep working. A session hook keeps the two in
+step for products written through the ORM: writers set the name, and the
+category (created for names not seen before) follows; Core writers call
+``ensure_categories``.
+
+Category listings are served from an in-process tree: the categories with
+their parent links and the per-category counters of catalog_stats, so loading
+it reads one row per category and no products. The counter deltas of every
+committed transaction are applied to the tree as it commits
+(``catalog_stats.subscribe``), so this process's writes show up immediately.
+Writes from other processes show up when the tree is reloaded, at most
+CATEGORY_TREE_TTL seconds later; changes to category rows reload it at once.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from slugify import slugify
+from sqlalchemy import event, inspect as sa_inspect, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.database import RoutingSession
+from app.models import CatalogStats, Category, Product as ProductModel
+from app.utils.catalog_stats import CATEGORY_SCOPE, COUNTERS, Deltas, subscribe, summed_stats
+
+CATEGORY_TREE_TTL = float(os.getenv("CATEGORY_TREE_TTL", "30"))
+
+_LOOKUP_BATCH_SIZE = 500
+_RELOAD_KEY = "category_tree_reload"
+
+
+def _category_ids(connection, names: List[str]) -> Dict[str, int]:
+    categories = Category.__table__
+    ids = {}
+    for start in range(0, len(names), _LOOKUP_BATCH_SIZE):
+        rows = connection.execute(
+            select(categories.c.name, categories.c.id)
+            .where(categories.c.name.in_(names[start:start + _LOOKUP_BATCH_SIZE]))
+        )
+        ids.update({name: category_id for name, category_id in rows})
+    return ids
+
+
+def _free_slug(connection, name: str, claimed: set) -> str:
+    categories = Category.__table__
+    base = slugify(name, allow_unicode=True) or "category"
+    slug, suffix = base, 1
+    while slug in claimed or connection.execute(
+        select(categories.c.id).where(categories.c.slug == slug)
+    ).first():
+        suffix += 1
+        slug = f"{base}-{suffix}"
+    claimed.add(slug)
+    return slug
+
+
+def ensure_categories(session: Session, names: Iterable[Optional[str]]) -> Dict[str, int]:
+    """Category id for each name, creating the categories that don't exist yet"""
+    names = sorted({name for name in names if name is not None})
+    if not names:
+        return {}
+    connection = session.connection()
+    ids = _category_ids(connection, names)
+    missing = [name for name in names if name not in ids]
+    if not missing:
+        return ids
+
+    table = Category.__table__
+    claimed: set = set()
+    rows = [{"name": name, "slug": _free_slug(connection, name, claimed), "is_active": True} for name in missing]
+    dialect_name = connection.dialect.name
+    if dialect_name in ("sqlite", "postgresql"):
+        # A concurrent writer may create the same category first; keep its row
+        dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+        connection.execute(dialect_insert(table).on_conflict_do_nothing(index_elements=["name"]), rows)
+    else:
+        connection.execute(insert(table), rows)
+    session.info[_RELOAD_KEY] = True
+    ids.update(_category_ids(connection, missing))
+    return ids
+
+
+def would_cycle(connection, category_id: int, parent_id: Optional[int]) -> bool:
+    """Whether making ``parent_id`` the parent of ``category_id`` would create a cycle"""
+    categories = Category.__table__
+    seen = set()
+    while parent_id is not None and parent_id not in seen:
+        if parent_id == category_id:
+            return True
+        seen.add(parent_id)
+        parent_id = connection.execute(
+            select(categories.c.parent_id).where(categories.c.id == parent_id)
+        ).scalar()
+    return parent_id is not None
+
+
+@dataclass
+class CategoryNode:
+    id: int
+    name: str
+    slug: str
+    parent_id: Optional[int]
+    is_active: bool
+    # Counters of the category's own products (catalog_stats names)
+    counts: Dict[str, int]
+    children: List[int] = field(default_factory=list)
+
+
+class CategoryTree:
+    """In-memory category tree with product counters"""
+
+    def __init__(self, ttl: float = CATEGORY_TREE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._nodes: Dict[int, CategoryNode] = {}
+        self._ids_by_name: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._loading = False
+        self._changed_while_loading = False
+
+    def load(self, db: Session):
+        """Rebuild from ``categories`` and the category rows of catalog_stats"""
+        with self._lock:
+            self._loading = True
+            self._changed_while_loading = False
+
+        categories = Category.__table__
+        stats = CatalogStats.__table__
+        nodes: Dict[int, CategoryNode] = {}
+        for row in db.execute(select(
+            categories.c.id, categories.c.name, categories.c.slug, categories.c.parent_id, categories.c.is_active
+        )):
+            nodes[row.id] = CategoryNode(
+                row.id, row.name, row.slug, row.parent_id, row.is_active is not False, dict.fromkeys(COUNTERS, 0)
+            )
+        ids_by_name = {node.name: node.id for node in nodes.values()}
+        for row in db.execute(summed_stats().where(stats.c.scope == CATEGORY_SCOPE)):
+            category_id = ids_by_name.get(row.name)
+            if category_id is not None:
+                nodes[category_id].counts = {counter: row._mapping[counter] for counter in COUNTERS}
+        for node in sorted(nodes.values(), key=lambda node: node.name):
+            if node.parent_id in nodes:
+                nodes[node.parent_id].children.append(node.id)
+
+        with self._lock:
+            self._nodes = nodes
+            self._ids_by_name = ids_by_name
+            # A commit that landed mid-load may be missing from the snapshot
+            self._loaded_at = None if self._changed_while_loading else time.monotonic()
+            self._loading = False
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def apply(self, deltas: Deltas):
+        """Add committed catalog_stats deltas to the category counters"""
+        with self._lock:
+            if self._loading:
+                self._changed_while_loading = True
+            for (scope, name), counts in deltas.items():
+                if scope != CATEGORY_SCOPE:
+                    continue
+                node = self._nodes.get(self._ids_by_name.get(name))
+                if node is None:
+                    # A category this copy doesn't know yet
+                    self._loaded_at = None
+                    continue
+                for counter, value in counts.items():
+                    node.counts[counter] += value
+
+    def _refresh(self, db: Session):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl:
+            self.load(db)
+
+    @staticmethod
+    def _summary(node: CategoryNode, counts: Dict[str, int]) -> Dict[str, Any]:
+        return {
+            "id": node.id,
+            "name": node.name,
+            "slug": node.slug,
+            "parent_id": node.parent_id,
+            "is_active": node.is_active,
+            "product_count": counts["total"],
+            "active_product_count": counts["active"],
+            "total_stock": counts["stock_total"],
+            "avg_price": counts["price_total"] / counts["total"] if counts["total"] else 0,
+        }
+
+    def categories(self, db: Session) -> List[Dict[str, Any]]:
+        """Every category with the counters of its own products, by name"""
+        self._refresh(db)
+        with self._lock:
+            return [
+                self._summary(node, node.counts)
+                for node in sorted(self._nodes.values(), key=lambda node: node.name)
+            ]
+
+    def tree(self, db: Session, active_only: bool = True) -> List[Dict[str, Any]]:
+        """Nested categories; counts include the products of subcategories"""
+        self._refresh(db)
+        with self._lock:
+            nodes = self._nodes
+
+            def build(node: CategoryNode, ancestors: frozenset):
+                counts = dict(node.counts)
+                children = []
+                for child_id in node.children:
+                    child = nodes[child_id]
+                    if child_id in ancestors or (active_only and not child.is_active):
+                        continue
+                    entry, child_counts = build(child, ancestors | {node.id})
+                    children.append(entry)
+                    for counter, value in child_counts.items():
+                        counts[counter] += value
+                return {**self._summary(node, counts), "children": children}, counts
+
+            roots = sorted(
+                (
+                    node for node in nodes.values()
+                    if node.parent_id not in nodes and (node.is_active or not active_only)
+                ),
+                key=lambda node: node.name
+            )
+            return [build(node, frozenset())[0] for node in roots]
+
+
+category_tree = CategoryTree()
+subscribe(category_tree.apply)
+
+
+def _category_changed(session: Session, product) -> bool:
+    return product in session.new or sa_inspect(product).attrs.category.history.has_changes()
+
+
+def install(session_class, tree: CategoryTree):
+    """Link Product writes flushed through ``session_class`` to their category; reload ``tree`` on category writes"""
+
+    @event.listens_for(session_class, "before_flush")
+    def link_categories(session, flush_context, instances):
+        # The name is what writers set; category_id follows it
+        products = [
+            obj for obj in (*session.new, *session.dirty)
+            if isinstance(obj, ProductModel) and obj not in session.deleted and _category_changed(session, obj)
+        ]
+        if not products:
+            return
+        ids = ensure_categories(session, [obj.category for obj in products])
+        for obj in products:
+            category_id = ids.get(obj.category)
+            if obj.category_id != category_id:
+                obj.category_id = category_id
+
+    @event.listens_for(session_class, "after_flush")
+    def collect_category_writes(session, flush_context):
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, Category):
+                session.info[_RELOAD_KEY] = True
+                break
+
+    @event.listens_for(session_class, "after_commit")
+    def reload_tree(session):
+        if session.info.pop(_RELOAD_KEY, False):
+            tree.invalidate()
+
+    @event.listens_for(session_class, "after_rollback")
+    def discard_reload(session):
+        session.info.pop(_RELOAD_KEY, None)
+
+
+# RoutingSession backs both SessionLocal and the async sessions
+install(RoutingSession, category_tree)
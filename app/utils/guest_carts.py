@@ -0,0 +1,502 @@
+"""
+Guest carts: carts for visitors who haven't logged in.
+
+A guest is identified by the ``guest_cart`` cookie, a random id signed with
+SECRET_KEY (HMAC-SHA256), so a client can't pick another guest's id. Its cart
+lives in a fast store rather than the database: ``memory`` (this process) or
+``redis`` (shared between workers; GUEST_CART_REDIS_URL). Adding, updating
+and removing lines only touches the store.
+
+The store is written behind to ``cart_items`` (rows with ``guest_id`` set and
+no user): every GUEST_CART_FLUSH_INTERVAL seconds the app replaces the rows of
+the carts changed since the last flush, GUEST_CART_FLUSH_BATCH carts per
+transaction, and it flushes once more at shutdown. A cart the store doesn't
+hold (a restart, or idle longer than GUEST_CART_IDLE_TTL) is reloaded from
+those rows on its next request.
+
+Logging in or registering merges the guest cart into the user's cart
+(``merge_guest_cart``). ``purge_abandoned`` deletes the rows of guest carts
+untouched for GUEST_CART_TTL seconds (``python manage_db.py purge-guest-carts``).
+
+The memory store is per process: with several workers, a guest's requests
+can land on workers holding different copies of the cart, so use ``redis``.
+When WEB_CONCURRENCY says there are several workers and the store is
+``memory``, guest carts are written through instead (GUEST_CART_WRITE_THROUGH):
+every request reads the cart from cart_items and writes its changes back
+before responding, as for users' carts.
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import bindparam, case, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.auth import SECRET_KEY
+from app.database import SessionLocal
+from app.models import CartItem as CartItemModel, Product as ProductModel
+
+logger = logging.getLogger(__name__)
+
+GUEST_CART_COOKIE = "guest_cart"
+GUEST_CART_TTL = int(os.getenv("GUEST_CART_TTL", str(30 * 24 * 3600)))
+GUEST_CART_COOKIE_SECURE = os.getenv("GUEST_CART_COOKIE_SECURE", "false").lower() == "true"
+GUEST_CART_STORE = os.getenv("GUEST_CART_STORE", "memory")
+GUEST_CART_REDIS_URL = os.getenv("GUEST_CART_REDIS_URL", os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"))
+GUEST_CART_REDIS_TIMEOUT = float(os.getenv("GUEST_CART_REDIS_TIMEOUT", os.getenv("CACHE_REDIS_TIMEOUT", "0.2")))
+GUEST_CART_IDLE_TTL = int(os.getenv("GUEST_CART_IDLE_TTL", "3600"))
+GUEST_CART_FLUSH_INTERVAL = float(os.getenv("GUEST_CART_FLUSH_INTERVAL", "5"))
+GUEST_CART_FLUSH_BATCH = int(os.getenv("GUEST_CART_FLUSH_BATCH", "500"))
+GUEST_CART_MAX_LINES = int(os.getenv("GUEST_CART_MAX_LINES", "100"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+# --- Cookie ---------------------------------------------------------------
+
+def _signature(guest_id: str) -> str:
+    digest = hmac.new(SECRET_KEY.encode(), f"guest-cart:{guest_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def new_guest_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def read_guest_cookie(value: Optional[str]) -> Optional[str]:
+    """The guest id in a ``guest_cart`` cookie value, or None if it's missing or its signature is wrong"""
+    if not value or "." not in value:
+        return None
+    guest_id, signature = value.rsplit(".", 1)
+    if not guest_id or not hmac.compare_digest(signature, _signature(guest_id)):
+        return None
+    return guest_id
+
+
+def guest_id_from_request(request: Request) -> Optional[str]:
+    return read_guest_cookie(request.cookies.get(GUEST_CART_COOKIE))
+
+
+def set_guest_cookie(response: Response, guest_id: str):
+    response.set_cookie(
+        GUEST_CART_COOKIE, f"{guest_id}.{_signature(guest_id)}",
+        max_age=GUEST_CART_TTL, httponly=True, samesite="lax", secure=GUEST_CART_COOKIE_SECURE
+    )
+
+
+def clear_guest_cookie(response: Response):
+    response.delete_cookie(GUEST_CART_COOKIE, httponly=True, samesite="lax", secure=GUEST_CART_COOKIE_SECURE)
+
+
+# --- Stores ---------------------------------------------------------------
+#
+# A cart is {product_id: quantity}. get() returns None for a cart the store
+# doesn't hold (load it from cart_items first) and {} for an emptied one.
+# Every change marks the cart dirty; pop_dirty() hands the dirty carts to
+# the flusher, which marks them again if writing them fails.
+
+class MemoryCartStore:
+    """Guest carts in this process; carts idle for ``idle_ttl`` seconds are dropped once written"""
+
+    def __init__(self, idle_ttl: int = GUEST_CART_IDLE_TTL):
+        self.idle_ttl = idle_ttl
+        self._carts: Dict[str, Dict[int, int]] = {}
+        self._touched: Dict[str, float] = {}
+        self._dirty: Dict[str, None] = {}
+        self._lock = threading.Lock()
+
+    def _change(self, guest_id: str) -> Dict[int, int]:
+        self._touched[guest_id] = time.time()
+        self._dirty[guest_id] = None
+        return self._carts.setdefault(guest_id, {})
+
+    def get(self, guest_id: str) -> Optional[Dict[int, int]]:
+        with self._lock:
+            cart = self._carts.get(guest_id)
+            if cart is None:
+                return None
+            self._touched[guest_id] = time.time()
+            return dict(cart)
+
+    def load(self, guest_id: str, lines: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+        with self._lock:
+            cart = self._carts.get(guest_id)
+            if cart is None:
+                cart = self._carts[guest_id] = {}
+                for product_id, quantity in lines:
+                    cart[product_id] = cart.get(product_id, 0) + quantity
+            self._touched[guest_id] = time.time()
+            return dict(cart)
+
+    def add(self, guest_id: str, product_id: int, quantity: int) -> int:
+        with self._lock:
+            cart = self._change(guest_id)
+            cart[product_id] = cart.get(product_id, 0) + quantity
+            return cart[product_id]
+
+    def set(self, guest_id: str, product_id: int, quantity: int):
+        with self._lock:
+            self._change(guest_id)[product_id] = quantity
+
+    def remove(self, guest_id: str, product_id: int) -> bool:
+        with self._lock:
+            return self._change(guest_id).pop(product_id, None) is not None
+
+    def clear(self, guest_id: str):
+        with self._lock:
+            self._change(guest_id).clear()
+
+    def apply(self, guest_id: str, changes: Dict[int, Optional[int]]):
+        """Set several lines at once; a None quantity removes the line"""
+        with self._lock:
+            cart = self._change(guest_id)
+            for product_id, quantity in changes.items():
+                if quantity is None:
+                    cart.pop(product_id, None)
+                else:
+                    cart[product_id] = quantity
+
+    def discard(self, guest_id: str):
+        """Forget a cart without writing it (it was merged into a user's cart)"""
+        with self._lock:
+            self._carts.pop(guest_id, None)
+            self._touched.pop(guest_id, None)
+            self._dirty.pop(guest_id, None)
+
+    def pop_dirty(self, limit: int) -> List[str]:
+        with self._lock:
+            guest_ids = list(self._dirty)[:limit]
+            for guest_id in guest_ids:
+                del self._dirty[guest_id]
+            # Written carts can go; the next request reloads them from cart_items
+            idle_since = time.time() - self.idle_ttl
+            for guest_id in [g for g, touched in self._touched.items() if touched < idle_since]:
+                if guest_id not in self._dirty and guest_id not in guest_ids:
+                    del self._carts[guest_id]
+                    del self._touched[guest_id]
+            return guest_ids
+
+    def mark_dirty(self, guest_ids: Iterable[str]):
+        with self._lock:
+            for guest_id in guest_ids:
+                if guest_id in self._carts:
+                    self._dirty[guest_id] = None
+
+
+class RedisCartStore:
+    """
+    Guest carts in Redis (or anything speaking its protocol), shared between workers.
+
+    A cart is a hash of product id -> quantity plus a marker field, so an
+    emptied cart still exists; keys expire after ``idle_ttl`` seconds without
+    a change. Dirty carts are a set.
+    """
+
+    MARKER = "_"
+
+    def __init__(self, client, idle_ttl: int = GUEST_CART_IDLE_TTL, prefix: str = "guest_cart:"):
+        self.client = client
+        self.idle_ttl = idle_ttl
+        self.prefix = prefix
+        self.dirty_key = f"{prefix}dirty"
+
+    def _key(self, guest_id: str) -> str:
+        return f"{self.prefix}cart:{guest_id}"
+
+    def _change(self, guest_id: str, pipe):
+        key = self._key(guest_id)
+        pipe.hset(key, self.MARKER, 0)
+        pipe.expire(key, self.idle_ttl)
+        pipe.sadd(self.dirty_key, guest_id)
+
+    def get(self, guest_id: str) -> Optional[Dict[int, int]]:
+        fields = self.client.hgetall(self._key(guest_id))
+        if not fields:
+            return None
+        return {
+            int(field): int(quantity) for field, quantity in fields.items()
+            if field not in (self.MARKER, self.MARKER.encode())
+        }
+
+    def load(self, guest_id: str, lines: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+        cart: Dict[int, int] = {}
+        for product_id, quantity in lines:
+            cart[product_id] = cart.get(product_id, 0) + quantity
+        key = self._key(guest_id)
+        pipe = self.client.pipeline()
+        # HSETNX: a request that loaded the cart first may already have changed it
+        for product_id, quantity in cart.items():
+            pipe.hsetnx(key, product_id, quantity)
+        pipe.hsetnx(key, self.MARKER, 0)
+        pipe.expire(key, self.idle_ttl)
+        pipe.execute()
+        return self.get(guest_id) or {}
+
+    def add(self, guest_id: str, product_id: int, quantity: int) -> int:
+        pipe = self.client.pipeline()
+        pipe.hincrby(self._key(guest_id), product_id, quantity)
+        self._change(guest_id, pipe)
+        return int(pipe.execute()[0])
+
+    def set(self, guest_id: str, product_id: int, quantity: int):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(guest_id), product_id, quantity)
+        self._change(guest_id, pipe)
+        pipe.execute()
+
+    def remove(self, guest_id: str, product_id: int) -> bool:
+        pipe = self.client.pipeline()
+        pipe.hdel(self._key(guest_id), product_id)
+        self._change(guest_id, pipe)
+        return bool(pipe.execute()[0])
+
+    def clear(self, guest_id: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(guest_id))
+        self._change(guest_id, pipe)
+        pipe.execute()
+
+    def apply(self, guest_id: str, changes: Dict[int, Optional[int]]):
+        """Set several lines at once; a None quantity removes the line"""
+        key = self._key(guest_id)
+        removed = [product_id for product_id, quantity in changes.items() if quantity is None]
+        kept = {product_id: quantity for product_id, quantity in changes.items() if quantity is not None}
+        pipe = self.client.pipeline()
+        if removed:
+            pipe.hdel(key, *removed)
+        if kept:
+            pipe.hset(key, mapping=kept)
+        self._change(guest_id, pipe)
+        pipe.execute()
+
+    def discard(self, guest_id: str):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(guest_id))
+        pipe.srem(self.dirty_key, guest_id)
+        pipe.execute()
+
+    def pop_dirty(self, limit: int) -> List[str]:
+        guest_ids = self.client.spop(self.dirty_key, limit) or []
+        return [g.decode() if isinstance(g, bytes) else g for g in guest_ids]
+
+    def mark_dirty(self, guest_ids: Iterable[str]):
+        guest_ids = list(guest_ids)
+        if guest_ids:
+            self.client.sadd(self.dirty_key, *guest_ids)
+
+
+def create_store(kind: str = GUEST_CART_STORE):
+    """
+    Guest cart store for ``kind`` ("memory" or "redis").
+
+    Falls back to the memory store when Redis is requested but the client
+    library is missing, like app.cache does.
+    """
+    if kind == "memory":
+        return MemoryCartStore()
+    if kind == "redis":
+        try:
+            import redis
+        except ImportError:
+            logger.warning("GUEST_CART_STORE=redis but the redis package is not installed; using the memory store")
+            return MemoryCartStore()
+        client = redis.Redis.from_url(
+            GUEST_CART_REDIS_URL,
+            socket_timeout=GUEST_CART_REDIS_TIMEOUT,
+            socket_connect_timeout=GUEST_CART_REDIS_TIMEOUT,
+        )
+        return RedisCartStore(client)
+    raise ValueError(f"Unknown GUEST_CART_STORE: {kind}")
+
+
+guest_cart_store = create_store()
+
+# Per-process carts would diverge between workers, and the flush of whichever
+# copy is written last would drop the others' lines
+GUEST_CART_WRITE_THROUGH = WEB_CONCURRENCY > 1 and isinstance(guest_cart_store, MemoryCartStore)
+if GUEST_CART_WRITE_THROUGH:
+    logger.warning(
+        f"Guest carts written through to cart_items: {WEB_CONCURRENCY} workers but no shared "
+        f"store (set GUEST_CART_STORE=redis)"
+    )
+
+
+# --- Database -------------------------------------------------------------
+
+def stored_lines(guest_id: str):
+    """The cart_items rows a guest cart was last written to, as (product_id, quantity)"""
+    items = CartItemModel.__table__
+    return select(items.c.product_id, items.c.quantity).where(items.c.guest_id == guest_id).order_by(items.c.id)
+
+
+def write_lines(guest_id: str, changes: Dict[int, Optional[int]]) -> list:
+    """Statements that set a guest's cart_items rows (GUEST_CART_WRITE_THROUGH); a None quantity removes the line"""
+    items = CartItemModel.__table__
+    statements = [delete(items).where(items.c.guest_id == guest_id, items.c.product_id.in_(list(changes)))]
+    rows = [
+        {"user_id": None, "guest_id": guest_id, "product_id": product_id, "quantity": quantity}
+        for product_id, quantity in changes.items() if quantity is not None
+    ]
+    if rows:
+        statements.append(insert(items).values(rows))
+    return statements
+
+
+def _existing_products(session: Session, product_ids: Iterable[int]) -> set:
+    products = ProductModel.__table__
+    product_ids = list(product_ids)
+    if not product_ids:
+        return set()
+    return set(session.execute(select(products.c.id).where(products.c.id.in_(product_ids))).scalars())
+
+
+def flush(session: Session, store=None, limit: int = GUEST_CART_FLUSH_BATCH) -> int:
+    """Write up to ``limit`` changed guest carts to cart_items and commit; returns the number written"""
+    store = store or guest_cart_store
+    guest_ids = store.pop_dirty(limit)
+    if not guest_ids:
+        return 0
+
+    items = CartItemModel.__table__
+    try:
+        carts = {}
+        for guest_id in guest_ids:
+            cart = store.get(guest_id)
+            # None: expired from the store before it was written; keep its rows
+            if cart is not None:
+                carts[guest_id] = cart
+        if carts:
+            live = _existing_products(session, {p for cart in carts.values() for p in cart})
+            session.execute(delete(items).where(items.c.guest_id.in_(list(carts))))
+            rows = [
+                {"user_id": None, "guest_id": guest_id, "product_id": product_id, "quantity": quantity}
+                for guest_id, cart in carts.items()
+                for product_id, quantity in cart.items()
+                if product_id in live
+            ]
+            if rows:
+                session.execute(insert(items), rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        store.mark_dirty(guest_ids)
+        raise
+    return len(guest_ids)
+
+
+def flush_guest_carts(store=None) -> int:
+    """Write every changed guest cart, one batch per transaction; returns the number of carts written"""
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            written = flush(db, store)
+        finally:
+            db.close()
+        total += written
+        if written < GUEST_CART_FLUSH_BATCH:
+            return total
+
+
+async def run_flusher(interval: float = GUEST_CART_FLUSH_INTERVAL):
+    """Call ``flush_guest_carts`` every ``interval`` seconds, off the event loop"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(flush_guest_carts)
+        except Exception as e:
+            logger.error(f"Guest cart flush failed: {e}")
+
+
+def merge_guest_cart(session: Session, guest_id: str, user_id: int, store=None) -> int:
+    """
+    Move a guest cart into a user's cart and commit; returns the number of lines merged.
+
+    Quantities of products already in the user's cart are added up, with a
+    single upsert on SQLite and PostgreSQL; a fixed number of statements
+    whatever the cart size. Lines are capped at the product's stock, and
+    products out of stock are left out.
+    """
+    store = store or guest_cart_store
+    items = CartItemModel.__table__
+    products = ProductModel.__table__
+    cart = store.get(guest_id)
+    if cart is None:
+        cart = {}
+        for product_id, quantity in session.execute(stored_lines(guest_id)):
+            cart[product_id] = cart.get(product_id, 0) + quantity
+
+    merged = 0
+    stock = {}
+    if cart:
+        stock = dict(session.execute(
+            select(products.c.id, products.c.stock).where(products.c.id.in_(list(cart)), products.c.stock > 0)
+        ).all())
+    rows = [
+        {"user_id": user_id, "guest_id": None, "product_id": product_id, "quantity": min(quantity, stock[product_id])}
+        for product_id, quantity in cart.items() if product_id in stock
+    ]
+    # Stock read at write time, for lines the user already has
+    line_stock = select(products.c.stock).where(products.c.id == items.c.product_id).correlate(items).scalar_subquery()
+
+    def capped(total):
+        return case((total <= line_stock, total), else_=line_stock)
+
+    dialect_name = session.get_bind().dialect.name
+    if rows and dialect_name in ("sqlite", "postgresql"):
+        # One multi-row upsert against the unique (user_id, product_id) index
+        dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+        stmt = dialect_insert(items).values(rows)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "product_id"],
+            set_={"quantity": capped(items.c.quantity + stmt.excluded.quantity), "updated_at": func.now()}
+        ))
+        merged = len(rows)
+    elif rows:
+        existing = dict(session.execute(
+            select(items.c.product_id, items.c.id)
+            .where(items.c.user_id == user_id, items.c.product_id.in_(list(stock)))
+        ).all())
+        updates = [
+            {"line_id": existing[row["product_id"]], "added": row["quantity"]}
+            for row in rows if row["product_id"] in existing
+        ]
+        inserts = [row for row in rows if row["product_id"] not in existing]
+        if updates:
+            session.execute(
+                update(items)
+                .where(items.c.id == bindparam("line_id"))
+                .values(quantity=capped(items.c.quantity + bindparam("added")), updated_at=func.now()),
+                updates
+            )
+        if inserts:
+            session.execute(insert(items), inserts)
+        merged = len(rows)
+
+    session.execute(delete(items).where(items.c.guest_id == guest_id))
+    session.commit()
+    # A flush already under way may still write the guest rows back;
+    # purge_abandoned deletes them in time
+    store.discard(guest_id)
+    return merged
+
+
+def purge_abandoned(session: Session, now: Optional[datetime] = None, ttl: int = GUEST_CART_TTL) -> int:
+    """Delete the cart_items rows of guest carts unchanged for ``ttl`` seconds and commit"""
+    items = CartItemModel.__table__
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=ttl)
+    result = session.execute(
+        delete(items).where(items.c.guest_id.isnot(None), items.c.updated_at < cutoff)
+    )
+    session.commit()
+    return result.rowcount
@@ -0,0 +1,200 @@
+"""
+Responsive derivatives for product images.
+
+Every product image stored under UPLOAD_FOLDER gets WebP and JPEG variants at
+the widths in IMAGE_VARIANT_WIDTHS (never upscaled) plus a tiny blurred
+placeholder (LQIP) inlined as a data URI. Decoding and resizing are CPU bound,
+so they run in a bounded process pool off the event loop; the product rows
+keep the result in ``products.image_variants`` and the API exposes it as
+``image_srcset`` / ``image_webp_srcset``.
+
+Derivatives sit next to their source (``<hash>-640w.webp``); sources are
+content addressed (app.utils.uploads), so re-processing an image finds its
+variants on disk and only the placeholder is recomputed.
+
+Images uploaded before the pipeline existed can be processed with
+``python -m app.utils.images``.
+"""
+
+import asyncio
+import base64
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.utils.uploads import UPLOAD_FOLDER, UPLOAD_URL_PREFIX
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_WIDTHS = sorted({
+    int(width) for width in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1024").split(",") if width.strip()
+})
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_LQIP_WIDTH = int(os.getenv("IMAGE_LQIP_WIDTH", "16"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# Variant formats: (key in image_variants, file extension, PIL format)
+FORMATS = (("webp", ".webp", "WEBP"), ("jpeg", ".jpg", "JPEG"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+# Worker side ---------------------------------------------------------------
+
+def _save_atomic(image, path: str, image_format: str, quality: int):
+    if os.path.exists(path):
+        return
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(temp_path, image_format, quality=quality, optimize=True)
+    os.replace(temp_path, path)
+
+
+def _target_widths(width: int, widths: Sequence[int]) -> List[int]:
+    """Configured widths below ``width``, plus ``width`` itself when it is the largest useful size"""
+    targets = [w for w in widths if w < width]
+    targets.append(min(width, widths[-1]) if widths else width)
+    return sorted(set(targets))
+
+
+def render_variants(source_path: str, widths: Sequence[int], quality: int, lqip_width: int) -> Dict[str, Any]:
+    """
+    Write the variants of ``source_path`` next to it (runs in a worker process).
+
+    Returns the source size, the generated widths and the placeholder data URI.
+    """
+    from PIL import Image, ImageOps
+
+    stem = os.path.splitext(source_path)[0]
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGBA")
+    width, height = image.size
+
+    # JPEG has no alpha channel: flatten transparent images onto white
+    flat = Image.new("RGB", image.size, (255, 255, 255))
+    flat.paste(image, mask=image.getchannel("A"))
+
+    targets = _target_widths(width, widths)
+    for target in targets:
+        size = (target, max(1, round(height * target / width)))
+        for key, extension, image_format in FORMATS:
+            source = image if key == "webp" else flat
+            resized = source if size == source.size else source.resize(size, Image.Resampling.LANCZOS)
+            _save_atomic(resized, f"{stem}-{target}w{extension}", image_format, quality)
+
+    lqip_size = (min(lqip_width, width), max(1, round(height * min(lqip_width, width) / width)))
+    buffer = io.BytesIO()
+    image.resize(lqip_size, Image.Resampling.BILINEAR).save(buffer, "WEBP", quality=30)
+    placeholder = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+    return {"width": width, "height": height, "widths": targets, "placeholder": placeholder}
+
+
+# Event loop side -----------------------------------------------------------
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs threads (bot, cache refreshes) can deadlock
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def local_path(image_url: Optional[str]) -> Optional[str]:
+    """File behind an /uploads URL, or None for remote and placeholder URLs"""
+    prefix = UPLOAD_URL_PREFIX + "/"
+    if not image_url or not image_url.startswith(prefix):
+        return None
+    relative = image_url[len(prefix):].split("?", 1)[0]
+    root = os.path.abspath(UPLOAD_FOLDER)
+    path = os.path.abspath(os.path.join(root, *relative.split("/")))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def variant_url(image_url: str, width: int, extension: str) -> str:
+    return f"{os.path.splitext(image_url)[0]}-{width}w{extension}"
+
+
+async def build_variants(image_url: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Generate the derivatives of a stored image; value for ``products.image_variants``.
+
+    Returns None for images that aren't in the upload store or can't be
+    decoded - the product then falls back to its full-size ``image_url``.
+    """
+    source_path = local_path(image_url)
+    if source_path is None:
+        return None
+
+    loop = asyncio.get_running_loop()
+    try:
+        rendered = await loop.run_in_executor(
+            _get_pool(), render_variants, source_path, IMAGE_VARIANT_WIDTHS, IMAGE_QUALITY, IMAGE_LQIP_WIDTH
+        )
+    except BrokenProcessPool as e:
+        # A worker died (e.g. killed for memory); start a fresh pool next time
+        logger.error(f"Image worker pool broke while processing {image_url}: {e}")
+        shutdown_pool()
+        return None
+    except Exception as e:
+        logger.warning(f"Image variants failed for {image_url}: {e}")
+        return None
+
+    return {
+        "width": rendered["width"],
+        "height": rendered["height"],
+        "placeholder": rendered["placeholder"],
+        "sources": [
+            {"width": width, **{key: variant_url(image_url, width, extension) for key, extension, _ in FORMATS}}
+            for width in rendered["widths"]
+        ],
+    }
+
+
+async def backfill(db) -> int:
+    """Build variants for products with a stored image and none yet; returns the count"""
+    from app.models import Product as ProductModel
+
+    products = db.query(ProductModel).filter(
+        ProductModel.image_url.like(UPLOAD_URL_PREFIX + "/%"),
+        ProductModel.image_variants.is_(None),
+    ).all()
+    variants = await asyncio.gather(*(build_variants(product.image_url) for product in products))
+    updated = 0
+    for product, value in zip(products, variants):
+        if value is not None:
+            product.image_variants = value
+            updated += 1
+    db.commit()
+    return updated
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        logger.info(f"Image variants built for {asyncio.run(backfill(db))} products")
+    finally:
+        db.close()
+        shutdown_pool()
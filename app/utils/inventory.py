@@ -0,0 +1,170 @@
+"""
+Inventory alerts.
+
+An active product needs restocking once its stock falls to its alert
+threshold: its own ``reorder_threshold`` if set, else its category's
+(``categories.reorder_threshold``), else DEFAULT_REORDER_THRESHOLD. The
+effective value is denormalised into ``products.alert_threshold`` so that
+``stock <= alert_threshold`` can be the predicate of a partial index:
+
+- ix_products_stock_alerts (stock, id) WHERE is_active AND stock <= alert_threshold
+- ix_products_out_of_stock (stock, id) WHERE is_active AND stock <= 0
+
+Alert listings walk one of these indexes in (stock, id) order with keyset
+cursors, so they only ever touch the products that are alerting; counts come
+from catalog_stats, so polling them doesn't read products at all.
+
+A session hook resolves ``alert_threshold`` for products written through the
+ORM; Core writers (app.utils.bulk_products) resolve it with
+``category_thresholds`` / ``resolve_threshold``.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect as sa_inspect, select, update
+from sqlalchemy.orm import Session
+
+from app.cache import CATEGORIES_TAG, queue_tags
+from app.database import RoutingSession
+from app.models import Category, Product as ProductModel
+from app.utils.catalog_stats import add_product, apply_deltas, new_deltas
+from app.utils.pagination import KeysetPaginator
+
+# Threshold of products whose category has none; matches the products.alert_threshold default
+DEFAULT_REORDER_THRESHOLD = 10
+
+ALERT_STATUSES = ("out_of_stock", "low_stock")
+
+# Product attributes alert_threshold is derived from
+THRESHOLD_SOURCES = ("category", "reorder_threshold")
+
+_LOOKUP_BATCH_SIZE = 500
+
+alert_paginator = KeysetPaginator(ProductModel, ["stock"], default_key="stock")
+
+
+def resolve_threshold(reorder_threshold: Optional[int], category_threshold: Optional[int]) -> int:
+    """Effective alert threshold of a product"""
+    if reorder_threshold is not None:
+        return reorder_threshold
+    if category_threshold is not None:
+        return category_threshold
+    return DEFAULT_REORDER_THRESHOLD
+
+
+def category_thresholds(connection, names: Iterable[Optional[str]]) -> Dict[str, int]:
+    """Reorder thresholds of the named categories that have one"""
+    categories = Category.__table__
+    names = sorted({name for name in names if name is not None})
+    thresholds = {}
+    for start in range(0, len(names), _LOOKUP_BATCH_SIZE):
+        rows = connection.execute(
+            select(categories.c.name, categories.c.reorder_threshold)
+            .where(categories.c.name.in_(names[start:start + _LOOKUP_BATCH_SIZE]))
+            .where(categories.c.reorder_threshold.isnot(None))
+        )
+        thresholds.update({name: threshold for name, threshold in rows})
+    return thresholds
+
+
+def list_alerts(
+    db: Session,
+    alert_status: Optional[str] = None,
+    category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+) -> Tuple[List, Optional[str], Optional[str]]:
+    """
+    One page of alerting products, lowest stock first: (rows, next_cursor, prev_cursor).
+
+    ``alert_status`` narrows the page to one of ALERT_STATUSES.
+    """
+    stmt = select(
+        ProductModel.id, ProductModel.name, ProductModel.slug, ProductModel.category,
+        ProductModel.stock, ProductModel.reorder_threshold, ProductModel.alert_threshold
+    ).where(ProductModel.is_active == True)
+    # Predicates spelled like the partial index definitions, so the planner can use them
+    if alert_status == "out_of_stock":
+        stmt = stmt.where(ProductModel.stock <= 0)
+    else:
+        stmt = stmt.where(ProductModel.stock <= ProductModel.alert_threshold)
+        if alert_status == "low_stock":
+            stmt = stmt.where(ProductModel.stock > 0)
+    if category is not None:
+        stmt = stmt.where(ProductModel.category == category)
+
+    stmt, page_state = alert_paginator.apply(stmt, "stock", "asc", cursor, limit, 0, db.get_bind().dialect.name)
+    return alert_paginator.page(db.execute(stmt).all(), page_state)
+
+
+def set_category_threshold(db: Session, name: str, threshold: Optional[int]) -> Optional[int]:
+    """
+    Set (or clear, with None) a category's reorder threshold and commit.
+
+    Re-resolves the alert threshold of the category's products that don't
+    have their own and returns how many changed; None if there is no such
+    category.
+    """
+    categories = Category.__table__
+    products = ProductModel.__table__
+
+    result = db.execute(update(categories).where(categories.c.name == name).values(reorder_threshold=threshold))
+    if not result.rowcount:
+        db.rollback()
+        return None
+
+    value = resolve_threshold(None, threshold)
+    affected = (
+        products.c.category == name,
+        products.c.reorder_threshold.is_(None),
+        products.c.alert_threshold != value,
+    )
+    # Row locks (PostgreSQL) keep the old values valid until the UPDATE
+    rows = db.execute(
+        select(products.c.is_active, products.c.stock, products.c.alert_threshold, products.c.price)
+        .where(*affected)
+        .with_for_update()
+    ).all()
+    if rows:
+        deltas = new_deltas()
+        for row in rows:
+            add_product(deltas, name, row.is_active, row.stock, row.alert_threshold, row.price, sign=-1)
+            add_product(deltas, name, row.is_active, row.stock, value, row.price)
+        db.execute(update(products).where(*affected).values(alert_threshold=value))
+        apply_deltas(db, deltas)
+    queue_tags(db, {CATEGORIES_TAG})
+    db.commit()
+    return len(rows)
+
+
+def _threshold_inputs_changed(session: Session, product) -> bool:
+    if product in session.new:
+        return True
+    state = sa_inspect(product)
+    return any(state.attrs[key].history.has_changes() for key in THRESHOLD_SOURCES)
+
+
+def install(session_class):
+    """Resolve ``alert_threshold`` for Product writes flushed through ``session_class``"""
+
+    def resolve_alert_thresholds(session, flush_context, instances):
+        products = [
+            obj for obj in (*session.new, *session.dirty)
+            if isinstance(obj, ProductModel) and obj not in session.deleted
+            and _threshold_inputs_changed(session, obj)
+        ]
+        if not products:
+            return
+        names = {obj.category for obj in products if obj.reorder_threshold is None}
+        thresholds = category_thresholds(session.connection(), names) if names - {None} else {}
+        for obj in products:
+            value = resolve_threshold(obj.reorder_threshold, thresholds.get(obj.category))
+            if obj.alert_threshold != value:
+                obj.alert_threshold = value
+
+    # Ahead of the catalog_stats hook, which counts products against their resolved threshold
+    event.listen(session_class, "before_flush", resolve_alert_thresholds, insert=True)
+
+
+# RoutingSession backs both SessionLocal and the async sessions
+install(RoutingSession)
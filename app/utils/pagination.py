@@ -0,0 +1,172 @@
+"""
+Keyset (cursor) pagination.
+
+Listings are ordered by ``(sort_key, id)``. A cursor is an opaque, URL-safe
+token holding the sort key, direction and the ``(value, id)`` of the row it
+points at; the next page is ``WHERE sort_key <= :value AND (sort_key < :value
+OR id < :id)`` (mirrored for ascending order), which walks the index from the
+cursor position, so page 1000 costs the same as page 1.
+
+Offset pagination is still supported; in both modes the response carries
+next/prev cursors so clients can switch to keyset paging at any point.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import String, and_, asc, desc, literal, or_, type_coerce
+from sqlalchemy.types import DateTime
+
+
+def encode_cursor(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(payload, dict) or not {"k", "o", "d", "i"} <= payload.keys():
+            raise ValueError("missing fields")
+        if not isinstance(payload["i"], int):
+            raise ValueError("bad id")
+        return payload
+    except (ValueError, binascii.Error, UnicodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
+
+@dataclass
+class PageState:
+    """What a paginated query was built with; needed to turn its rows into a page"""
+    key: Optional[str]
+    order: str
+    direction: str
+    limit: int
+    offset: int
+    from_cursor: bool
+
+
+class KeysetPaginator:
+    """
+    Builds keyset-paginated queries for a model.
+
+    ``sort_keys`` whitelists the columns that can back a cursor; sorting by
+    anything else falls back to offset pagination without cursors.
+    """
+
+    def __init__(self, model, sort_keys: List[str], default_key: str = "created_at"):
+        self.model = model
+        self.sort_keys = set(sort_keys)
+        self.default_key = default_key
+
+    def _column(self, key: str):
+        return getattr(self.model, key)
+
+    def _order_by(self, stmt, key: str, direction_fn):
+        if key == "id":
+            return stmt.order_by(direction_fn(self.model.id))
+        return stmt.order_by(direction_fn(self._column(key)), direction_fn(self.model.id))
+
+    def _bind_value(self, key: str, value: Any, dialect_name: str):
+        column = self._column(key)
+        if value is None or not isinstance(column.type, DateTime):
+            return column, value
+        value = datetime.fromisoformat(value)
+        if dialect_name == "sqlite":
+            # SQLite stores timestamps as text; server defaults (CURRENT_TIMESTAMP)
+            # have no fractional part, so compare against the same text form
+            text_value = value.strftime("%Y-%m-%d %H:%M:%S")
+            if value.microsecond:
+                text_value += f".{value.microsecond:06d}"
+            return type_coerce(column, String), literal(text_value, String)
+        return column, value
+
+    def apply(
+        self,
+        stmt,
+        sort_by: Optional[str],
+        sort_order: str,
+        cursor: Optional[str],
+        limit: int,
+        offset: int = 0,
+        dialect_name: str = "",
+    ) -> Tuple[Any, PageState]:
+        """Add ordering, the keyset condition (or offset) and LIMIT limit+1 to ``stmt``"""
+        id_column = self.model.id
+
+        if cursor:
+            payload = decode_cursor(cursor)
+            key, order, direction = payload["k"], payload["o"], payload["d"]
+            if key not in self.sort_keys or order not in ("asc", "desc") or direction not in ("next", "prev"):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid pagination cursor"
+                )
+            try:
+                column, value = self._bind_value(key, payload.get("v"), dialect_name)
+            except (TypeError, ValueError):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid pagination cursor"
+                )
+            cursor_id = payload["i"]
+
+            # Walking backwards flips the comparison and the ORDER BY
+            forward = (order == "desc") == (direction == "next")
+            if key == "id":
+                condition = id_column < cursor_id if forward else id_column > cursor_id
+            elif forward:
+                condition = and_(column <= value, or_(column < value, id_column < cursor_id))
+            else:
+                condition = and_(column >= value, or_(column > value, id_column > cursor_id))
+            stmt = self._order_by(stmt.where(condition), key, desc if forward else asc)
+            return stmt.limit(limit + 1), PageState(key, order, direction, limit, 0, True)
+
+        key = sort_by or self.default_key
+        order = "asc" if (sort_order or "desc").lower() == "asc" else "desc"
+        if getattr(self.model, key, None) is None:
+            key = self.default_key
+        stmt = self._order_by(stmt, key, asc if order == "asc" else desc)
+        stmt = stmt.offset(offset).limit(limit + 1)
+        return stmt, PageState(key if key in self.sort_keys else None, order, "next", limit, offset, False)
+
+    def _cursor_for(self, item, state: PageState, direction: str) -> str:
+        value = getattr(item, state.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        return encode_cursor({"k": state.key, "o": state.order, "d": direction, "v": value, "i": item.id})
+
+    def page(self, rows: List[Any], state: PageState) -> Tuple[List[Any], Optional[str], Optional[str]]:
+        """Trim the look-ahead row and compute (items, next_cursor, prev_cursor)"""
+        has_more = len(rows) > state.limit
+        items = list(rows[:state.limit])
+
+        if state.direction == "prev":
+            items.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, state.from_cursor or state.offset > 0
+
+        if state.key is None or not items:
+            return items, None, None
+
+        next_cursor = self._cursor_for(items[-1], state, "next") if has_next else None
+        prev_cursor = self._cursor_for(items[0], state, "prev") if has_prev else None
+        return items, next_cursor, prev_cursor
+
+
+def set_cursor_headers(response, next_cursor: Optional[str], prev_cursor: Optional[str]):
+    """Expose cursors on endpoints whose body is a plain list"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
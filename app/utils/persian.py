@@ -0,0 +1,52 @@
+"""
+Persian text normalization for search.
+
+The same text can reach the database with Arabic or Persian code points
+(ي/ی, ك/ک), Persian, Arabic or Latin digits, ZWNJ between word parts and
+optional diacritics. PERSIAN_CHAR_MAP folds these into one form for queries.
+The search index normalizes indexed text with a copy of it in SQL (migrations
+0003 and 0012); a change here needs a migration rebuilding that index.
+"""
+
+import re
+from typing import Dict, List
+
+# Character -> replacement ("" removes the character)
+PERSIAN_CHAR_MAP: Dict[str, str] = {
+    # Arabic letter forms -> Persian
+    "ي": "ی",
+    "ى": "ی",
+    "ك": "ک",
+    "ة": "ه",
+    "ۀ": "ه",
+    "ؤ": "و",
+    "أ": "ا",
+    "إ": "ا",
+    "آ": "ا",
+    "ٱ": "ا",
+    # Zero-width non-joiner separates word parts; treat it as a space
+    "\u200c": " ",
+    # Persian and Arabic-Indic digits -> ASCII
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+    # Diacritics, tatweel and zero-width joiner are dropped
+    **{chr(c): "" for c in range(0x064B, 0x0656)},
+    "\u0670": "",  # superscript alef
+    "\u0640": "",  # tatweel
+    "\u200d": "",  # zero-width joiner
+}
+
+_TRANSLATION = str.maketrans(PERSIAN_CHAR_MAP)
+_WORD = re.compile(r"\w+")
+
+
+def normalize_persian(text: str) -> str:
+    """Fold Arabic/Persian variants, digits and diacritics; lowercase Latin"""
+    if not text:
+        return ""
+    return text.translate(_TRANSLATION).lower()
+
+
+def search_terms(text: str) -> List[str]:
+    """Normalized word tokens of ``text``"""
+    return _WORD.findall(normalize_persian(text))
@@ -10,12 +10,37 @@ import mimetypes
 
 from app.models import Product
 from app.schemas import ProductImport, ImportResult
+from app.utils.slugs import allocate_slug, allocate_slugs
+from app.utils.images import build_variants
+from app.utils.uploads import store_remote
 
 logger = logging.getLogger(__name__)
 
 class ProductImportProcessor:
     def __init__(self, db: Session):
         self.db = db
+        # Slugs allocated ahead of time for new products, keyed by product name
+        self.reserved_slugs: Dict[str, str] = {}
+    
+    def reserve_slugs(self, rows: List[Dict[str, Any]]):
+        """Allocate slugs for every new product in an import chunk with one batch"""
+        names = {}
+        for row in rows:
+            if self.validate_product_data(row).success:
+                name = str(row.get('name', '')).strip()
+                names.setdefault(name, self.generate_slug(name))
+        names = {name: base for name, base in names.items() if name not in self.reserved_slugs}
+        if not names:
+            return
+        
+        existing = {
+            name for (name,) in self.db.query(Product.name).filter(Product.name.in_(list(names)))
+        }
+        new_names = [name for name in names if name not in existing]
+        slugs = allocate_slugs(self.db, [names[name] for name in new_names])
+        # Commit so the reservation survives a later row's rollback
+        self.db.commit()
+        self.reserved_slugs.update(zip(new_names, slugs))
     
     async def process_product_row(self, row: Dict[str, Any], user_id: int) -> ImportResult:
         """پردازش یک سطر از فایل import"""
@@ -125,24 +150,16 @@ class ProductImportProcessor:
         # Currency
         data['currency'] = 'IRT'
         
-        # Generate slug from name
-        base_slug = self.generate_slug(data['name'])
-        data['slug'] = self.ensure_unique_slug(base_slug)
+        # Base slug from name; made unique when the product is saved
+        data['base_slug'] = self.generate_slug(data['name'])
         
         return data
     
     def find_existing_product(self, product_data: Dict[str, Any]) -> Optional[Product]:
         """جستجوی محصول موجود"""
-        query = self.db.query(Product)
-        
-        # Search by name and slug (since Product model doesn't have SKU field)
-        product = query.filter(Product.name == product_data['name']).first()
-        if product:
-            return product
-            
-        # Search by slug as fallback
-        product = query.filter(Product.slug == product_data['slug']).first()
-        return product
+        # Search by name (Product model doesn't have a SKU field; slugs are
+        # allocated per product, so the base slug does not identify one)
+        return self.db.query(Product).filter(Product.name == product_data['name']).first()
     
     async def create_new_product(self, product_data: Dict[str, Any], user_id: int) -> ImportResult:
         """ایجاد محصول جدید"""
@@ -155,6 +172,10 @@ class ProductImportProcessor:
                     product_data['name']
                 )
             
+            image_variants = await build_variants(image_path) if image_path else None
+            
+            slug = self.reserved_slugs.pop(product_data['name'], None) or self.ensure_unique_slug(product_data['base_slug'])
+            
             # Create product using correct field names
             new_product = Product(
                 name=product_data['name'],
@@ -163,7 +184,8 @@ class ProductImportProcessor:
                 stock=product_data['stock'],  # maps to stock_quantity in CSV
                 category=product_data['category'],
                 image_url=image_path or product_data.get('image_url'),
-                slug=product_data['slug'],
+                image_variants=image_variants,
+                slug=slug,
                 currency=product_data['currency'],
                 is_active=product_data['is_active']
             )
@@ -201,16 +223,7 @@ class ProductImportProcessor:
             if product_data.get('category'):
                 product.category = product_data['category']
             
-            # Update slug if name changed
-            if product_data['slug'] != product.slug:
-                # Check if new slug already exists
-                existing_slug = self.db.query(Product).filter(
-                    Product.slug == product_data['slug'],
-                    Product.id != product.id
-                ).first()
-                
-                if not existing_slug:
-                    product.slug = product_data['slug']
+            # Products are matched by name, so the existing slug stays
             
             # Update image if new URL provided
             if product_data.get('image_url') and product_data['image_url'] != product.image_url:
@@ -220,6 +233,7 @@ class ProductImportProcessor:
                 )
                 if image_path:
                     product.image_url = image_path
+                    product.image_variants = await build_variants(image_path)
             
             self.db.commit()
             
@@ -239,21 +253,9 @@ class ProductImportProcessor:
                 product_id=product.id
             )
     
-    def ensure_unique_slug(self, base_slug: str, product_id: Optional[int] = None) -> str:
+    def ensure_unique_slug(self, base_slug: str, current_slug: Optional[str] = None) -> str:
         """اطمینان از یکتا بودن slug"""
-        slug = base_slug
-        counter = 1
-        
-        while True:
-            query = self.db.query(Product).filter(Product.slug == slug)
-            if product_id:
-                query = query.filter(Product.id != product_id)
-            
-            if not query.first():
-                return slug
-            
-            slug = f"{base_slug}-{counter}"
-            counter += 1
+        return allocate_slug(self.db, base_slug, current_slug=current_slug)
     
     def generate_slug(self, text: str) -> str:
         """ایجاد slug از متن فارسی"""
@@ -286,10 +288,9 @@ class ProductImportProcessor:
     async def download_product_image(self, image_url: str, product_name: str) -> Optional[str]:
         """دانلود تصویر محصول"""
         try:
-            # Skip download for now - just validate URL
-            # In production, implement actual image download and storage
+            # Stored under its content hash: re-importing the same image reuses the file
             if self.is_valid_url(image_url):
-                return image_url
+                return await store_remote(image_url)
             return None
             
         except Exception as e:
@@ -0,0 +1,83 @@
+"""
+Full-text product search.
+
+SQLite uses an FTS5 table (products_fts) and PostgreSQL a generated tsvector
+column (products.search_vector) with a GIN index. Both are created by
+migration 0003 and maintained by the database itself (triggers / generated
+column), so every write path - the routers, ProductImportProcessor and the
+Telegram importer - keeps the index in sync. Queries are normalized with
+app.utils.persian and indexed text by the same character mapping in SQL, so
+the triggers work from any SQLite client. Other dialects fall back to ILIKE.
+"""
+
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, literal_column, or_, select, table, text
+
+from app.models import Product as ProductModel
+from app.utils.persian import search_terms
+
+FTS_TABLE = "products_fts"
+SEARCH_VECTOR_COLUMN = "search_vector"
+
+# Indexed columns with their relevance weight (bm25 weight, tsvector label)
+SEARCH_COLUMNS = [
+    ("name", 10.0, "A"),
+    ("category", 4.0, "B"),
+    ("slug", 2.0, "C"),
+    ("description", 1.0, "D"),
+]
+
+
+def sqlite_match_query(terms: List[str]) -> str:
+    """FTS5 MATCH string: every term must match, as a prefix"""
+    return " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+
+
+def postgres_tsquery(terms: List[str]) -> str:
+    """to_tsquery string: every term must match, as a prefix"""
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def apply_text_search(db_query, q: str, dialect_name: str) -> Tuple[object, Optional[object]]:
+    """
+    Restrict a Product query to matches for ``q``.
+
+    Returns the filtered query and an ORDER BY expression ranking the matches by
+    relevance (None when the backend has no ranking).
+    """
+    terms = search_terms(q)
+    if not terms:
+        return db_query, None
+
+    if dialect_name == "sqlite":
+        weights = ", ".join(str(weight) for _, weight, _ in SEARCH_COLUMNS)
+        matches = (
+            select(
+                literal_column("rowid").label("product_id"),
+                literal_column(f"bm25({FTS_TABLE}, {weights})").label("rank"),
+            )
+            .select_from(table(FTS_TABLE))
+            .where(text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=sqlite_match_query(terms)))
+            .subquery("fts_matches")
+        )
+        db_query = db_query.join(matches, ProductModel.id == matches.c.product_id)
+        # bm25() is lower-is-better
+        return db_query, matches.c.rank.asc()
+
+    if dialect_name == "postgresql":
+        vector = literal_column(f"products.{SEARCH_VECTOR_COLUMN}")
+        tsquery = func.to_tsquery("simple", postgres_tsquery(terms))
+        db_query = db_query.filter(vector.op("@@")(tsquery))
+        return db_query, func.ts_rank_cd(vector, tsquery).desc()
+
+    search_term = f"%{q.strip()}%"
+    db_query = db_query.filter(
+        or_(
+            ProductModel.name.ilike(search_term),
+            ProductModel.description.ilike(search_term),
+            ProductModel.category.ilike(search_term),
+            ProductModel.slug.ilike(search_term)
+        )
+    )
+    return db_query, None
@@ -0,0 +1,188 @@
+"""
+Per-request SQL instrumentation.
+
+SQLAlchemy cursor events record every statement executed while a request is
+being served: query count, total DB time, the slowest statement and how often
+each statement shape repeats. Repeated SELECT shapes are reported as likely
+N+1 lazy loads. Results go to the log, and a sample of slow SELECTs has its
+query plan appended to a JSON-lines file. Off by default: plans are taken
+with a synchronous EXPLAIN on the request's connection. The Server-Timing
+header exposes timings to every client, so it needs SQL_SERVER_TIMING too.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.middleware.base import BaseHTTPMiddleware
+
+logger = logging.getLogger(__name__)
+
+SQL_PROFILING = os.getenv("SQL_PROFILING", "false").lower() == "true"
+SQL_SERVER_TIMING = os.getenv("SQL_SERVER_TIMING", "false").lower() == "true"
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "100"))
+SQL_PLAN_SAMPLE_RATE = float(os.getenv("SQL_PLAN_SAMPLE_RATE", "0.1"))
+# Relative paths are taken from the project root, not the working directory
+SQL_PLAN_LOG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    os.getenv("SQL_PLAN_LOG", "logs/slow_query_plans.jsonl"),
+)
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\([^)]*\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\([^)]*\)s|\$\d+|:\w+))*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_WHITESPACE = re.compile(r"\s+")
+
+_current_profile: ContextVar[Optional["QueryProfile"]] = ContextVar("sql_query_profile", default=None)
+_plan_log_lock = threading.Lock()
+
+
+def statement_shape(statement: str) -> str:
+    """Normalize a statement so that executions differing only in parameters compare equal"""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _IN_LIST.sub("(?)", shape)
+    return _NUMBER.sub("N", shape)
+
+
+class QueryProfile:
+    """Statements executed on behalf of one request"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.shapes: Counter = Counter()
+        # Sync handlers of one request may run statements on several threadpool threads
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, duration_ms: float):
+        shape = statement_shape(statement)
+        with self._lock:
+            self.count += 1
+            self.total_ms += duration_ms
+            self.shapes[shape] += 1
+            if duration_ms > self.slowest_ms:
+                self.slowest_ms = duration_ms
+                self.slowest_statement = statement
+
+    def repeated_shapes(self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD):
+        """SELECT shapes executed at least ``threshold`` times - likely N+1 loads"""
+        return [
+            (shape, count)
+            for shape, count in self.shapes.most_common()
+            if count >= threshold and shape.upper().startswith("SELECT")
+        ]
+
+    def server_timing(self) -> str:
+        metrics = [
+            f'db;dur={self.total_ms:.2f};desc="{self.count} queries"',
+            f"db-slowest;dur={self.slowest_ms:.2f}",
+        ]
+        repeated = self.repeated_shapes()
+        if repeated:
+            metrics.append(f'db-n-plus-one;desc="{len(repeated)} repeated statements"')
+        return ", ".join(metrics)
+
+
+def _write_plan(conn, cursor, statement, parameters, context, duration_ms):
+    """Append the query plan of a slow SELECT to SQL_PLAN_LOG"""
+    dialect = conn.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    plan_cursor = conn.connection.cursor()
+    try:
+        plan_cursor.execute(prefix + statement, parameters)
+        plan = [list(row) for row in plan_cursor.fetchall()]
+    finally:
+        plan_cursor.close()
+
+    profile = _current_profile.get()
+    entry = {
+        "timestamp": datetime.now().isoformat(),
+        "path": profile.path if profile else None,
+        "dialect": dialect,
+        "duration_ms": round(duration_ms, 3),
+        "statement": statement,
+        "plan": plan,
+    }
+    directory = os.path.dirname(SQL_PLAN_LOG)
+    with _plan_log_lock:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(SQL_PLAN_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_profile.get() is not None:
+        context._profiler_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    started = getattr(context, "_profiler_started", None)
+    if profile is None or started is None:
+        return
+
+    duration_ms = (time.perf_counter() - started) * 1000
+    profile.record(statement, duration_ms)
+
+    if (
+        duration_ms >= SQL_SLOW_QUERY_MS
+        and not executemany
+        and statement.lstrip().upper().startswith("SELECT")
+        and random.random() < SQL_PLAN_SAMPLE_RATE
+    ):
+        try:
+            _write_plan(conn, cursor, statement, parameters, context, duration_ms)
+        except Exception as e:
+            logger.warning(f"Failed to sample query plan: {str(e)}")
+
+
+class QueryProfilerMiddleware(BaseHTTPMiddleware):
+    """Attach a QueryProfile to each request and report it when the response is ready"""
+
+    async def dispatch(self, request, call_next):
+        if not SQL_PROFILING:
+            return await call_next(request)
+
+        profile = QueryProfile(request.url.path)
+        token = _current_profile.set(profile)
+        try:
+            response = await call_next(request)
+        finally:
+            _current_profile.reset(token)
+
+        if profile.count and SQL_SERVER_TIMING:
+            response.headers["Server-Timing"] = profile.server_timing()
+
+        repeated = profile.repeated_shapes()
+        if repeated:
+            shape, count = repeated[0]
+            logger.warning(
+                f"Possible N+1 on {request.method} {profile.path}: "
+                f"{count}x {shape[:200]} ({profile.count} queries, {profile.total_ms:.1f}ms)"
+            )
+        elif profile.count and profile.slowest_ms >= SQL_SLOW_QUERY_MS:
+            logger.warning(
+                f"Slow query on {request.method} {profile.path}: "
+                f"{profile.slowest_ms:.1f}ms {profile.slowest_statement[:200]}"
+            )
+        else:
+            logger.debug(
+                f"{request.method} {profile.path}: {profile.count} queries, {profile.total_ms:.1f}ms"
+            )
+        return response
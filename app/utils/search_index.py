@@ -0,0 +1,447 @@
+"""
+In-process product search index.
+
+For deployments that cannot add the full-text objects from migration 0003,
+SEARCH_BACKEND=memory serves ``query=`` searches from an in-memory inverted
+index instead of the database:
+
+- tokens of name / category / slug / description, normalized with
+  app.utils.persian, scored with BM25 (field-weighted term frequencies)
+- prefix expansion for as-you-type queries
+- character trigrams over the vocabulary for typo tolerance
+
+The index holds a snapshot of every product row, so a search returns complete
+products without a database round trip. It is loaded at startup and updated
+incrementally from session events (see ``install``), which covers the routers,
+ProductImportProcessor and the Telegram importer - they all write through
+SessionLocal. Each worker process keeps its own copy, so writes made by other
+processes (other workers, the bot) are picked up by ``sync`` every
+SEARCH_INDEX_SYNC_INTERVAL seconds.
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, inspect as sa_inspect, select
+from sqlalchemy.orm import Session
+
+from app.database import RoutingSession, SessionLocal
+from app.models import Product as ProductModel
+from app.utils.catalog_stats import read_product_total
+from app.utils.persian import search_terms
+
+logger = logging.getLogger(__name__)
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "database").lower()
+# Seconds between polls for product writes made by other processes (0 disables)
+SEARCH_INDEX_SYNC_INTERVAL = float(os.getenv("SEARCH_INDEX_SYNC_INTERVAL", "5"))
+# Each poll reaches this many seconds further back than the newest updated_at
+# it has seen, for transactions that committed a while after stamping their rows
+SEARCH_INDEX_SYNC_LOOKBACK = float(os.getenv("SEARCH_INDEX_SYNC_LOOKBACK", "60"))
+# Polls detect deletions from the catalog_stats product total; every this many
+# seconds one counts the products table instead, for writes that bypassed it
+SEARCH_INDEX_RECOUNT_INTERVAL = float(os.getenv("SEARCH_INDEX_RECOUNT_INTERVAL", "300"))
+
+# Relative weight of a term occurrence in each field
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "slug": 1.0, "description": 1.0}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+FUZZY_MIN_SIMILARITY = 0.4
+MAX_EXPANSIONS = 30
+
+_PENDING_KEY = "search_index_pending"
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _term_weights(row: Dict[str, Any]) -> Dict[str, float]:
+    """Field-weighted term frequencies of a product row"""
+    weights: Dict[str, float] = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in search_terms(row.get(field) or ""):
+            weights[term] += weight
+    return weights
+
+
+def _snapshot(product) -> Dict[str, Any]:
+    return {attr.key: getattr(product, attr.key) for attr in sa_inspect(ProductModel).column_attrs}
+
+
+def _newest_update(rows: List[Dict[str, Any]]) -> Optional[datetime]:
+    stamps = [row["updated_at"] for row in rows if row.get("updated_at") is not None]
+    return max(stamps) if stamps else None
+
+
+class ProductSearchIndex:
+    """Inverted index over product text with BM25 scoring"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs: Dict[int, Dict[str, Any]] = {}
+        self._doc_terms: Dict[int, Dict[str, float]] = {}
+        self._doc_len: Dict[int, float] = {}
+        self._total_len = 0.0
+        self._postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self._trigram_terms: Dict[str, Set[str]] = defaultdict(set)
+        self._vocabulary: List[str] = []
+        self._active_ids: Set[int] = set()
+        self._category_ids: Dict[str, Set[int]] = defaultdict(set)
+        self._avg_len_hint: Optional[float] = None
+        self.loaded_at: Optional[float] = None
+        self.synced_at: Optional[float] = None
+        # Newest products.updated_at seen, on the database's clock
+        self._synced_through: Optional[datetime] = None
+        self._recounted_at: Optional[float] = None
+
+    # Maintenance -------------------------------------------------------
+
+    def load(self, db: Session):
+        """Replace the index contents with every product in the database"""
+        products = db.query(ProductModel).all()
+        rows = [_snapshot(product) for product in products]
+        weighted = [(row, _term_weights(row)) for row in rows]
+
+        fresh = ProductSearchIndex()
+        # Seed the average length so early documents are normalized like later ones
+        fresh._avg_len_hint = sum(sum(w.values()) for _, w in weighted) / len(weighted) if weighted else 1.0
+        for row, weights in weighted:
+            fresh._add(row, weights)
+        with self._lock:
+            self.__dict__.update({k: v for k, v in fresh.__dict__.items() if k != "_lock"})
+            self._avg_len_hint = None
+            self.loaded_at = self.synced_at = time.time()
+            self._synced_through = _newest_update(rows)
+            self._recounted_at = time.monotonic()
+        logger.info(f"Search index loaded with {len(products)} products")
+
+    def sync(self, db: Session) -> int:
+        """
+        Apply product writes committed by other processes since the last load
+        or sync; returns the number of products re-indexed or removed.
+
+        Changed rows are found by updated_at, deletions by comparing the
+        product total (catalog_stats; a COUNT every SEARCH_INDEX_RECOUNT_INTERVAL
+        seconds) with the index and then the ids.
+        """
+        if self._synced_through is None:
+            self.load(db)
+            return len(self._docs)
+
+        since = self._synced_through - timedelta(seconds=SEARCH_INDEX_SYNC_LOOKBACK)
+        rows = [_snapshot(product) for product in db.query(ProductModel).filter(ProductModel.updated_at >= since)]
+        if time.monotonic() - self._recounted_at >= SEARCH_INDEX_RECOUNT_INTERVAL:
+            total = db.scalar(select(func.count(ProductModel.id)))
+            self._recounted_at = time.monotonic()
+        else:
+            total = read_product_total(db)
+        missing: Set[int] = set()
+        changed = 0
+        with self._lock:
+            for row in rows:
+                if self._docs.get(row["id"]) != row:
+                    self._remove(row["id"])
+                    self._add(row)
+                    changed += 1
+            indexed = len(self._docs)
+        if total != indexed:
+            ids = set(db.scalars(select(ProductModel.id)))
+            with self._lock:
+                removed = [product_id for product_id in self._docs if product_id not in ids]
+                for product_id in removed:
+                    self._remove(product_id)
+                missing = ids - self._docs.keys()
+            changed += len(removed)
+        if missing:
+            # Inserted without a fresh updated_at (e.g. by hand)
+            for product in db.query(ProductModel).filter(ProductModel.id.in_(missing)):
+                self.upsert(_snapshot(product))
+                changed += 1
+
+        with self._lock:
+            newest = _newest_update(rows)
+            if newest is not None and newest > self._synced_through:
+                self._synced_through = newest
+            self.synced_at = time.time()
+        if changed:
+            logger.info(f"Search index synced {changed} products changed elsewhere")
+        return changed
+
+    def upsert(self, row: Dict[str, Any]):
+        with self._lock:
+            self._remove(row["id"])
+            self._add(row)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove(product_id)
+
+    def _average_length(self) -> float:
+        if self._avg_len_hint is not None:
+            return self._avg_len_hint
+        return self._total_len / len(self._docs) if self._docs else 1.0
+
+    def _add(self, row: Dict[str, Any], weights: Optional[Dict[str, float]] = None):
+        product_id = row["id"]
+        weights = weights if weights is not None else _term_weights(row)
+
+        self._docs[product_id] = row
+        if row.get("is_active"):
+            self._active_ids.add(product_id)
+        if row.get("category") is not None:
+            self._category_ids[row["category"]].add(product_id)
+        self._doc_terms[product_id] = weights
+        length = sum(weights.values())
+        self._doc_len[product_id] = length
+        self._total_len += length
+
+        # Postings store the BM25 term-frequency component, normalized with the
+        # average length at insert time; idf is applied at query time
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (self._average_length() or 1.0))
+        for term, tf in weights.items():
+            postings = self._postings[term]
+            if not postings:
+                insort(self._vocabulary, term)
+                for trigram in _trigrams(term):
+                    self._trigram_terms[trigram].add(term)
+            postings[product_id] = tf * (BM25_K1 + 1) / (tf + norm)
+
+    def _remove(self, product_id: int):
+        weights = self._doc_terms.pop(product_id, None)
+        if weights is None:
+            return
+        row = self._docs.pop(product_id, None)
+        self._active_ids.discard(product_id)
+        if row and row.get("category") in self._category_ids:
+            self._category_ids[row["category"]].discard(product_id)
+        self._total_len -= self._doc_len.pop(product_id, 0.0)
+
+        for term in weights:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                index = bisect_left(self._vocabulary, term)
+                if index < len(self._vocabulary) and self._vocabulary[index] == term:
+                    del self._vocabulary[index]
+                for trigram in _trigrams(term):
+                    terms = self._trigram_terms.get(trigram)
+                    if terms is not None:
+                        terms.discard(term)
+                        if not terms:
+                            del self._trigram_terms[trigram]
+
+    # Query -------------------------------------------------------------
+
+    def _expand(self, term: str) -> Dict[str, float]:
+        """Vocabulary terms matching a query term, with a match-quality weight"""
+        expansions: Dict[str, float] = {}
+        if term in self._postings:
+            expansions[term] = 1.0
+
+        index = bisect_left(self._vocabulary, term)
+        while index < len(self._vocabulary) and len(expansions) < MAX_EXPANSIONS:
+            candidate = self._vocabulary[index]
+            if not candidate.startswith(term):
+                break
+            expansions.setdefault(candidate, PREFIX_WEIGHT)
+            index += 1
+
+        if expansions or len(term) < 3:
+            return expansions
+
+        # No exact or prefix match: fall back to trigram similarity (typos)
+        query_trigrams = _trigrams(term)
+        shared: Dict[str, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for candidate in self._trigram_terms.get(trigram, ()):
+                shared[candidate] += 1
+        for candidate, count in shared.items():
+            similarity = count / (len(query_trigrams) + len(_trigrams(candidate)) - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                expansions[candidate] = FUZZY_WEIGHT * similarity
+        if len(expansions) > MAX_EXPANSIONS:
+            expansions = dict(heapq.nlargest(MAX_EXPANSIONS, expansions.items(), key=lambda item: item[1]))
+        return expansions
+
+    def search(
+        self,
+        query: str,
+        skip: int = 0,
+        limit: int = 100,
+        active_only: bool = True,
+        category: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Products matching every term of ``query``, best first.
+
+        Returns the requested page of product rows and the total match count.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return [], 0
+
+        with self._lock:
+            doc_count = len(self._docs)
+            if not doc_count:
+                return [], 0
+
+            # (postings, weight) per expansion, weight = match quality * idf
+            expanded = []
+            for term in terms:
+                sources = []
+                for candidate, quality in self._expand(term).items():
+                    postings = self._postings[candidate]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    sources.append((postings, quality * idf))
+                if not sources:
+                    return [], 0
+                expanded.append(sources)
+
+            # Start from the rarest term and only probe the surviving candidates
+            # for the others, so cost follows the smallest posting list
+            expanded.sort(key=lambda sources: sum(len(postings) for postings, _ in sources))
+
+            # Filters are applied while scoring the first term
+            allowed = self._active_ids if active_only else self._docs.keys()
+            if category is not None:
+                allowed = self._category_ids.get(category, set()) & allowed
+
+            first = expanded[0]
+            if len(first) == 1:
+                postings, weight = first[0]
+                scores = {
+                    product_id: weight * tf_part
+                    for product_id, tf_part in postings.items()
+                    if product_id in allowed
+                }
+            else:
+                scores = {}
+                for postings, weight in first:
+                    for product_id, tf_part in postings.items():
+                        score = weight * tf_part
+                        if score > scores.get(product_id, 0.0) and product_id in allowed:
+                            scores[product_id] = score
+
+            for sources in expanded[1:]:
+                if len(sources) == 1:
+                    postings, weight = sources[0]
+                    scores = {
+                        product_id: score + weight * postings[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in postings
+                    }
+                else:
+                    narrowed: Dict[int, float] = {}
+                    for product_id, score in scores.items():
+                        best = 0.0
+                        for postings, weight in sources:
+                            tf_part = postings.get(product_id)
+                            if tf_part is not None and weight * tf_part > best:
+                                best = weight * tf_part
+                        if best:
+                            narrowed[product_id] = score + best
+                    scores = narrowed
+                if not scores:
+                    return [], 0
+
+            # Ties go to the newer (higher id) product
+            page = heapq.nlargest(skip + limit, zip(scores.values(), scores.keys()))[skip:]
+            return [self._docs[product_id] for _, product_id in page], len(scores)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": SEARCH_BACKEND,
+                "products": len(self._docs),
+                "terms": len(self._postings),
+                "loaded_at": self.loaded_at,
+                "synced_at": self.synced_at,
+            }
+
+    # Session integration ----------------------------------------------
+
+    def install(self, session_class):
+        """Keep the index in step with committed Product writes made through ``session_class``"""
+
+        @event.listens_for(session_class, "after_flush")
+        def collect_changes(session, flush_context):
+            pending = session.info.setdefault(_PENDING_KEY, {})
+            for obj in session.new | session.dirty:
+                if isinstance(obj, ProductModel):
+                    pending[obj.id] = _snapshot(obj)
+            for obj in session.deleted:
+                if isinstance(obj, ProductModel):
+                    pending[obj.id] = None
+
+        @event.listens_for(session_class, "after_commit")
+        def apply_changes(session):
+            pending = session.info.pop(_PENDING_KEY, None)
+            if not pending:
+                return
+            for product_id, row in pending.items():
+                if row is None:
+                    self.remove(product_id)
+                else:
+                    self.upsert(row)
+
+        @event.listens_for(session_class, "after_rollback")
+        def discard_changes(session):
+            session.info.pop(_PENDING_KEY, None)
+
+
+def queue_changes(session, rows: Iterable[Dict[str, Any]] = (), removed_ids: Iterable[int] = ()):
+    """
+    Index Core-level product writes (no ORM objects to flush) when ``session`` commits.
+
+    ``rows`` are full product rows keyed by column name.
+    """
+    if SEARCH_BACKEND != "memory":
+        return
+    pending = session.info.setdefault(_PENDING_KEY, {})
+    for row in rows:
+        pending[row["id"]] = dict(row)
+    for product_id in removed_ids:
+        pending[product_id] = None
+
+
+product_index = ProductSearchIndex()
+
+
+def sync_product_index() -> int:
+    """Bring ``product_index`` up to date with the database"""
+    db = SessionLocal()
+    try:
+        return product_index.sync(db)
+    finally:
+        db.close()
+
+
+async def run_syncer(interval: float = SEARCH_INDEX_SYNC_INTERVAL):
+    """Call ``sync_product_index`` every ``interval`` seconds, off the event loop"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(sync_product_index)
+        except Exception as e:
+            logger.error(f"Search index sync failed: {e}")
+
+if SEARCH_BACKEND == "memory":
+    # RoutingSession backs both SessionLocal and the async sessions
+    product_index.install(RoutingSession)
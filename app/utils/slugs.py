@@ -0,0 +1,190 @@
+"""
+Unique product slugs.
+
+Every product writer - the routers, ProductImportProcessor and the Telegram
+importer - allocates slugs here instead of probing ``slug``, ``slug-1``,
+``slug-2``, ... one query at a time. slug_counters keeps the next free suffix
+index per base slug (index 0 is the bare base, index n is ``base-n``):
+
+- a base seen for the first time is seeded with one indexed prefix query over
+  products.slug
+- allocating ``n`` slugs for a base is an atomic upsert that advances its
+  counter by ``n``, so concurrent writers get disjoint suffix ranges; bases
+  allocated together share multi-row upserts
+- one ``IN`` query checks the candidates against slugs that were chosen
+  outside the allocator (e.g. a product literally named "کیف 2"); clashes are
+  re-allocated
+
+A rolled-back transaction also rolls back its counter increments, so callers
+that hand out slugs before inserting (see ProductImportProcessor) commit the
+allocation first.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Product as ProductModel, SlugCounter
+
+# Leave room for a numeric suffix within products.slug (String(250))
+MAX_BASE_LENGTH = 200
+
+_MAX_ATTEMPTS = 10
+_SEED_BATCH_SIZE = 200
+_UPSERT_BATCH_SIZE = 500
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _family_filter(slug_column, base: str, dialect_name: str):
+    """``slug = base OR slug LIKE 'base-%'`` in a form the slug index can serve"""
+    if dialect_name == "postgresql":
+        # Served by the text_pattern_ops index (ix_products_slug_pattern, migration 0005);
+        # the default collation's index can't do prefixes
+        return or_(slug_column == base, slug_column.like(_like_escape(base) + "-%", escape="\\"))
+    # SQLite compares with BINARY collation, so the prefix is a range on the unique index
+    return or_(slug_column == base, (slug_column >= base + "-") & (slug_column < base + "."))
+
+
+def _suffix_index(slug: str, base: str) -> Optional[int]:
+    """Allocation index ``slug`` occupies in ``base``'s family (None if it is not base / base-N)"""
+    if slug == base:
+        return 0
+    match = re.fullmatch(re.escape(base) + r"-(\d+)", slug)
+    return int(match.group(1)) if match else None
+
+
+def _slug_for(base: str, index: int) -> str:
+    return base if index == 0 else f"{base}-{index}"
+
+
+def _normalize_base(base: Optional[str]) -> str:
+    return (base or "product")[:MAX_BASE_LENGTH].strip("-") or "product"
+
+
+def _seed_indexes(db: Session, bases: List[str]) -> Dict[str, int]:
+    """Next free index for each base, from the slugs already in products"""
+    dialect_name = db.get_bind().dialect.name
+    slug = ProductModel.__table__.c.slug
+    rows = []
+    # Bounded OR chains: SQLite caps expression depth at 1000
+    for start in range(0, len(bases), _SEED_BATCH_SIZE):
+        batch = bases[start:start + _SEED_BATCH_SIZE]
+        rows.extend(db.execute(
+            select(slug).where(or_(*(_family_filter(slug, base, dialect_name) for base in batch)))
+        ).scalars())
+
+    seeds = dict.fromkeys(bases, 0)
+    for existing in rows:
+        if existing in seeds:
+            seeds[existing] = max(seeds[existing], 1)
+        prefix, _, suffix = existing.rpartition("-")
+        if prefix in seeds and suffix.isdigit():
+            seeds[prefix] = max(seeds[prefix], int(suffix) + 1)
+    return seeds
+
+
+def _advance(db: Session, counts: Dict[str, int], seeds: Dict[str, int]) -> Dict[str, range]:
+    """Atomically reserve ``counts[base]`` indexes per base, starting no lower than its seed"""
+    table = SlugCounter.__table__
+    dialect_name = db.get_bind().dialect.name
+    ends: Dict[str, int] = {}
+
+    if dialect_name in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+        greatest = func.max if dialect_name == "sqlite" else func.greatest
+        # One multi-row upsert per batch of bases reserving the same count (usually 1):
+        # next_index = max(next_index, seed) + count = max(next_index + count, seed + count)
+        by_count: Dict[int, List[str]] = {}
+        for base, count in counts.items():
+            by_count.setdefault(count, []).append(base)
+        for count, bases in by_count.items():
+            for start in range(0, len(bases), _UPSERT_BATCH_SIZE):
+                batch = bases[start:start + _UPSERT_BATCH_SIZE]
+                stmt = dialect_insert(table).values(
+                    [{"base": base, "next_index": seeds.get(base, 0) + count} for base in batch]
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["base"],
+                    set_={"next_index": greatest(table.c.next_index + count, stmt.excluded.next_index)}
+                ).returning(table.c.base, table.c.next_index)
+                ends.update((base, end) for base, end in db.execute(stmt))
+    else:
+        for base, count in counts.items():
+            seed = seeds.get(base, 0)
+            # Row lock from the UPDATE keeps the read consistent until commit
+            start = case((table.c.next_index > seed, table.c.next_index), else_=seed)
+            result = db.execute(
+                table.update().where(table.c.base == base).values(next_index=start + count)
+            )
+            if result.rowcount == 0:
+                db.execute(table.insert().values(base=base, next_index=seed + count))
+            ends[base] = db.execute(select(table.c.next_index).where(table.c.base == base)).scalar_one()
+
+    return {base: range(ends[base] - count, ends[base]) for base, count in counts.items()}
+
+
+def allocate_slugs(db: Session, bases: Iterable[str]) -> List[str]:
+    """
+    One unique slug per entry of ``bases`` (duplicates get distinct suffixes).
+
+    Runs in the caller's transaction; the slugs are only reserved once it commits.
+    """
+    bases = [_normalize_base(base) for base in bases]
+    if not bases:
+        return []
+
+    pending = Counter(bases)
+    allocated: Dict[str, List[str]] = {base: [] for base in pending}
+    seeded = set(db.execute(
+        select(SlugCounter.base).where(SlugCounter.base.in_(list(pending)))
+    ).scalars())
+
+    for _ in range(_MAX_ATTEMPTS):
+        unseeded = [base for base in pending if base not in seeded]
+        seeds = _seed_indexes(db, unseeded) if unseeded else {}
+        seeded.update(unseeded)
+
+        candidates = {
+            base: [_slug_for(base, index) for index in indexes]
+            for base, indexes in _advance(db, pending, seeds).items()
+        }
+
+        # Slugs picked outside the allocator may sit inside a reserved range
+        every = [slug for slugs in candidates.values() for slug in slugs]
+        slug = ProductModel.__table__.c.slug
+        taken = set(db.execute(select(slug).where(slug.in_(every))).scalars())
+
+        pending = Counter()
+        for base, slugs in candidates.items():
+            free = [candidate for candidate in slugs if candidate not in taken]
+            allocated[base].extend(free)
+            if len(free) < len(slugs):
+                # Re-seed from products so the counter jumps past the clash
+                pending[base] = len(slugs) - len(free)
+                seeded.discard(base)
+        if not pending:
+            break
+    else:
+        raise RuntimeError("Could not allocate unique slugs")
+
+    return [allocated[base].pop(0) for base in bases]
+
+
+def allocate_slug(db: Session, base: str, current_slug: Optional[str] = None) -> str:
+    """
+    Unique slug for ``base``.
+
+    A product that already has a slug from the same family (``base`` or
+    ``base-N``) keeps it, so saving a product without renaming it is a no-op.
+    """
+    base = _normalize_base(base)
+    if current_slug and _suffix_index(current_slug, base) is not None:
+        return current_slug
+    return allocate_slugs(db, [base])[0]
@@ -0,0 +1,216 @@
+"""
+Static serving for product media (/uploads, /static/products).
+
+StaticMediaMiddleware answers media requests before the rest of the
+middleware stack (the query profiler's BaseHTTPMiddleware would otherwise
+pipe every chunk through a memory stream), so images cost one file read
+loop per request and nothing else:
+
+- the file is handed to the server with the ASGI zero-copy / path-send
+  extensions (sendfile) when the server offers them, and streamed with
+  async reads otherwise
+- content-addressed names (app.utils.uploads, app.utils.images) get an ETag
+  equal to their hash and ``Cache-Control: immutable``; other files get a
+  size/mtime ETag and STATIC_MAX_AGE
+- ``If-None-Match`` answers 304, single ``Range`` requests answer 206
+  (``If-Range`` is honoured), unsatisfiable ranges 416
+- a precompressed sibling (``file.br`` / ``file.gz``) is served when the
+  client accepts that encoding
+"""
+
+import mimetypes
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import aiofiles
+
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+CHUNK_SIZE = 64 * 1024
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# <sha256>.<ext> sources and their <sha256>-<width>w.<ext> variants
+_CONTENT_ADDRESSED = re.compile(r"([0-9a-f]{64}(?:-\d+w)?)\.[a-z0-9]+")
+# (Accept-Encoding token, file suffix), in order of preference
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+mimetypes.add_type("image/webp", ".webp")
+mimetypes.add_type("image/avif", ".avif")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    ``(start, end)`` (inclusive) for a single-range ``Range`` header.
+
+    None means "send the whole file": no header, a malformed one or several
+    ranges (which a server may ignore).
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last N bytes
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable()
+    if first > last:
+        return None
+    return first, min(last, size - 1)
+
+
+def _accepted_encodings(header: Optional[str]) -> List[str]:
+    accepted = []
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        if token and not re.search(r"q\s*=\s*0(\.0*)?\s*$", params):
+            accepted.append(token.strip().lower())
+    return accepted
+
+
+class StaticMedia:
+    """ASGI app serving the files under ``directory``"""
+
+    def __init__(self, directory: str, max_age: int = STATIC_MAX_AGE):
+        self.directory = os.path.abspath(directory)
+        self.max_age = max_age
+
+    def resolve(self, path: str) -> Optional[str]:
+        full_path = os.path.abspath(os.path.join(self.directory, *path.strip("/").split("/")))
+        if not full_path.startswith(self.directory + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] not in ("GET", "HEAD"):
+            await _send_empty(send, 405, [(b"allow", b"GET, HEAD")])
+            return
+
+        full_path = self.resolve(scope["path"])
+        if full_path is None:
+            await _send_empty(send, 404, [(b"content-type", b"application/json")], b'{"detail":"Not Found"}')
+            return
+
+        request_headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        name = os.path.basename(full_path)
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        # Precompressed sibling, if the client takes it
+        encoding = None
+        vary = False
+        accepted = _accepted_encodings(request_headers.get("accept-encoding"))
+        for token, suffix in PRECOMPRESSED:
+            if os.path.isfile(full_path + suffix):
+                vary = True
+                if encoding is None and token in accepted:
+                    encoding, full_path = token, full_path + suffix
+
+        stat = os.stat(full_path)
+        size = stat.st_size
+        match = _CONTENT_ADDRESSED.fullmatch(name)
+        if match:
+            etag = f'"{match.group(1)}{"-" + encoding if encoding else ""}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            etag = f'"{size:x}-{stat.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+            cache_control = f"public, max-age={self.max_age}"
+
+        headers = [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"etag", etag.encode("latin-1")),
+            (b"cache-control", cache_control.encode("latin-1")),
+            (b"accept-ranges", b"bytes"),
+        ]
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+        if vary:
+            headers.append((b"vary", b"Accept-Encoding"))
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+            await _send_empty(send, 304, headers)
+            return
+
+        byte_range = None
+        if_range = request_headers.get("if-range")
+        if if_range is None or if_range.strip() == etag:
+            try:
+                byte_range = parse_range(request_headers.get("range"), size)
+            except RangeNotSatisfiable:
+                headers.append((b"content-range", f"bytes */{size}".encode("latin-1")))
+                await _send_empty(send, 416, headers)
+                return
+
+        if byte_range:
+            start, end = byte_range
+            status, offset, count = 206, start, end - start + 1
+            headers.append((b"content-range", f"bytes {start}-{end}/{size}".encode("latin-1")))
+        else:
+            status, offset, count = 200, 0, size
+        headers.append((b"content-length", str(count).encode("latin-1")))
+
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        if scope["method"] == "HEAD" or count == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await _send_file(scope, send, full_path, offset, count, size)
+
+
+async def _send_empty(send, status: int, headers, body: bytes = b""):
+    if status != 304:
+        headers = headers + [(b"content-length", str(len(body)).encode("latin-1"))]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_file(scope, send, path: str, offset: int, count: int, size: int):
+    extensions = scope.get("extensions") or {}
+    if "http.response.zerocopysend" in extensions:
+        # The server sendfile()s straight from the descriptor
+        with open(path, "rb") as file:
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": offset, "count": count})
+        return
+    if "http.response.pathsend" in extensions and offset == 0 and count == size:
+        await send({"type": "http.response.pathsend", "path": path})
+        return
+
+    async with aiofiles.open(path, "rb") as file:
+        await file.seek(offset)
+        remaining = count
+        while remaining > 0:
+            chunk = await file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; end the response rather than hang the client
+            await send({"type": "http.response.body", "body": b""})
+
+
+class StaticMediaMiddleware:
+    """Serve ``mounts`` (URL prefix -> directory) ahead of the application"""
+
+    def __init__(self, app, mounts: Dict[str, str]):
+        self.app = app
+        self.mounts = [(prefix.rstrip("/"), StaticMedia(directory)) for prefix, directory in mounts.items()]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            for prefix, media in self.mounts:
+                if path.startswith(prefix + "/"):
+                    await media(dict(scope, path=path[len(prefix):]), receive, send)
+                    return
+        await self.app(scope, receive, send)
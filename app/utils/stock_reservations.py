@@ -0,0 +1,282 @@
+"""
+Stock reservations for orders.
+
+Creating an order takes its stock at once, with one conditional UPDATE per
+product:
+
+    UPDATE products SET stock = stock - :quantity
+    WHERE id = :id AND is_active AND stock >= :quantity
+
+The database checks and decrements in the same statement, so buyers racing
+for the last units can't both get them: the loser's UPDATE matches no row
+and its order is rolled back. Products are updated in id order, so
+concurrent orders lock rows in the same order. The name and price the order
+records come from the same statement, not from the client.
+
+The order then holds the stock (``orders.holds_stock``) until it ships;
+cancelling it returns the stock (``apply_status_change``). Orders paid online
+also get a deadline (``orders.reserved_until``, STOCK_RESERVATION_TTL
+seconds): payment or an admin confirmation clears it, and ``release_expired``
+cancels the orders whose deadline passed while they were still unpaid. The app
+runs it every STOCK_RESERVATION_SWEEP_INTERVAL seconds (0 disables that; run
+``python manage_db.py release-reservations`` from cron instead).
+Pay-on-delivery orders (PAY_ON_DELIVERY_METHODS) get no deadline.
+
+Each transition is a conditional UPDATE of the order row, so a payment and
+the sweep racing for one order can't both win. The product UPDATEs are Core
+statements; like app.utils.bulk_products, this module feeds catalog_stats,
+the catalog caches and the search index itself.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.orm import Session
+
+from app.cache import product_tags, queue_tags
+from app.database import SessionLocal
+from app.models import Order, OrderItem, OrderStatusHistory, Product as ProductModel
+from app.utils.catalog_stats import TRACKED_ATTRIBUTES, add_product, apply_deltas, new_deltas
+from app.utils.search_index import queue_changes as queue_index_changes
+
+logger = logging.getLogger(__name__)
+
+STOCK_RESERVATION_TTL = int(os.getenv("STOCK_RESERVATION_TTL", "1800"))
+STOCK_RESERVATION_SWEEP_INTERVAL = float(os.getenv("STOCK_RESERVATION_SWEEP_INTERVAL", "60"))
+PAY_ON_DELIVERY_METHODS = {
+    method.strip() for method in os.getenv("PAY_ON_DELIVERY_METHODS", "cash_on_delivery").split(",")
+    if method.strip()
+}
+
+# Statuses that confirm an order (its stock is kept past the payment
+# deadline) and that hand its stock over to the carrier
+CONFIRMED_STATUSES = ("confirmed", "preparing", "shipped", "delivered")
+SHIPPED_STATUSES = ("shipped", "delivered")
+
+# Orders released per transaction by the expiry sweep
+SWEEP_BATCH_SIZE = 500
+
+EXPIRED_NOTE = "مهلت پرداخت به پایان رسید و سفارش لغو شد"
+
+
+class StockUnavailable(Exception):
+    """A product can't cover the quantity an order asks for"""
+
+    def __init__(self, product_id: int, requested: int, available: Optional[int]):
+        self.product_id = product_id
+        self.requested = requested
+        # None: no such product, or it isn't for sale
+        self.available = available
+        super().__init__(f"Insufficient stock for product {product_id}: requested {requested}, available {available}")
+
+
+def reservation_deadline(payment_method: Optional[str], now: Optional[datetime] = None) -> Optional[datetime]:
+    """When a new order's reservation lapses if still unpaid; None for pay-on-delivery orders"""
+    if payment_method in PAY_ON_DELIVERY_METHODS:
+        return None
+    return (now or datetime.utcnow()) + timedelta(seconds=STOCK_RESERVATION_TTL)
+
+
+def _available(session: Session, product_id: int) -> Optional[int]:
+    table = ProductModel.__table__
+    row = session.execute(select(table.c.stock, table.c.is_active).where(table.c.id == product_id)).first()
+    if row is None or not row.is_active:
+        return None
+    return max(row.stock, 0)
+
+
+def _adjust_stock(session: Session, quantities: Dict[int, int], sign: int) -> Dict[int, dict]:
+    """Add ``sign * quantity`` to each product's stock; returns the updated product rows"""
+    table = ProductModel.__table__
+    returning = session.get_bind().dialect.update_returning
+    deltas = new_deltas()
+    rows: Dict[int, dict] = {}
+
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        statement = update(table).where(table.c.id == product_id).values(stock=table.c.stock + sign * quantity)
+        if sign < 0:
+            statement = statement.where(table.c.is_active == True, table.c.stock >= quantity)
+        if returning:
+            row = session.execute(statement.returning(*table.c)).first()
+        else:
+            row = None
+            if session.execute(statement).rowcount:
+                row = session.execute(select(table).where(table.c.id == product_id)).first()
+        if row is None:
+            if sign < 0:
+                raise StockUnavailable(product_id, quantity, _available(session, product_id))
+            # Deleted since the order took it; nothing to return the stock to
+            continue
+
+        row = row._asdict()
+        old = dict(row, stock=row["stock"] - sign * quantity)
+        add_product(deltas, *(old[key] for key in TRACKED_ATTRIBUTES), sign=-1)
+        add_product(deltas, *(row[key] for key in TRACKED_ATTRIBUTES))
+        rows[product_id] = row
+
+    if rows:
+        apply_deltas(session, deltas)
+        queue_tags(session, product_tags(rows, [row["slug"] for row in rows.values()]))
+        queue_index_changes(session, rows=rows.values())
+    return rows
+
+
+def reserve_stock(session: Session, quantities: Dict[int, int]) -> Dict[int, dict]:
+    """
+    Take ``quantities`` (product id -> units) from stock in ``session``'s transaction.
+
+    Returns the updated product rows by id. Raises StockUnavailable for the
+    first product that can't cover its quantity; roll back the transaction
+    then, as the products before it were already decremented.
+    """
+    return _adjust_stock(session, quantities, -1)
+
+
+def _order_quantities(session: Session, order_ids: List[int]) -> Dict[int, int]:
+    items = OrderItem.__table__
+    rows = session.execute(
+        select(items.c.product_id, func.sum(items.c.quantity))
+        .where(items.c.order_id.in_(order_ids))
+        .group_by(items.c.product_id)
+    )
+    return {product_id: int(quantity) for product_id, quantity in rows}
+
+
+def _claim(session: Session, order_ids: List[int], *criteria, **values) -> List[int]:
+    """Ids among ``order_ids`` matching ``criteria`` that this call updated with ``values``"""
+    orders = Order.__table__
+    statement = update(orders).where(*criteria).values(**values)
+    if session.get_bind().dialect.update_returning:
+        return list(session.execute(statement.where(orders.c.id.in_(order_ids)).returning(orders.c.id)).scalars())
+    return [
+        order_id for order_id in order_ids
+        if session.execute(statement.where(orders.c.id == order_id)).rowcount
+    ]
+
+
+def release_reservations(session: Session, order_ids: Iterable[int], *criteria, **values) -> List[int]:
+    """
+    Return the stock held by the given orders (those matching ``criteria``) in ``session``'s transaction.
+
+    ``values`` are set on the released orders as well. Returns the ids of the
+    orders that held stock; the others are left alone.
+    """
+    orders = Order.__table__
+    order_ids = sorted(set(order_ids))
+    if not order_ids:
+        return []
+    released = _claim(
+        session, order_ids, orders.c.holds_stock == True, *criteria,
+        holds_stock=False, reserved_until=None, **values
+    )
+    if released:
+        _adjust_stock(session, _order_quantities(session, released), 1)
+    return released
+
+
+def commit_reservation(session: Session, order_id: int, shipped: bool = False) -> bool:
+    """
+    Keep an order's stock past its deadline (it was paid or confirmed), in ``session``'s transaction.
+
+    With ``shipped`` the stock has left the warehouse and the order stops
+    holding it. False if the order holds no stock, e.g. because its
+    reservation already lapsed.
+    """
+    orders = Order.__table__
+    values = {"reserved_until": None}
+    if shipped:
+        values["holds_stock"] = False
+    return bool(_claim(session, [order_id], orders.c.holds_stock == True, **values))
+
+
+def reinstate_reservation(session: Session, order_id: int) -> bool:
+    """Take a cancelled order's stock again, in ``session``'s transaction; raises StockUnavailable"""
+    orders = Order.__table__
+    reinstated = _claim(session, [order_id], orders.c.holds_stock == False, holds_stock=True)
+    if reinstated:
+        reserve_stock(session, _order_quantities(session, reinstated))
+    return bool(reinstated)
+
+
+def apply_status_change(session: Session, order_id: int, old_status: str, new_status: str):
+    """
+    Move an order's stock along with a status change, in ``session``'s transaction.
+
+    Cancelling returns the stock; reopening a cancelled order takes it again
+    (raising StockUnavailable if it's gone); confirming keeps it past the
+    payment deadline and shipping hands it over.
+    """
+    if new_status == old_status:
+        return
+    if new_status == "cancelled":
+        release_reservations(session, [order_id])
+    elif old_status == "cancelled":
+        reinstate_reservation(session, order_id)
+        commit_reservation(session, order_id, shipped=new_status in SHIPPED_STATUSES)
+    elif new_status in CONFIRMED_STATUSES:
+        commit_reservation(session, order_id, shipped=new_status in SHIPPED_STATUSES)
+
+
+def release_expired(session: Session, now: Optional[datetime] = None, limit: int = SWEEP_BATCH_SIZE) -> int:
+    """Cancel up to ``limit`` orders whose reservation lapsed unpaid, return their stock and commit"""
+    orders = Order.__table__
+    now = now or datetime.utcnow()
+    # Spelled like the ix_orders_reserved_until predicate, so the planner can use it
+    expired = (
+        orders.c.reserved_until.isnot(None),
+        orders.c.reserved_until <= now,
+        orders.c.payment_status != "paid",
+    )
+    rows = session.execute(
+        select(orders.c.id, orders.c.status).where(*expired).order_by(orders.c.reserved_until).limit(limit)
+    ).all()
+    if not rows:
+        return 0
+
+    old_statuses = {row.id: row.status for row in rows}
+    # Re-checked by the UPDATE: a payment may have landed since the SELECT
+    released = release_reservations(session, old_statuses, *expired, status="cancelled")
+    if released:
+        session.execute(insert(OrderStatusHistory.__table__), [
+            {
+                "order_id": order_id,
+                "old_status": old_statuses[order_id],
+                "new_status": "cancelled",
+                "notes": EXPIRED_NOTE,
+                "changed_by_user_id": None,
+            }
+            for order_id in released
+        ])
+    session.commit()
+    return len(released)
+
+
+def sweep_expired() -> int:
+    """Release every lapsed reservation, one batch per transaction; returns the number of orders cancelled"""
+    total = 0
+    while True:
+        db = SessionLocal()
+        try:
+            released = release_expired(db)
+        finally:
+            db.close()
+        total += released
+        if released < SWEEP_BATCH_SIZE:
+            return total
+
+
+async def run_sweeper(interval: float = STOCK_RESERVATION_SWEEP_INTERVAL):
+    """Call ``sweep_expired`` every ``interval`` seconds, off the event loop"""
+    while True:
+        try:
+            released = await asyncio.to_thread(sweep_expired)
+            if released:
+                logger.info(f"Released the stock of {released} unpaid orders")
+        except Exception as e:
+            logger.error(f"Stock reservation sweep failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,111 @@
+"""
+Content-addressed storage for uploaded files.
+
+Uploads are streamed to a temporary file in fixed-size chunks with async file
+I/O, hashed on the way and then moved to ``<UPLOAD_FOLDER>/ab/cd/<sha256><ext>``.
+The same image uploaded again (e.g. by a repeated bot import) maps to the same
+path, so it is stored once and the existing file is reused. The size limit is
+checked per chunk, so an oversized upload is rejected without being read to
+the end. Remote images (imports, Telegram) are downloaded the same way with
+``store_remote``.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from typing import AsyncIterator, Optional
+
+import aiofiles
+import aiofiles.os
+import httpx
+from fastapi import UploadFile
+
+UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", "uploads")
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "15"))
+UPLOAD_URL_PREFIX = "/uploads"
+CHUNK_SIZE = 64 * 1024
+
+DEFAULT_EXTENSION = ".jpg"
+_EXTENSION_PATTERN = re.compile(r"\.[a-z0-9]{1,10}")
+
+
+class UploadTooLarge(ValueError):
+    """Upload exceeded the configured size limit"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds the maximum size of {max_size} bytes")
+        self.max_size = max_size
+
+
+def file_extension(filename: Optional[str]) -> str:
+    """Lower-cased extension of ``filename``, or the default for odd or missing ones"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if _EXTENSION_PATTERN.fullmatch(extension) else DEFAULT_EXTENSION
+
+
+def content_path(digest: str, extension: str) -> str:
+    """Path of a stored file relative to UPLOAD_FOLDER (two levels of 256-way sharding)"""
+    return os.path.join(digest[:2], digest[2:4], digest + extension)
+
+
+async def store_stream(
+    chunks: AsyncIterator[bytes],
+    extension: str = DEFAULT_EXTENSION,
+    max_size: int = MAX_FILE_SIZE,
+    upload_folder: str = UPLOAD_FOLDER,
+) -> str:
+    """Store ``chunks`` under their content hash and return the file's URL"""
+    await aiofiles.os.makedirs(upload_folder, exist_ok=True)
+    # Same filesystem as the destination, so the final move is an atomic rename
+    temp_path = os.path.join(upload_folder, f".upload-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        async with aiofiles.open(temp_path, "wb") as out:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge(max_size)
+                digest.update(chunk)
+                await out.write(chunk)
+
+        relative_path = content_path(digest.hexdigest(), extension)
+        final_path = os.path.join(upload_folder, relative_path)
+        if await aiofiles.os.path.exists(final_path):
+            await aiofiles.os.remove(temp_path)
+        else:
+            await aiofiles.os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            # Concurrent uploads of the same content write identical bytes; last rename wins
+            await aiofiles.os.replace(temp_path, final_path)
+    except BaseException:
+        if await aiofiles.os.path.exists(temp_path):
+            await aiofiles.os.remove(temp_path)
+        raise
+
+    return f"{UPLOAD_URL_PREFIX}/{relative_path.replace(os.sep, '/')}"
+
+
+async def _read_chunks(file: UploadFile, chunk_size: int) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def store_upload(file: UploadFile, max_size: int = MAX_FILE_SIZE) -> str:
+    """Stream an UploadFile into the content-addressed store and return its URL"""
+    return await store_stream(_read_chunks(file, CHUNK_SIZE), file_extension(file.filename), max_size)
+
+
+async def store_remote(url: str, max_size: int = MAX_FILE_SIZE, timeout: float = IMAGE_DOWNLOAD_TIMEOUT) -> str:
+    """Download ``url`` into the content-addressed store and return the local URL"""
+    async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            return await store_stream(
+                response.aiter_bytes(CHUNK_SIZE), file_extension(httpx.URL(url).path), max_size
+            )
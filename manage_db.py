@@ -17,6 +17,10 @@ sys.path.append(str(project_root))
 
 from app.database import engine, SessionLocal
 from app.models import Base, User, Product, Category, Banner
+from app.migrations import upgrade_database
+from app.utils.catalog_stats import rebuild as rebuild_catalog_stats, read_stats
+from app.utils.guest_carts import purge_abandoned as purge_abandoned_guest_carts
+from app.utils.stock_reservations import sweep_expired as release_expired_reservations
 from app.database.seeders.admin_user import seed_admin_user
 from app.database.seeders.sample_products import run_all_seeders
 
@@ -33,18 +37,11 @@ class DatabaseManager:
         print("🚀 Initializing iShop database...")
         
         try:
-            # Create all tables
-            print("📋 Creating database tables...")
-            Base.metadata.create_all(bind=self.engine)
+            # Apply Alembic migrations
+            print("📋 Applying database migrations...")
+            upgrade_database()
             
-            # Run initial migration if exists
-            migration_path = project_root / "app" / "database" / "migrations" / "001_initial_schema.py"
-            if migration_path.exists():
-                print("🔄 Running initial migration...")
-                from app.database.migrations.initial_schema import upgrade
-                upgrade()
-            
-            print("✅ Database tables created successfully")
+            print("✅ Database schema is up to date")
             
             # Create admin user
             print("👤 Creating admin user...")
@@ -75,6 +72,10 @@ class DatabaseManager:
         try:
             # Drop all tables
             Base.metadata.drop_all(bind=self.engine)
+            with self.engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
+                if self.engine.dialect.name == "sqlite":
+                    conn.execute(text("DROP TABLE IF EXISTS products_fts"))
             print("🧹 All tables dropped")
             
             # Recreate database
@@ -183,6 +184,51 @@ class DatabaseManager:
         else:
             print("Available seeders: admin, products, all")
     
+    def rebuild_stats(self):
+        """Recompute the catalog_stats summary table from the products table"""
+        db: Session = SessionLocal()
+        
+        try:
+            rebuild_catalog_stats(db)
+            stats = read_stats(db)
+            print(f"✅ Catalog stats rebuilt: {stats['total_products']} products, "
+                  f"{len(stats['categories'])} categories")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error rebuilding catalog stats: {str(e)}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+    
+    def release_reservations(self):
+        """Cancel orders left unpaid past their stock reservation deadline"""
+        try:
+            released = release_expired_reservations()
+            print(f"✅ Released the stock of {released} unpaid orders")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error releasing stock reservations: {str(e)}")
+            return False
+    
+    def purge_guest_carts(self):
+        """Delete the saved lines of guest carts abandoned for GUEST_CART_TTL seconds"""
+        db: Session = SessionLocal()
+        
+        try:
+            purged = purge_abandoned_guest_carts(db)
+            print(f"✅ Purged {purged} abandoned guest cart lines")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error purging guest carts: {str(e)}")
+            db.rollback()
+            return False
+        finally:
+            db.close()
+    
     def create_admin_user(self, username, email, password):
         """Create a new admin user"""
         from app.auth import get_password_hash
@@ -255,6 +301,15 @@ def main():
     seed_parser.add_argument('seeder', choices=['admin', 'products', 'all'],
                            help='Seeder to run')
     
+    # Rebuild catalog stats command
+    subparsers.add_parser('rebuild-stats', help='Recompute dashboard product counters')
+    
+    # Release expired stock reservations command
+    subparsers.add_parser('release-reservations', help='Cancel unpaid orders past their reservation deadline')
+    
+    # Purge abandoned guest carts command
+    subparsers.add_parser('purge-guest-carts', help='Delete guest carts untouched for GUEST_CART_TTL seconds')
+    
     # Create admin command
     admin_parser = subparsers.add_parser('create-admin', help='Create admin user')
     admin_parser.add_argument('username', help='Admin username')
@@ -290,6 +345,15 @@ def main():
     elif args.command == 'seed':
         db_manager.seed_data(args.seeder)
     
+    elif args.command == 'rebuild-stats':
+        db_manager.rebuild_stats()
+    
+    elif args.command == 'release-reservations':
+        db_manager.release_reservations()
+    
+    elif args.command == 'purge-guest-carts':
+        db_manager.purge_guest_carts()
+    
     elif args.command == 'create-admin':
         db_manager.create_admin_user(args.username, args.email, args.password)
 
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Product Search Benchmark for iShop
+Compares the old ILIKE '%q%' scan, the database full-text index and the
+in-process index (SEARCH_BACKEND=memory) on a generated catalog (100k products
+by default).
+
+Usage:
+    python scripts/benchmark_search.py [--products 100000] [--runs 20]
+
+Without DATABASE_URL a throwaway SQLite database is used; set DATABASE_URL to a
+scratch PostgreSQL database to benchmark the tsvector backend instead.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+if not os.getenv("DATABASE_URL"):
+    _tmp_dir = tempfile.mkdtemp(prefix="ishop-search-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, or_
+
+from app.database import SessionLocal, get_engine
+from app.migrations import upgrade_database
+from app.models import Product as ProductModel
+from app.utils.product_search import apply_text_search
+from app.utils.search_index import ProductSearchIndex
+
+ADJECTIVES = ["چرمی", "مشکی", "سفید", "زنانه", "مردانه", "اسپرت", "کلاسیک", "ضدآب", "طبی", "بچگانه"]
+NOUNS = ["کیف", "کفش", "ساعت", "کمربند", "کلاه", "عینک", "دستکش", "شال", "پیراهن", "کوله"]
+CATEGORIES = ["کیف", "کفش", "اکسسوری", "پوشاک", "ساعت"]
+# Arabic keyboard variants that users (and imports) produce
+VARIANTS = [("ی", "ي"), ("ک", "ك")]
+
+QUERIES = ["كيف چرمي", "کفش اسپرت", "ساعت ۱۲", "عینک", "کوله بچگانه", "شال زنانه مشکی"]
+
+
+def make_name(i: int) -> str:
+    name = f"{random.choice(NOUNS)} {random.choice(ADJECTIVES)} مدل {i % 500}"
+    if i % 3 == 0:
+        for persian, arabic in VARIANTS:
+            name = name.replace(persian, arabic)
+    return name
+
+
+def seed_products(count: int, batch_size: int = 5000):
+    """Insert ``count`` generated products through the normal engine (index triggers included)"""
+    engine = get_engine()
+    started = time.perf_counter()
+    for start in range(0, count, batch_size):
+        rows = [
+            {
+                "name": make_name(i),
+                "description": f"{random.choice(ADJECTIVES)} و {random.choice(ADJECTIVES)}، مناسب استفاده روزانه",
+                "category": random.choice(CATEGORIES),
+                "price": random.randint(10, 5000) * 1000,
+                "currency": "IRT",
+                "slug": f"product-{i}",
+                "stock": random.randint(0, 50),
+                "is_active": i % 10 != 0,
+            }
+            for i in range(start, min(start + batch_size, count))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(ProductModel), rows)
+    return time.perf_counter() - started
+
+
+def ilike_search(db, q):
+    term = f"%{q}%"
+    return (
+        db.query(ProductModel)
+        .filter(ProductModel.is_active == True)
+        .filter(or_(ProductModel.name.ilike(term), ProductModel.description.ilike(term), ProductModel.category.ilike(term)))
+        .order_by(ProductModel.created_at.desc())
+        .limit(20)
+        .all()
+    )
+
+
+def fts_search(db, q):
+    query = db.query(ProductModel).filter(ProductModel.is_active == True)
+    query, relevance = apply_text_search(query, q, db.get_bind().dialect.name)
+    if relevance is not None:
+        query = query.order_by(relevance, ProductModel.created_at.desc())
+    return query.limit(20).all()
+
+
+def memory_search(index):
+    def search(db, q):
+        products, _ = index.search(q, 0, 20)
+        return products
+    return search
+
+
+def measure(search, runs):
+    timings = []
+    hits = 0
+    db = SessionLocal()
+    try:
+        for _ in range(runs):
+            for q in QUERIES:
+                started = time.perf_counter()
+                hits += len(search(db, q))
+                timings.append((time.perf_counter() - started) * 1000)
+                db.expunge_all()
+    finally:
+        db.close()
+    timings.sort()
+    return {
+        "mean": statistics.mean(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "hits": hits / runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="iShop product search benchmark")
+    parser.add_argument("--products", type=int, default=100_000, help="Number of products to generate")
+    parser.add_argument("--runs", type=int, default=20, help="Repetitions of the query set")
+    args = parser.parse_args()
+
+    random.seed(42)
+    print("=== PRODUCT SEARCH BENCHMARK ===")
+    print(f"Database: {get_engine().url.render_as_string(hide_password=True)}")
+
+    upgrade_database()
+    seconds = seed_products(args.products)
+    print(f"Seeded {args.products} products in {seconds:.1f}s (including index maintenance)")
+
+    index = ProductSearchIndex()
+    db = SessionLocal()
+    started = time.perf_counter()
+    index.load(db)
+    db.close()
+    print(f"Loaded in-memory index in {time.perf_counter() - started:.1f}s")
+
+    searches = [("ILIKE scan", ilike_search), ("Full-text", fts_search), ("In-memory", memory_search(index))]
+    for label, search in searches:
+        result = measure(search, args.runs)
+        print(
+            f"{label:<12} mean {result['mean']:8.2f}ms  p50 {result['p50']:8.2f}ms  "
+            f"p95 {result['p95']:8.2f}ms  rows/query-set {result['hits']:.0f}"
+        )
+
+    get_engine().dispose()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Cart Query Checker for iShop
+Fills one user's cart with a growing number of products and verifies that
+GET /api/v1/cart costs the same number of SQL statements whatever the cart
+size (read from the Server-Timing header of the query profiler), and that
+its totals match the lines.
+
+Runs against a throwaway SQLite database; exits non-zero on any problem.
+"""
+
+import os
+import re
+import sys
+import tempfile
+from datetime import timedelta
+
+# Point the app at a fresh database before any app module reads DATABASE_URL
+_tmp_dir = tempfile.mkdtemp(prefix="ishop-cart-queries-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'check.db')}"
+os.environ["SQL_PROFILING"] = "true"
+os.environ["SQL_SERVER_TIMING"] = "true"
+os.environ["STOCK_RESERVATION_SWEEP_INTERVAL"] = "0"
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, insert
+
+from app.auth import create_access_token
+from app.database import get_engine
+from app.main import app
+from app.migrations import upgrade_database
+from app.models import CartItem, Product as ProductModel, User
+
+CART_SIZES = [0, 1, 10, 100, 250]
+_QUERY_COUNT = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def seed(products: int) -> int:
+    """``products`` products and one user; returns the user id"""
+    with get_engine().begin() as conn:
+        conn.execute(insert(ProductModel), [
+            {"name": f"محصول {i}", "slug": f"product-{i}", "price": (i + 1) * 1000, "stock": 100}
+            for i in range(products)
+        ])
+        return conn.execute(
+            insert(User).values(
+                username="shopper", first_name="a", last_name="b", email="shopper@example.com",
+                password_hash="-", role="user"
+            ).returning(User.id)
+        ).scalar()
+
+
+def fill_cart(user_id: int, size: int):
+    with get_engine().begin() as conn:
+        conn.execute(delete(CartItem).where(CartItem.user_id == user_id))
+        if size:
+            conn.execute(insert(CartItem), [
+                {"user_id": user_id, "product_id": product_id, "quantity": product_id % 3 + 1}
+                for product_id in range(1, size + 1)
+            ])
+
+
+if __name__ == "__main__":
+    upgrade_database()
+    user_id = seed(max(CART_SIZES))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'shopper'}, timedelta(hours=1))}"}
+
+    problems = []
+    counts = {}
+    # As a context manager, so the shutdown hooks close the asyncio connections
+    with TestClient(app) as client:
+        for size in CART_SIZES:
+            fill_cart(user_id, size)
+            response = client.get("/api/v1/cart", headers=headers)
+            match = _QUERY_COUNT.search(response.headers.get("server-timing", ""))
+            if response.status_code != 200 or not match:
+                problems.append(f"cart of {size}: HTTP {response.status_code}, no query count")
+                continue
+            counts[size] = int(match.group(1))
+            cart = response.json()
+            lines = cart["items"]
+            if (
+                len(lines) != size
+                or cart["total_quantity"] != sum(line["quantity"] for line in lines)
+                or cart["total_amount"] != sum(line["product_price"] * line["quantity"] for line in lines)
+                or any(line["total_price"] != line["product_price"] * line["quantity"] for line in lines)
+            ):
+                problems.append(f"cart of {size}: totals don't match its lines")
+            print(f"cart of {size:>4} lines: {counts[size]} queries, total {cart['total_amount']}")
+
+    if len(set(counts.values())) > 1:
+        problems.append(f"query count grows with the cart: {counts}")
+
+    get_engine().dispose()
+    if problems:
+        for problem in problems:
+            print(f"ERROR: {problem}")
+        sys.exit(1)
+    print("Cart query count is constant")
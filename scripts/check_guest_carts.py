@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Guest Cart Checker for iShop
+Builds a guest cart without logging in and verifies that doing so writes
+nothing to cart_items until the write-behind flush, that the flushed cart is
+reloaded when the store loses it, and that logging in merges it into the
+user's cart with one upsert and one DELETE.
+
+Runs against a throwaway SQLite database; exits non-zero on any problem.
+"""
+
+import os
+import sys
+import tempfile
+
+# Point the app at a fresh database before any app module reads DATABASE_URL
+_tmp_dir = tempfile.mkdtemp(prefix="ishop-guest-carts-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'check.db')}"
+os.environ["STOCK_RESERVATION_SWEEP_INTERVAL"] = "0"
+# Flushed explicitly below
+os.environ["GUEST_CART_FLUSH_INTERVAL"] = "0"
+os.environ["GUEST_CART_STORE"] = "memory"
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert, select
+
+from app.auth import get_password_hash
+from app.database import SessionLocal, get_engine
+from app.main import app
+from app.migrations import upgrade_database
+from app.models import CartItem, Product as ProductModel, User
+from app.utils.guest_carts import GUEST_CART_COOKIE, flush_guest_carts, guest_cart_store
+
+PRODUCTS = 50
+
+cart_writes = []
+
+
+@event.listens_for(get_engine(), "before_cursor_execute")
+def count_cart_writes(conn, cursor, statement, parameters, context, executemany):
+    if statement.lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE")) and "cart_items" in statement:
+        cart_writes.append(statement.split()[0].upper())
+
+
+def seed():
+    with get_engine().begin() as conn:
+        conn.execute(insert(ProductModel), [
+            {"name": f"محصول {i}", "slug": f"product-{i}", "price": (i + 1) * 1000, "stock": 100}
+            for i in range(PRODUCTS)
+        ])
+        user_id = conn.execute(
+            insert(User).values(
+                username="shopper", first_name="a", last_name="b", email="shopper@example.com",
+                password_hash=get_password_hash("secret"), role="user"
+            ).returning(User.id)
+        ).scalar()
+        # Already in the user's cart: the merge adds to it
+        conn.execute(insert(CartItem).values(user_id=user_id, product_id=1, quantity=1))
+    return user_id
+
+
+def cart_rows(**owner):
+    db = SessionLocal()
+    try:
+        column, value = next(iter(owner.items()))
+        return dict(db.execute(
+            select(CartItem.product_id, CartItem.quantity).where(getattr(CartItem, column) == value)
+        ).all())
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    upgrade_database()
+    user_id = seed()
+    cart_writes.clear()
+
+    problems = []
+    with TestClient(app) as client:
+        for product_id in range(1, PRODUCTS + 1):
+            client.post("/api/v1/cart/add", json={"product_id": product_id, "quantity": 2})
+        client.put("/api/v1/cart/update/2", json={"quantity": 5})
+        client.delete(f"/api/v1/cart/remove/{PRODUCTS}")
+        cart = client.get("/api/v1/cart").json()
+        print(f"guest cart: {len(cart['items'])} lines, {cart['total_quantity']} units")
+        if len(cart["items"]) != PRODUCTS - 1 or cart["total_quantity"] != 2 * (PRODUCTS - 2) + 5:
+            problems.append("the guest cart doesn't hold what was added")
+        if cart_writes:
+            problems.append(f"building the guest cart wrote to cart_items: {cart_writes}")
+        print(f"cart_items writes before the flush: {len(cart_writes)}")
+
+        guest_id = client.cookies[GUEST_CART_COOKIE].split(".")[0]
+        flush_guest_carts()
+        print(f"cart_items writes by the flush: {cart_writes}")
+        if len(cart_rows(guest_id=guest_id)) != PRODUCTS - 1:
+            problems.append("the flush didn't write the guest cart")
+
+        # As after a restart: the cart comes back from cart_items
+        guest_cart_store.discard(guest_id)
+        if client.get("/api/v1/cart/count").json()["count"] != cart["total_quantity"]:
+            problems.append("the guest cart wasn't reloaded from cart_items")
+
+        cart_writes.clear()
+        response = client.post("/api/v1/auth/login", data={"username": "shopper", "password": "secret"})
+        print(f"login: HTTP {response.status_code}, merge writes: {cart_writes}")
+        if response.status_code != 200 or cart_writes != ["INSERT", "DELETE"]:
+            problems.append("merging the guest cart took more than one upsert and one DELETE")
+        merged = cart_rows(user_id=user_id)
+        if len(merged) != PRODUCTS - 1 or merged[1] != 3 or merged[2] != 5:
+            problems.append(f"the merged cart is wrong: {merged}")
+        if cart_rows(guest_id=guest_id) or GUEST_CART_COOKIE in client.cookies:
+            problems.append("the guest cart outlived the login")
+
+    get_engine().dispose()
+    if problems:
+        for problem in problems:
+            print(f"ERROR: {problem}")
+        sys.exit(1)
+    print("Guest carts stay off the database until flushed")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Migration Checker for iShop
+Verifies that the Alembic revisions alone produce the schema declared in
+app/models.py, and that importing app.main no longer creates tables.
+
+Runs against a throwaway SQLite database; exits non-zero on any problem.
+"""
+
+import os
+import sys
+import tempfile
+
+# Point the app at a fresh database before any app module reads DATABASE_URL
+_tmp_dir = tempfile.mkdtemp(prefix="ishop-migrations-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'check.db')}"
+os.environ["DB_AUTO_MIGRATE"] = "false"
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import inspect
+
+from app.database import Base, get_engine
+from app.migrations import (
+    alembic_config,
+    check_schema_current,
+    include_object,
+    pending_revisions,
+    upgrade_database,
+)
+
+
+def check_import_creates_nothing():
+    """app.main must not touch the schema at import time"""
+    import app.main  # noqa: F401
+
+    tables = inspect(get_engine()).get_table_names()
+    if tables:
+        print(f"ERROR: importing app.main created tables: {tables}")
+        return False
+    print("app.main import leaves the database untouched")
+    return True
+
+
+def check_startup_refuses_unmigrated():
+    """The startup check must reject a database that has not been migrated"""
+    try:
+        check_schema_current()
+    except RuntimeError as e:
+        print(f"Startup check rejects unmigrated database: {e}")
+        return True
+    print("ERROR: startup check accepted an unmigrated database")
+    return False
+
+
+def check_models_match_migrations():
+    """Upgrade to head and diff the result against Base.metadata"""
+    upgrade_database()
+
+    if pending_revisions():
+        print("ERROR: revisions still pending after upgrade")
+        return False
+
+    with get_engine().connect() as connection:
+        context = MigrationContext.configure(connection, opts={"include_object": include_object})
+        diff = compare_metadata(context, Base.metadata)
+
+    if diff:
+        print("ERROR: models and migrations differ:")
+        for change in diff:
+            print(f"   - {change}")
+        return False
+
+    check_schema_current()
+    print("Migrations produce the schema declared in app/models.py")
+    return True
+
+
+def check_round_trip():
+    """Downgrade to base and back up again"""
+    config = alembic_config()
+    command.downgrade(config, "base")
+    command.upgrade(config, "head")
+    print("Downgrade/upgrade round trip succeeded")
+    return True
+
+
+if __name__ == "__main__":
+    print("=== MIGRATION CHECKER ===")
+
+    ok = (
+        check_import_creates_nothing()
+        and check_startup_refuses_unmigrated()
+        and check_models_match_migrations()
+        and check_round_trip()
+    )
+
+    get_engine().dispose()
+    sys.exit(0 if ok else 1)
@@ -239,7 +239,8 @@ Group=www-data
 WorkingDirectory=/var/www/ishop
 Environment=PATH=/var/www/ishop/venv/bin
 EnvironmentFile=/var/www/ishop/.env.production.local
-ExecStart=/var/www/ishop/venv/bin/uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers 4
+Environment=WEB_CONCURRENCY=4
+ExecStart=/var/www/ishop/venv/bin/uvicorn app.main:app --host 0.0.0.0 --port 8000
 Restart=always
 RestartSec=3
 
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Stock Reservation Stress Test for iShop
+Sends hundreds of concurrent POST /api/v1/orders requests for the last units
+of one product and checks that no more units were sold than were in stock,
+that catalog_stats still matches a rebuild, and that the expiry sweep returns
+every unpaid unit.
+
+Usage:
+    python scripts/stress_stock_reservations.py [--clients 300] [--stock 10] [--quantity 1]
+
+Without DATABASE_URL a throwaway SQLite database is used; set DATABASE_URL to a
+scratch PostgreSQL database to race real concurrent transactions instead.
+Exits non-zero if stock was oversold.
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if not os.getenv("DATABASE_URL"):
+    _tmp_dir = tempfile.mkdtemp(prefix="ishop-stock-stress-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'stress.db')}"
+# The sweep is run explicitly below
+os.environ.setdefault("STOCK_RESERVATION_SWEEP_INTERVAL", "0")
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import func, insert, select
+
+from app.auth import create_access_token
+from app.database import SessionLocal, dispose_async_engines, get_engine
+from app.main import app
+from app.migrations import upgrade_database
+from app.models import Order, OrderItem, Product as ProductModel, User
+from app.utils.catalog_stats import read_stats, rebuild
+from app.utils.stock_reservations import release_expired
+
+
+def seed(clients: int, stock: int) -> int:
+    """One product with ``stock`` units and ``clients`` users; returns the product id"""
+    engine = get_engine()
+    with engine.begin() as conn:
+        product_id = conn.execute(
+            insert(ProductModel).values(
+                name="آخرین موجودی", slug="last-units", price=1_000_000, currency="IRT",
+                category="تست", stock=stock, is_active=True
+            ).returning(ProductModel.id)
+        ).scalar()
+        conn.execute(insert(User), [
+            {
+                "username": f"buyer{i}", "first_name": "خریدار", "last_name": str(i),
+                "email": f"buyer{i}@example.com", "password_hash": "-", "role": "user",
+            }
+            for i in range(clients)
+        ])
+    db = SessionLocal()
+    try:
+        rebuild(db)
+    finally:
+        db.close()
+    return product_id
+
+
+async def buy(client: httpx.AsyncClient, start: asyncio.Event, user: int, product_id: int, quantity: int) -> int:
+    token = create_access_token({"sub": f"buyer{user}"}, timedelta(hours=1))
+    await start.wait()
+    response = await client.post(
+        "/api/v1/orders/",
+        json={
+            "items": [{"product_id": product_id, "quantity": quantity}],
+            "customer_name": f"خریدار {user}",
+            "customer_email": f"buyer{user}@example.com",
+            "shipping_address": "تهران",
+            "payment_method": "online",
+        },
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    return response.status_code
+
+
+async def race(clients: int, product_id: int, quantity: int):
+    start = asyncio.Event()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+        tasks = [asyncio.create_task(buy(client, start, user, product_id, quantity)) for user in range(clients)]
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        start.set()
+        statuses = await asyncio.gather(*tasks)
+    # Close the asyncio connections before the event loop goes away
+    await dispose_async_engines()
+    return collections.Counter(statuses), time.perf_counter() - started
+
+
+def stock_state(product_id: int):
+    db = SessionLocal()
+    try:
+        stock = db.execute(select(ProductModel.stock).where(ProductModel.id == product_id)).scalar()
+        sold = db.execute(
+            select(func.coalesce(func.sum(OrderItem.quantity), 0))
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(OrderItem.product_id == product_id, Order.holds_stock == True)
+        ).scalar()
+        stats = read_stats(db)
+        rebuild(db)
+        stats_match = stats == read_stats(db)
+        return stock, sold, stats_match
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="iShop stock reservation stress test")
+    parser.add_argument("--clients", type=int, default=300, help="Concurrent buyers")
+    parser.add_argument("--stock", type=int, default=10, help="Units in stock")
+    parser.add_argument("--quantity", type=int, default=1, help="Units per order")
+    args = parser.parse_args()
+
+    print("=== STOCK RESERVATION STRESS TEST ===")
+    print(f"Database: {get_engine().url.render_as_string(hide_password=True)}")
+
+    upgrade_database()
+    product_id = seed(args.clients, args.stock)
+
+    statuses, seconds = asyncio.run(race(args.clients, product_id, args.quantity))
+    stock, sold, stats_match = stock_state(product_id)
+    expected_orders = args.stock // args.quantity
+    print(f"{args.clients} buyers x {args.quantity} unit(s) for {args.stock} in stock, in {seconds:.2f}s")
+    print(f"Responses: {dict(sorted(statuses.items()))}")
+    print(f"Units sold: {sold}  stock left: {stock}  catalog_stats consistent: {stats_match}")
+
+    db = SessionLocal()
+    try:
+        released = release_expired(db, now=datetime.utcnow() + timedelta(days=1), limit=args.clients)
+    finally:
+        db.close()
+    stock_after_expiry, held_after_expiry, stats_match_after_expiry = stock_state(product_id)
+    print(
+        f"Expiry sweep cancelled {released} orders; stock back to {stock_after_expiry}, "
+        f"catalog_stats consistent: {stats_match_after_expiry}"
+    )
+
+    failures = []
+    if sold + stock != args.stock or stock < 0:
+        failures.append("units sold plus stock left don't add up to the initial stock")
+    if statuses.get(200, 0) != expected_orders or sold != expected_orders * args.quantity:
+        failures.append(f"expected exactly {expected_orders} successful orders")
+    if not stats_match or not stats_match_after_expiry:
+        failures.append("catalog_stats drifted from the products table")
+    if stock_after_expiry != args.stock or held_after_expiry != 0:
+        failures.append("the expiry sweep didn't return every unpaid unit")
+
+    get_engine().dispose()
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("OK: no oversell")
@@ -62,11 +62,7 @@ sudo -u $APP_USER npm run build
 
 # Step 6: Run database migrations (if any)
 print_status "Running database migrations..."
-if [ -f "migrations.py" ]; then
-    sudo -u $APP_USER ./venv/bin/python migrations.py
-else
-    print_warning "No migration script found, skipping..."
-fi
+sudo -u $APP_USER ./venv/bin/python -m app.migrations
 
 # Step 7: Update file permissions
 print_status "Updating file permissions..."